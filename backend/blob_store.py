@@ -0,0 +1,140 @@
+# backend/blob_store.py
+
+"""
+Compressed blob store for large per-call artifacts (Whisper segments, raw GPT
+output, full speech history).
+
+Blobs live outside the session document so Firebase writes and GET /session
+polls only carry a small reference:
+
+    {"blob": "<session_id>/<call_sid>/<name>", "bytes": 1234, "raw_bytes": 9876}
+
+Artifacts of the whole session rather than one call (the speech log every
+branch call appends to) use SESSION_BLOB in place of the call SID.
+
+Blobs are zlib-compressed JSON under XDIAL_BLOB_DIR and are loaded lazily.
+Append-only lists (the speech history) are JSON lines instead, so adding an
+item writes one line rather than recompressing the whole list. Every function
+here does blocking file I/O: async handlers call them through run_io.
+"""
+
+import os
+import json
+import zlib
+import logging
+import threading
+from collections import OrderedDict
+from session_model import Segments
+
+
+XDIAL_BLOB_DIR = os.getenv("XDIAL_BLOB_DIR", "blobs")
+BLOB_CACHE_ENTRIES = int(os.getenv("BLOB_CACHE_ENTRIES", "64"))
+SESSION_BLOB = "session"
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _safe(part) -> str:
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in str(part or "unknown"))
+
+
+def _blob_key(session_id: str, call_sid: str, name: str) -> str:
+    return f"{_safe(session_id)}/{_safe(call_sid)}/{_safe(name)}"
+
+
+def _blob_path(key: str) -> str:
+    return os.path.join(XDIAL_BLOB_DIR, *key.split("/")) + ".json.z"
+
+
+def _lines_path(key: str) -> str:
+    return os.path.join(XDIAL_BLOB_DIR, *key.split("/")) + ".jsonl"
+
+
+def _remember(key: str, data):
+    with _cache_lock:
+        _cache[key] = data
+        _cache.move_to_end(key)
+        while len(_cache) > BLOB_CACHE_ENTRIES:
+            _cache.popitem(last=False)
+
+
+def put_blob(session_id: str, call_sid: str, name: str, data) -> dict:
+    """Compress and store `data`; returns the reference to keep in the session."""
+    key = _blob_key(session_id, call_sid, name)
+    raw = json.dumps(data, separators=(",", ":")).encode("utf-8")
+    packed = zlib.compress(raw, 6)
+
+    path = _blob_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(packed)
+    os.replace(tmp_path, path)
+
+    _remember(key, data)
+    logging.info(f"[BLOB STORED] {key} ({len(raw)} → {len(packed)} bytes)")
+    return {"blob": key, "bytes": len(packed), "raw_bytes": len(raw)}
+
+
+def get_blob(ref, default=None):
+    """Load a blob by reference dict (or key); cached in memory after first read."""
+    if not ref:
+        return default
+    key = ref["blob"] if isinstance(ref, dict) else ref
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    try:
+        if os.path.exists(_lines_path(key)):
+            with open(_lines_path(key), "r", encoding="utf-8") as f:
+                data = [json.loads(line) for line in f if line.strip()]
+        else:
+            with open(_blob_path(key), "rb") as f:
+                data = json.loads(zlib.decompress(f.read()))
+    except FileNotFoundError:
+        logging.warning(f"[BLOB MISSING] {key}")
+        return default
+    _remember(key, data)
+    return data
+
+
+def append_blob(session_id: str, call_sid: str, name: str, item) -> dict:
+    """Append one item to a list blob (e.g. the full speech history) and return its reference."""
+    key = _blob_key(session_id, call_sid, name)
+    path = _lines_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lines = []
+    if os.path.exists(_blob_path(key)):
+        # A list stored by put_blob before: carry it over once, then only append
+        with open(_blob_path(key), "rb") as f:
+            lines = [json.dumps(old, separators=(",", ":")) + "\n" for old in json.loads(zlib.decompress(f.read()))]
+    lines.append(json.dumps(item, separators=(",", ":")) + "\n")
+    with open(path, "a", encoding="utf-8") as f:
+        f.writelines(lines)
+        size = f.tell()
+    if len(lines) > 1:
+        os.remove(_blob_path(key))
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            cached.append(item)
+    return {"blob": key, "bytes": size, "format": "jsonl"}
+
+
+def summarize_segments(segments) -> dict:
+    """Compact stand-in for a Whisper segment list kept inline in the session."""
+    segments = Segments.coerce(segments)
+    return {
+        "count": len(segments),
+        "duration": round(segments.end[-1], 2) if len(segments) else 0,
+        "chars": sum(len(text) for text in segments.text),
+    }
+
+
+def load_transcript_text(session: dict) -> str:
+    """Full Whisper transcript for a session, loading the offloaded segments on demand."""
+    # Older sessions still carry their segments inline
+    segments = session.get("whisper_segments") or get_blob(session.get("whisper_segments_ref"))
+    return Segments.coerce(segments).joined_text()
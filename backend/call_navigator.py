@@ -0,0 +1,112 @@
+# backend/call_navigator.py
+
+"""
+In-call tree navigation.
+
+A branch call pays for the greeting, the route down and a fresh call setup just
+to hear one menu. A navigation call stays connected instead: once it has heard
+a menu it presses the digit of the next branch to explore, and it climbs back up
+with the menu's own "previous menu" / "main menu" options to reach siblings and
+cousins. Each press sequence is played with <Play digits>, the next menu is
+heard with <Gather>, and the call loops through crawler-branch with <Redirect>.
+
+When no way back is known (a leaf, or a menu without back options) the call
+hangs up and the next branch is dialed from the root by a fresh call.
+
+Off by default: prefix replay (one call per branch, replaying the learned route
+and recording only the node) runs branches concurrently within the scheduler's
+limits and records each node with its learned timings. Set CRAWL_IN_CALL=true
+for IVRs with reliable back options, where fewer call setups matter more.
+"""
+
+import os
+import re
+
+from tree import make_key, split_key
+from dial_planner import DIAL_LEVEL_PAUSE, dtmf_route
+
+
+CRAWL_IN_CALL = os.getenv("CRAWL_IN_CALL", "false").lower() == "true"
+NAV_FIRST_PRESS_PAUSE = float(os.getenv("NAV_FIRST_PRESS_PAUSE", "0.5"))  # menu already heard
+NAV_MAX_NODES_PER_CALL = int(os.getenv("NAV_MAX_NODES_PER_CALL", "25"))
+NAV_MAX_PRESSES = 8
+NAV_SCAN_LIMIT = 50
+
+# Checked in order: "return to the main menu" is a main-menu key, not a previous-menu one
+_NAV_OPTIONS = (
+    ("main", re.compile(r"\bmain menu\b|\bstart over\b|\btop menu\b")),
+    ("previous", re.compile(r"\bprevious menu\b|\bprior menu\b|\bgo back\b|\bback to\b|\blast menu\b")),
+    ("repeat", re.compile(r"\brepeat\b|\bhear (?:these |the |this |those )?(?:options|choices|menu) again\b")),
+)
+
+
+def classify_option(label: str):
+    """'9: Return to the main menu' → 'main'; None for an ordinary branch."""
+    text = str(label or "").lower()
+    for kind, pattern in _NAV_OPTIONS:
+        if pattern.search(text):
+            return kind
+    return None
+
+
+def mark_nav_options(phone_tree, key: str, options: dict, on_change=None) -> list:
+    """Flag the navigation options of the menu at `key`; returns the digits worth exploring."""
+    explore = []
+    for digit, label in options.items():
+        kind = classify_option(label)
+        if kind:
+            phone_tree.insert(f"{key}.{digit}", nav=kind, on_change=on_change)
+        else:
+            explore.append(digit)
+    return explore
+
+
+def nav_keys(phone_tree, key: str) -> dict:
+    """{'previous': '*', 'main': '9'} for the menu at `key`."""
+    keys = {}
+    for digit, child in phone_tree.children(key).items():
+        if isinstance(child, dict) and child.get("nav"):
+            keys.setdefault(child["nav"], digit)
+    return keys
+
+
+def plan_move(phone_tree, current: str, target: str):
+    """
+    Presses that take a call sitting in the menu at `current` to the menu at
+    `target`, as {digits, pauses, send_digits}; None if the tree knows no way up.
+    """
+    here, down = split_key(current), split_key(target)
+    presses = []  # (menu the key is pressed in, key)
+    while down[:len(here)] != here:
+        keys = nav_keys(phone_tree, make_key(here))
+        # "previous" is as good as "main" when the parent is already on the target's path
+        if "previous" in keys and (len(here) == 1 or down[:len(here) - 1] == here[:-1] or "main" not in keys):
+            presses.append((make_key(here), keys["previous"]))
+            here = here[:-1]
+        elif "main" in keys:
+            presses.append((make_key(here), keys["main"]))
+            here = []
+        else:
+            return None
+    for digit in down[len(here):]:
+        presses.append((make_key(here), digit))
+        here = here + [digit]
+    if not presses or len(presses) > NAV_MAX_PRESSES:
+        return None
+
+    pauses = [NAV_FIRST_PRESS_PAUSE] + [
+        float((phone_tree.get(menu) or {}).get("pause") or DIAL_LEVEL_PAUSE) for menu, _ in presses[1:]
+    ]
+    return dtmf_route([digit for _, digit in presses], pauses)
+
+
+def pick_target(phone_tree, frontier: list, current: str):
+    """Cheapest (target, plan) reachable from `current`, preferring earlier frontier keys on ties."""
+    best = None
+    for target in frontier[:NAV_SCAN_LIMIT]:
+        plan = plan_move(phone_tree, current, target)
+        if plan and (best is None or len(plan["digits"]) < len(best[1]["digits"])):
+            best = (target, plan)
+            if len(plan["digits"]) == 1:
+                break
+    return best
@@ -0,0 +1,437 @@
+# backend/call_scheduler.py
+
+"""
+Central scheduler for every outbound Twilio call.
+
+All call sites (first discovery call, query injection, direct dials, branch
+crawls, revalidation, retries) submit a dial job here instead of calling
+Twilio themselves. Jobs wait in one priority queue and are started only when
+
+- the Twilio account has a free slot (CALL_ACCOUNT_LIMIT),
+- the destination has fewer than CALL_NUMBER_CONCURRENCY calls in flight, and
+- the destination's token bucket has a token (CALL_NUMBER_RATE calls per
+  minute, bursts of CALL_NUMBER_BURST), so one call center isn't hammered.
+
+Every process keeps its own slots and buckets, so the account limit and the
+rate are split evenly across all processes placing calls: the workers listed in
+XDIAL_WORKERS times the processes each one runs (XDIAL_LOCAL_WORKERS, which
+defaults to WEB_CONCURRENCY — uvicorn's own default for --workers). The
+per-destination concurrency cap stays per process.
+
+Queue order is lane, then priority, then a weighted fair tag per user
+(fair_queue.FairClock), so one user with fifty crawls doesn't starve the
+next; each user also holds at most DIAL_USER_QUOTA × weight calls at once.
+
+    interactive   a user is waiting on it (default for /start-recon sessions)
+    bulk          background mapping and revalidation
+
+CALL_INTERACTIVE_RESERVE account slots are kept for the interactive lane, so
+an interactive call never waits for bulk calls to hang up.
+
+A slot is freed when the status callback reports the call finished
+(call_finished), or after CALL_TIMEOUT if it never does (a reaper task checks
+every CALL_REAP_INTERVAL while calls are in flight). A finish reported before
+the dial has returned its SID is kept and applied once the SID is known.
+"""
+
+import os
+import time
+import heapq
+import asyncio
+import inspect
+import logging
+import itertools
+from collections import Counter, OrderedDict, deque
+
+import routing
+from fair_queue import FairClock, ANONYMOUS_USER, DIAL_USER_QUOTA, user_quota
+
+
+CALL_ACCOUNT_LIMIT = int(os.getenv("CALL_ACCOUNT_LIMIT", os.getenv("CRAWL_GLOBAL_LIMIT", "10")))
+CALL_INTERACTIVE_RESERVE = int(os.getenv("CALL_INTERACTIVE_RESERVE", "2"))
+CALL_NUMBER_CONCURRENCY = int(os.getenv("CALL_NUMBER_CONCURRENCY", os.getenv("CRAWL_PER_NUMBER_LIMIT", "3")))
+CALL_NUMBER_RATE = float(os.getenv("CALL_NUMBER_RATE", "6"))    # calls per minute per destination
+CALL_NUMBER_BURST = float(os.getenv("CALL_NUMBER_BURST", "3"))
+CALL_TIMEOUT = float(os.getenv("CALL_TIMEOUT", os.getenv("CRAWL_CALL_TIMEOUT", "600")))
+CALL_REAP_INTERVAL = float(os.getenv("CALL_REAP_INTERVAL", "30"))
+XDIAL_LOCAL_WORKERS = int(os.getenv("XDIAL_LOCAL_WORKERS", os.getenv("WEB_CONCURRENCY", "1")))
+CALL_EARLY_FINISHES = 1000
+CALL_WAIT_SAMPLES = 500
+
+LANE_INTERACTIVE = "interactive"
+LANE_BULK = "bulk"
+LANES = (LANE_INTERACTIVE, LANE_BULK)
+
+TERMINAL_CALL_STATUSES = {"completed", "busy", "failed", "no-answer", "canceled"}
+UNANSWERED_CALL_STATUSES = {"busy", "failed", "no-answer"}  # ended without connecting (canceled is deliberate)
+
+
+class DialError(RuntimeError):
+    """A job's call could not be placed (the dial raised or returned no SID)."""
+
+
+def _process_count() -> int:
+    routed = len(routing.workers) if routing.routing_enabled() else 1
+    return max(1, routed * XDIAL_LOCAL_WORKERS)
+
+
+def _account_share() -> int:
+    return max(1, CALL_ACCOUNT_LIMIT // _process_count())
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, per_minute: float, burst: float, now: float):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= 1
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def wait(self, now: float) -> float:
+        """Seconds until the next token."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate if self.rate else float("inf")
+
+
+class DialJob:
+    __slots__ = ("session_id", "user_id", "number", "dial", "lane", "priority", "label", "on_done",
+                 "tag", "enqueued", "started", "call_sid", "dialed")
+
+    def __init__(self, session_id, user_id, number, dial, lane, priority, label, on_done, tag, enqueued):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.number = number
+        self.dial = dial
+        self.lane = lane
+        self.priority = priority
+        self.label = label
+        self.on_done = on_done
+        self.tag = tag
+        self.enqueued = enqueued
+        self.started = None
+        self.call_sid = None
+        # Resolves to the call SID (None if cancelled); raises DialError if the dial failed
+        self.dialed = asyncio.get_running_loop().create_future()
+
+    def sort_key(self):
+        return (LANES.index(self.lane), -self.priority, self.tag)
+
+
+class CallScheduler:
+    def __init__(self, account_limit: int = None, interactive_reserve: int = CALL_INTERACTIVE_RESERVE,
+                 number_concurrency: int = CALL_NUMBER_CONCURRENCY, number_rate: float = None,
+                 number_burst: float = None, call_timeout: float = CALL_TIMEOUT,
+                 user_quota_base: int = DIAL_USER_QUOTA, reap_interval: float = CALL_REAP_INTERVAL,
+                 clock=time.monotonic):
+        self.account_limit = account_limit or _account_share()
+        self.interactive_reserve = min(interactive_reserve, self.account_limit - 1)
+        self.number_concurrency = number_concurrency
+        self.number_rate = number_rate or CALL_NUMBER_RATE / _process_count()
+        self.number_burst = number_burst or max(1.0, CALL_NUMBER_BURST / _process_count())
+        self.call_timeout = call_timeout
+        self.user_quota_base = user_quota_base
+        self.reap_interval = reap_interval
+        self.clock = clock
+        # Optional hooks: session_id -> lane / user_id (user_of may be async), for jobs submitted without them
+        self.lane_of = None
+        self.user_of = None
+        self._heap = []
+        self._seq = itertools.count()
+        self._fair = FairClock()
+        self._per_user = Counter()
+        self._in_flight = set()
+        self._by_sid = {}
+        self._per_number = Counter()
+        self._buckets = {}
+        self._timer = None
+        self._launches = set()
+        self._reaper = None
+        # call_sid -> when it finished, for status callbacks that beat the dial's return
+        self._early = OrderedDict()
+        self._waits = {lane: deque(maxlen=CALL_WAIT_SAMPLES) for lane in LANES}
+        self._stats = Counter()
+
+    # ── submission ────────────────────────────────────────────────
+
+    async def submit(self, session_id: str, number: str, dial, lane: str = None, priority: int = 0,
+                     label: str = None, on_done=None) -> DialJob:
+        """
+        Queue a dial. `dial()` places the call (sync or async) and returns its SID;
+        `on_done(job)` runs once the call is over, failed or was cancelled.
+        Returns right away, even when the job can start now; await `job.dialed` for the
+        SID (None if cancelled before dialing, DialError if the call couldn't be placed).
+        """
+        lane = lane or (self.lane_of(session_id) if self.lane_of else None) or LANE_INTERACTIVE
+        if lane not in LANES:
+            lane = LANE_INTERACTIVE
+        user_id = self.user_of(session_id) if self.user_of else None
+        if inspect.isawaitable(user_id):
+            user_id = await user_id
+        user_id = user_id or ANONYMOUS_USER
+        job = DialJob(session_id, user_id, number or "", dial, lane, priority, label, on_done,
+                      self._fair.tag(user_id), self.clock())
+        heapq.heappush(self._heap, (job.sort_key(), next(self._seq), job))
+        self._stats[f"submitted_{lane}"] += 1
+        await self.pump()
+        return job
+
+    async def cancel(self, session_id: str, label_prefix: str = None) -> int:
+        """Drop a session's queued jobs (calls already in flight finish normally)."""
+        dropped, kept = [], []
+        for entry in self._heap:
+            job = entry[2]
+            if job.session_id == session_id and (label_prefix is None or (job.label or "").startswith(label_prefix)):
+                dropped.append(job)
+            else:
+                kept.append(entry)
+        self._heap = kept
+        heapq.heapify(self._heap)
+        for job in dropped:
+            self._stats["cancelled"] += 1
+            await self._done(job)
+        return len(dropped)
+
+    def has_jobs(self, session_id: str) -> bool:
+        return any(e[2].session_id == session_id for e in self._heap) or any(
+            j.session_id == session_id for j in self._in_flight
+        )
+
+    def _user_has_jobs(self, user_id: str) -> bool:
+        return self._per_user[user_id] > 0 or any(e[2].user_id == user_id for e in self._heap)
+
+    # ── dispatch ──────────────────────────────────────────────────
+
+    def _bucket(self, number: str, now: float) -> TokenBucket:
+        bucket = self._buckets.get(number)
+        if bucket is None:
+            bucket = self._buckets[number] = TokenBucket(self.number_rate, self.number_burst, now)
+        return bucket
+
+    def _take(self) -> list:
+        """Start as many queued jobs as the limits allow, in queue order."""
+        now = self.clock()
+        taken, skipped, retry_in = [], [], None
+        while self._heap and len(self._in_flight) < self.account_limit:
+            entry = heapq.heappop(self._heap)
+            job = entry[2]
+            if job.lane != LANE_INTERACTIVE and len(self._in_flight) >= self.account_limit - self.interactive_reserve:
+                skipped.append(entry)
+                continue
+            if self._per_user[job.user_id] >= user_quota(self.user_quota_base, job.user_id):
+                skipped.append(entry)
+                self._stats["throttled_user_quota"] += 1
+                continue
+            if job.number and self._per_number[job.number] >= self.number_concurrency:
+                skipped.append(entry)
+                self._stats["throttled_concurrency"] += 1
+                continue
+            bucket = self._bucket(job.number, now) if job.number else None
+            if bucket and not bucket.ready(now):
+                skipped.append(entry)
+                self._stats["throttled_rate"] += 1
+                wait = bucket.wait(now)
+                retry_in = wait if retry_in is None else min(retry_in, wait)
+                continue
+            if bucket:
+                bucket.take(now)
+            job.started = now
+            self._fair.started(job.tag)
+            self._in_flight.add(job)
+            self._per_number[job.number] += 1
+            self._per_user[job.user_id] += 1
+            self._waits[job.lane].append(now - job.enqueued)
+            taken.append(job)
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+        if retry_in is not None:
+            self._schedule_pump(retry_in)
+        return taken
+
+    def _schedule_pump(self, delay: float):
+        # Rate-limited jobs are retried when their bucket refills
+        if self._timer is not None and not self._timer.done():
+            return
+        async def later():
+            await asyncio.sleep(delay)
+            self._timer = None
+            await self.pump()
+        self._timer = asyncio.create_task(later())
+
+    async def pump(self):
+        for job in self._reap():
+            await self._done(job)
+        # Dials run as their own tasks: submit() and call_finished() are called from
+        # webhooks, which must not wait on another call's Twilio round trip (and retries)
+        for job in self._take():
+            task = asyncio.create_task(self._launch(job))
+            self._launches.add(task)
+            task.add_done_callback(self._launches.discard)
+
+    async def _launch(self, job: DialJob):
+        error = None
+        try:
+            call_sid = job.dial()
+            if inspect.isawaitable(call_sid):
+                call_sid = await call_sid
+        except Exception as e:
+            logging.error(f"[SCHEDULER DIAL ERROR] {job.session_id} {job.label}: {e}")
+            call_sid, error = None, e
+        if not call_sid:
+            self._stats["dial_errors"] += 1
+            if not job.dialed.done():
+                job.dialed.set_exception(DialError(f"{job.label or 'call'} for {job.session_id} not placed: {error or 'no call SID'}"))
+                # Mark it retrieved: nobody awaits fire-and-forget jobs, awaiting callers still get the error
+                job.dialed.exception()
+            self._release(job)
+            await self._done(job)
+            await self.pump()
+            return
+        job.call_sid = call_sid
+        self._by_sid[call_sid] = job
+        self._stats["dialed"] += 1
+        if not job.dialed.done():
+            job.dialed.set_result(call_sid)
+        logging.info(
+            f"[SCHEDULER DIAL] {job.lane} {job.label or ''} for {job.session_id} | SID: {call_sid} | "
+            f"in flight: {len(self._in_flight)}/{self.account_limit}, {job.number}: {self._per_number[job.number]}"
+        )
+        if self._early.pop(call_sid, None) is not None:
+            # Its terminal status callback arrived while we were still waiting on Twilio
+            self._stats["finished_early"] += 1
+            await self.call_finished(call_sid)
+        else:
+            self._ensure_reaper()
+
+    def _ensure_reaper(self):
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_loop())
+
+    async def _reap_loop(self):
+        # Lost status callbacks must not hold slots until some unrelated submit() pumps
+        while self._in_flight:
+            await asyncio.sleep(self.reap_interval)
+            await self.pump()
+
+    def _reap(self) -> list:
+        # Free slots whose status callback never arrived
+        now = self.clock()
+        reaped = [j for j in self._in_flight if j.call_sid and now - j.started > self.call_timeout]
+        for job in reaped:
+            logging.warning(f"[SCHEDULER TIMEOUT] {job.label} for {job.session_id} (SID {job.call_sid})")
+            self._stats["timed_out"] += 1
+            self._release(job)
+        return reaped
+
+    def _release(self, job: DialJob):
+        if job not in self._in_flight:
+            return
+        self._in_flight.discard(job)
+        if job.call_sid:
+            self._by_sid.pop(job.call_sid, None)
+        self._per_number[job.number] -= 1
+        if self._per_number[job.number] <= 0:
+            del self._per_number[job.number]
+        self._per_user[job.user_id] -= 1
+        if self._per_user[job.user_id] <= 0:
+            del self._per_user[job.user_id]
+
+    async def _done(self, job: DialJob):
+        if not job.dialed.done():
+            job.dialed.set_result(job.call_sid)
+        if not self._user_has_jobs(job.user_id):
+            self._fair.forget(job.user_id)
+        if job.on_done:
+            try:
+                result = job.on_done(job)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logging.error(f"[SCHEDULER CALLBACK ERROR] {job.label}: {e}")
+
+    async def call_finished(self, call_sid: str):
+        """Status-callback hook: free the call's slot and start whatever is waiting. Returns the job, if any."""
+        job = self._by_sid.get(call_sid)
+        if job is None:
+            if self._launches:
+                # Possibly a call whose dial hasn't returned yet: remember it for _launch
+                self._remember_early(call_sid)
+            return None
+        self._stats["completed"] += 1
+        self._release(job)
+        await self._done(job)
+        await self.pump()
+        return job
+
+    def _remember_early(self, call_sid: str):
+        now = self.clock()
+        self._early[call_sid] = now
+        while self._early and (len(self._early) > CALL_EARLY_FINISHES or now - next(iter(self._early.values())) > self.call_timeout):
+            self._early.popitem(last=False)
+
+    # ── metrics ───────────────────────────────────────────────────
+
+    @staticmethod
+    def _percentiles(samples) -> dict:
+        if not samples:
+            return {"count": 0}
+        ordered = sorted(samples)
+        pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+        return {"count": len(ordered), "p50": pick(0.5), "p95": pick(0.95), "max": round(ordered[-1], 3)}
+
+    def _user_stats(self) -> dict:
+        queued = Counter(entry[2].user_id for entry in self._heap)
+        return {
+            u: {"in_flight": self._per_user.get(u, 0), "queued": queued.get(u, 0),
+                "quota": user_quota(self.user_quota_base, u)}
+            for u in sorted(set(queued) | set(self._per_user))
+        }
+
+    def stats(self) -> dict:
+        now = self.clock()
+        depth = Counter(entry[2].lane for entry in self._heap)
+        oldest = {}
+        for entry in self._heap:
+            job = entry[2]
+            oldest[job.lane] = max(oldest.get(job.lane, 0.0), now - job.enqueued)
+        return {
+            **self._stats,
+            "in_flight": len(self._in_flight),
+            "dialing": len(self._launches),
+            "queued": len(self._heap),
+            "lanes": {
+                lane: {
+                    "queued": depth.get(lane, 0),
+                    "in_flight": sum(1 for j in self._in_flight if j.lane == lane),
+                    "oldest_wait": round(oldest.get(lane, 0.0), 3),
+                    "wait": self._percentiles(self._waits[lane]),
+                }
+                for lane in LANES
+            },
+            "per_number": dict(self._per_number),
+            "users": self._user_stats(),
+            "buckets": {n: round(b.tokens, 2) for n, b in self._buckets.items() if b.tokens < b.burst},
+            "limits": {
+                "account": self.account_limit,
+                "interactive_reserve": self.interactive_reserve,
+                "number_concurrency": self.number_concurrency,
+                "number_rate_per_min": self.number_rate,
+                "number_burst": self.number_burst,
+                "user_quota": self.user_quota_base,
+            },
+        }
+
+
+call_scheduler = CallScheduler()
@@ -0,0 +1,125 @@
+# backend/crawl_coordinator.py
+
+"""
+Concurrent branch crawling.
+
+Instead of popping one pending digit, placing one call and waiting for it to
+finish before the next, every branch to explore is queued as a dotted tree key
+("root.2.3") and handed to the call scheduler (call_scheduler), which dials it
+as soon as the account, the destination's concurrency cap and its rate limit
+allow. Every callback carries its branch key, so results from concurrent
+calls land on their own node of the session tree.
+
+This module keeps the crawl-level bookkeeping: which keys a session already
+queued, and when a session has nothing left in flight so its tree can be
+finalized (on_idle). Results processed after their call has ended (leaf
+recordings go through Whisper) are announced with expect() and resolve() so
+the session isn't reported idle in between.
+"""
+
+import os
+import asyncio
+from collections import Counter
+
+from call_scheduler import call_scheduler, TERMINAL_CALL_STATUSES
+
+
+CRAWL_MAX_DEPTH = int(os.getenv("CRAWL_MAX_DEPTH", "3"))
+CRAWL_BRANCH_RETRIES = int(os.getenv("CRAWL_BRANCH_RETRIES", "2"))
+
+
+class CrawlCoordinator:
+    def __init__(self, scheduler=None):
+        self.scheduler = scheduler or call_scheduler
+        # async dial(session_id, key) -> call_sid or None; async on_idle(session_id)
+        self.dial = None
+        self.on_idle = None
+        self._seen = {}
+        self._retries = {}
+        self._active = Counter()
+        self._pending = Counter()
+        self._tasks = set()
+        self._stats = Counter()
+
+    @property
+    def per_number_limit(self) -> int:
+        return self.scheduler.number_concurrency
+
+    # ── queueing ──────────────────────────────────────────────────
+
+    async def enqueue(self, session_id: str, number: str, keys, lane: str = None):
+        """Queue branch keys for a session (keys already queued or dialed are skipped)."""
+        seen = self._seen.setdefault(session_id, set())
+        for key in keys:
+            if key in seen:
+                continue
+            seen.add(key)
+            self._active[session_id] += 1
+            self._stats["queued"] += 1
+            await self.scheduler.submit(
+                session_id, number, lambda key=key: self.dial(session_id, key),
+                lane=lane, label=key, on_done=self._branch_done,
+            )
+
+    async def retry(self, session_id: str, number: str, key: str, lane: str = None) -> bool:
+        """Dial a branch again after its result was lost; False once CRAWL_BRANCH_RETRIES is used up."""
+        retries = self._retries.setdefault(session_id, Counter())
+        if retries[key] >= CRAWL_BRANCH_RETRIES:
+            self._stats["retries_exhausted"] += 1
+            return False
+        retries[key] += 1
+        self._stats["retried"] += 1
+        self._seen.setdefault(session_id, set()).discard(key)
+        await self.enqueue(session_id, number, [key], lane=lane)
+        return True
+
+    def is_crawling(self, session_id: str) -> bool:
+        return self._active[session_id] > 0 or self._pending[session_id] > 0
+
+    async def cancel(self, session_id: str):
+        """Drop a session's queued branches (calls already in flight finish normally)."""
+        await self.scheduler.cancel(session_id, label_prefix="root")
+
+    def expect(self, session_id: str):
+        """A branch result will arrive after its call ends; hold the session open until resolve()."""
+        self._pending[session_id] += 1
+
+    async def resolve(self, session_id: str):
+        self._pending[session_id] -= 1
+        await self._check_idle(session_id)
+
+    # ── completion ────────────────────────────────────────────────
+
+    async def _branch_done(self, job):
+        self._active[job.session_id] -= 1
+        self._stats["dialed" if job.call_sid else "dial_errors"] += 1
+        await self._check_idle(job.session_id)
+
+    async def _check_idle(self, session_id: str):
+        if self._active[session_id] <= 0:
+            self._active.pop(session_id, None)
+        if self._pending[session_id] <= 0:
+            self._pending.pop(session_id, None)
+        if session_id in self._seen and not self.is_crawling(session_id):
+            self._seen.pop(session_id, None)
+            self._retries.pop(session_id, None)
+            if self.on_idle:
+                # Run separately: the caller may be holding this session's lock
+                task = asyncio.create_task(self.on_idle(session_id))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def call_finished(self, call_sid: str) -> bool:
+        """Status-callback hook: free the call's slot and dial whatever is waiting."""
+        return await self.scheduler.call_finished(call_sid) is not None
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "sessions": len(self._seen),
+            "active": sum(self._active.values()),
+            "processing": sum(self._pending.values()),
+        }
+
+
+crawl_coordinator = CrawlCoordinator()
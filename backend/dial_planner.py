@@ -0,0 +1,189 @@
+# backend/dial_planner.py
+
+"""
+Goal-directed dialing from a cached phone tree.
+
+Given a mapped tree and a request like "change my Delta flight", rank every
+node locally — character n-gram TF-IDF over the node labels, scored for all
+nodes at once with a sparse matrix-vector product — and turn the best match
+into the DTMF route that reaches it:
+
+    {"key": "root.2.3", "digits": ["2", "3"], "pauses": [12.0, 3.0],
+     "send_digits": "wwwwwwwwwwwwwwwwwwwwwwww2wwwwww3", ...}
+
+`send_digits` uses Twilio's "w" (half-second wait) so a single call can play
+the whole route with <Play digits> instead of discovering the tree again one
+recorded level at a time.
+"""
+
+import os
+import math
+import hashlib
+import logging
+from collections import Counter
+
+import numpy as np
+
+from label_index import tokenize
+from session_memory import SessionCache
+from tree import split_key
+
+
+NGRAM_SIZES = (3, 4)
+DIAL_MIN_SCORE = float(os.getenv("DIAL_MIN_SCORE", "0.2"))
+DIAL_ROOT_PAUSE = float(os.getenv("DIAL_ROOT_PAUSE", "8"))    # seconds before the first digit
+DIAL_LEVEL_PAUSE = float(os.getenv("DIAL_LEVEL_PAUSE", "3"))  # seconds before each deeper digit
+LABEL_WEIGHT = 0.75  # the rest of the score comes from the full path of labels down to the node
+
+_rankers = SessionCache(max_entries=256, write_back=None)
+
+
+def _text(label: str) -> str:
+    return " ".join(tokenize(label))
+
+
+def _ngrams(text: str) -> Counter:
+    padded = f" {text} "
+    return Counter(padded[i:i + n] for n in NGRAM_SIZES for i in range(len(padded) - n + 1))
+
+
+class NgramRanker:
+    """TF-IDF over character n-grams, stored as a CSR matrix of L2-normalized rows."""
+
+    def __init__(self, texts: list):
+        vocab = {}
+        indptr, indices, data = [0], [], []
+        for text in texts:
+            for gram, count in _ngrams(text).items():
+                indices.append(vocab.setdefault(gram, len(vocab)))
+                data.append(1.0 + math.log(count))
+            indptr.append(len(indices))
+
+        self.vocab = vocab
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        df = np.bincount(self.indices, minlength=len(vocab)).astype(np.float64)
+        self.idf = np.log((1 + len(texts)) / (1 + df)) + 1.0
+        data = np.asarray(data, dtype=np.float64) * self.idf[self.indices]
+
+        row_lengths = np.diff(self.indptr)
+        rows = np.repeat(np.arange(len(texts)), row_lengths)
+        norms = np.sqrt(np.bincount(rows, weights=data * data, minlength=len(texts)))
+        norms[norms == 0] = 1.0
+        self.data = data / norms[rows]
+        self.rows = rows
+        self.size = len(texts)
+
+    def scores(self, query: str) -> np.ndarray:
+        """Cosine similarity of `query` against every row."""
+        q = np.zeros(len(self.vocab))
+        for gram, count in _ngrams(query).items():
+            col = self.vocab.get(gram)
+            if col is not None:
+                q[col] = (1.0 + math.log(count)) * self.idf[col]
+        norm = np.linalg.norm(q)
+        if norm == 0:
+            return np.zeros(self.size)
+        return np.bincount(self.rows, weights=self.data * q[self.indices], minlength=self.size) / norm
+
+
+class TreeRanker:
+    """Rankers over one tree: node labels, plus all labels from the root down to each node."""
+
+    def __init__(self, tree: dict):
+        self.nodes = []
+        stack = [("root", [], tree or {})]
+        while stack:
+            parent_key, path, children = stack.pop()
+            for digit, node in children.items():
+                if not isinstance(node, dict):
+                    continue
+                key = node.get("key") or f"{parent_key}.{digit}"
+                path_here = path + [node.get("label", "")]
+                self.nodes.append((key, node, path_here))
+                stack.append((key, path_here, node.get("children") or {}))
+        self.labels = NgramRanker([_text(n.get("label", "")) for _, n, _ in self.nodes])
+        self.paths = NgramRanker([_text(" ".join(path)) for _, _, path in self.nodes])
+
+    def rank(self, query: str, limit: int = 5) -> list:
+        if not self.nodes:
+            return []
+        text = _text(query)
+        scores = LABEL_WEIGHT * self.labels.scores(text) + (1 - LABEL_WEIGHT) * self.paths.scores(text)
+        # Equal scores: prefer the shallower node (fewer digits to dial)
+        depth = np.array([key.count(".") for key, _, _ in self.nodes])
+        order = np.lexsort((depth, -scores))[:limit]
+        return [(self.nodes[i][0], self.nodes[i][1], float(scores[i])) for i in order]
+
+
+def _label_fingerprint(tree: dict) -> str:
+    """Hash of every (key, label) in a tree: all a ranker depends on. Read-only, unlike tree.tree_hash."""
+    digest = hashlib.sha1()
+    stack = [("root", tree or {})]
+    while stack:
+        parent_key, children = stack.pop()
+        for digit in sorted(children):
+            node = children[digit]
+            if not isinstance(node, dict):
+                continue
+            key = node.get("key") or f"{parent_key}.{digit}"
+            digest.update(f"{key}\t{node.get('label', '')}\n".encode("utf-8"))
+            stack.append((key, node.get("children") or {}))
+    return digest.hexdigest()[:16]
+
+
+def get_ranker(tree: dict, number: str = None) -> TreeRanker:
+    cache_key = f"{number or ''}:{_label_fingerprint(tree)}"
+    ranker = _rankers.get(cache_key)
+    if ranker is None:
+        ranker = _rankers[cache_key] = TreeRanker(tree)
+    return ranker
+
+
+def _waits(seconds: float) -> str:
+    return "w" * max(0, round(seconds * 2))
+
+
+def dtmf_route(digits: list, pauses: list) -> dict:
+    """Route dict for pressing `digits`, each after its pause; send_digits is the 'w'-padded DTMF string."""
+    return {
+        "digits": digits,
+        "pauses": pauses,
+        "send_digits": "".join(_waits(p) + d for p, d in zip(pauses, digits)),
+    }
+
+
+def route_to(tree: dict, key: str, root_pause: float = None) -> dict:
+    """Digits, per-level pauses and the 'w'-padded DTMF string that reach `key`."""
+    digits = split_key(key)
+    pauses, children, parent = [], tree or {}, None
+    for i, digit in enumerate(digits):
+        default = (root_pause or DIAL_ROOT_PAUSE) if i == 0 else DIAL_LEVEL_PAUSE
+        pauses.append(float((parent or {}).get("pause") or default))
+        parent = children.get(digit) or {}
+        children = parent.get("children") or {}
+    return dtmf_route(digits, pauses)
+
+
+def plan_route(tree: dict, query: str, number: str = None, root_pause: float = None,
+               min_score: float = DIAL_MIN_SCORE):
+    """
+    Best node for `query` and the DTMF route to it, or None if nothing matches well.
+    A node's "pause" (seconds until its menu accepts input) overrides the defaults.
+    """
+    ranked = get_ranker(tree, number).rank(query, limit=3)
+    if not ranked or ranked[0][2] < min_score:
+        logging.info(f"[DIAL PLAN] No confident match for '{query}' (best: {ranked[0][2] if ranked else None})")
+        return None
+
+    key, node, score = ranked[0]
+    plan = {
+        "key": key,
+        "label": node.get("label"),
+        "score": round(score, 4),
+        **route_to(tree, key, root_pause),
+        "alternatives": [{"key": k, "label": n.get("label"), "score": round(s, 4)} for k, n, s in ranked[1:]],
+    }
+    digits = plan["digits"]
+    logging.info(f"[DIAL PLAN] '{query}' → {key} ({plan['label']}) via {'-'.join(digits)} | score={plan['score']}")
+    return plan
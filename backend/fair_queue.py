@@ -0,0 +1,170 @@
+# backend/fair_queue.py
+
+"""
+Weighted fair queuing of crawl work across users.
+
+Dialing, Whisper transcription and GPT parsing all have limited capacity.
+Served first come first served, one user who submits fifty /start-recon
+requests pushes everyone else's first menu behind fifty crawls. Instead each
+piece of work is tagged with a virtual start time per user (start-time fair
+queuing):
+
+    tag = max(virtual_now, user's previous tag) + 1 / weight(user)
+
+and the smallest tag runs next. A user with a long backlog only competes with
+their own backlog, and a light user's job goes straight to the front. On top of
+that each user may hold at most `user_quota × weight` slots of a queue at once.
+
+Weights come from USER_WEIGHTS ("acme=2,batch-importer=0.5"; everyone else
+gets 1). Work without a user_id is served as the "anonymous" user.
+
+Each queue runs its work on its own thread pool, sized to its concurrency, so
+minutes of Whisper or a burst of GPT calls never hold the storage I/O pool.
+"""
+
+import os
+import heapq
+import asyncio
+import logging
+import itertools
+from functools import partial
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+ANONYMOUS_USER = "anonymous"
+
+
+def _parse_weights(spec: str) -> dict:
+    weights = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        user_id, _, weight = item.partition("=")
+        try:
+            weights[user_id.strip()] = max(0.01, float(weight))
+        except ValueError:
+            logging.warning(f"[FAIR QUEUE] Ignoring bad USER_WEIGHTS entry '{item}'")
+    return weights
+
+
+USER_WEIGHTS = _parse_weights(os.getenv("USER_WEIGHTS", ""))
+WHISPER_CONCURRENCY = int(os.getenv("WHISPER_CONCURRENCY", "2"))
+WHISPER_USER_QUOTA = int(os.getenv("WHISPER_USER_QUOTA", "1"))
+GPT_CONCURRENCY = int(os.getenv("GPT_CONCURRENCY", "8"))
+GPT_USER_QUOTA = int(os.getenv("GPT_USER_QUOTA", "3"))
+DIAL_USER_QUOTA = int(os.getenv("DIAL_USER_QUOTA", "4"))
+
+
+def user_weight(user_id: str) -> float:
+    return USER_WEIGHTS.get(user_id or ANONYMOUS_USER, 1.0)
+
+
+def user_quota(base: int, user_id: str) -> int:
+    return max(1, round(base * user_weight(user_id)))
+
+
+class FairClock:
+    """Virtual-time tags per flow (user); the lowest tag is served next."""
+
+    def __init__(self, weight=user_weight):
+        self.weight = weight
+        self.now = 0.0
+        self._last = {}
+
+    def tag(self, flow: str) -> float:
+        tag = max(self.now, self._last.get(flow, 0.0)) + 1.0 / self.weight(flow)
+        self._last[flow] = tag
+        return tag
+
+    def started(self, tag: float):
+        self.now = max(self.now, tag)
+
+    def forget(self, flow: str):
+        # An idle flow restarts from virtual_now; no credit is banked while away
+        self._last.pop(flow, None)
+
+
+class FairQueue:
+    """A pool of `concurrency` slots shared fairly across users."""
+
+    def __init__(self, name: str, concurrency: int, user_quota_base: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.user_quota_base = user_quota_base
+        self.clock = FairClock()
+        self._heap = []
+        self._seq = itertools.count()
+        self._running = Counter()
+        self._queued = Counter()
+        self._stats = Counter()
+        self._pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"{name}-queue")
+
+    async def run(self, user_id: str, fn, *args, **kwargs):
+        """Run blocking `fn(*args, **kwargs)` on this queue's pool once it is this user's turn."""
+        user_id = user_id or ANONYMOUS_USER
+        turn = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (self.clock.tag(user_id), next(self._seq), user_id, turn))
+        self._queued[user_id] += 1
+        self._dispatch()
+        try:
+            await turn
+        except asyncio.CancelledError:
+            if not turn.done() or turn.cancelled():
+                self._queued[user_id] -= 1
+                self._drop_empty(user_id)
+            else:
+                self._finish(user_id)
+            raise
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, partial(fn, *args, **kwargs))
+        finally:
+            self._finish(user_id)
+
+    def _dispatch(self):
+        skipped = []
+        while self._heap and sum(self._running.values()) < self.concurrency:
+            entry = heapq.heappop(self._heap)
+            tag, _, user_id, turn = entry
+            if turn.done():  # cancelled while queued
+                continue
+            if self._running[user_id] >= user_quota(self.user_quota_base, user_id):
+                skipped.append(entry)
+                self._stats["over_quota"] += 1
+                continue
+            self.clock.started(tag)
+            self._queued[user_id] -= 1
+            self._running[user_id] += 1
+            self._stats["started"] += 1
+            turn.set_result(None)
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+
+    def _finish(self, user_id: str):
+        self._running[user_id] -= 1
+        self._drop_empty(user_id)
+        self._dispatch()
+
+    def _drop_empty(self, user_id: str):
+        if self._running[user_id] <= 0:
+            self._running.pop(user_id, None)
+        if self._queued[user_id] <= 0:
+            self._queued.pop(user_id, None)
+        if user_id not in self._running and user_id not in self._queued:
+            self.clock.forget(user_id)
+
+    def stats(self) -> dict:
+        users = set(self._running) | set(self._queued)
+        return {
+            **self._stats,
+            "running": sum(self._running.values()),
+            "queued": sum(self._queued.values()),
+            "concurrency": self.concurrency,
+            "users": {
+                u: {"in_flight": self._running.get(u, 0), "queued": self._queued.get(u, 0),
+                    "quota": user_quota(self.user_quota_base, u)}
+                for u in sorted(users)
+            },
+        }
+
+
+whisper_queue = FairQueue("whisper", WHISPER_CONCURRENCY, WHISPER_USER_QUOTA)
+gpt_queue = FairQueue("gpt", GPT_CONCURRENCY, GPT_USER_QUOTA)
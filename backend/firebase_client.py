@@ -1,62 +1,187 @@
+# backend/firebase_client.py
 
-import firebase_admin
-from firebase_admin import credentials, db
 import os
+import copy
+import uuid
+import asyncio
+import itertools
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from session_memory import SessionCache
+from storage import get_storage, ORIGIN_FIELD
+from session_model import SessionRecord, as_document
+from log_utils import Summary
 
+# Session persistence goes through the active storage backend (see storage.py);
+# Firebase is the default, XDIAL_STORAGE=sqlite keeps everything local.
+FIREBASE_CACHE_TTL = float(os.getenv("FIREBASE_CACHE_TTL", "900"))
+FIREBASE_VERIFY_INTERVAL = float(os.getenv("FIREBASE_VERIFY_INTERVAL", "2"))  # seconds a version check stays valid
+STORAGE_IO_WORKERS = int(os.getenv("STORAGE_IO_WORKERS", "16"))
 
-# 🌐 Firebase setup
-FIREBASE_CERT_PATH = os.getenv("FIREBASE_CERT_PATH", "firebase-key.json")
-FIREBASE_DB_URL = os.getenv("FIREBASE_DB_URL", "https://xdial-default-rtdb.firebaseio.com/")
+# Bounded pool for blocking storage calls made from async handlers
+_io_pool = ThreadPoolExecutor(max_workers=STORAGE_IO_WORKERS, thread_name_prefix="storage-io")
 
-if not firebase_admin._apps:
-    cred = credentials.Certificate(FIREBASE_CERT_PATH)
+# 🧠 Read-through cache of session documents.
+# Every write sets a fresh "_version" stamp in the same multi-path update as
+# its fields (one atomic round trip; stamps are unique per process and write, so
+# workers never hand out the same one), and a cached copy is validated against
+# it with a one-field read — at most once per FIREBASE_VERIFY_INTERVAL —
+# instead of a full fetch.
+VERSION_FIELD = "_version"
+_VERSION_PREFIX = uuid.uuid4().hex[:12]
+_version_seq = itertools.count(1)
+_doc_cache = SessionCache(ttl=FIREBASE_CACHE_TTL, write_back=None)
+_verified = SessionCache(ttl=FIREBASE_VERIFY_INTERVAL, write_back=None)  # present = checked recently
+_stats_lock = threading.Lock()
+_read_stats = {"storage": 0, "cache": 0, "version_checks": 0}
 
-# backend/firebase_client.py
 
-import firebase_admin
-from firebase_admin import credentials, db
-import os
+def _count(kind: str):
+    with _stats_lock:
+        _read_stats[kind] += 1
+
 
-FIREBASE_CREDENTIAL_PATH = os.getenv("FIREBASE_CREDENTIAL_PATH", "firebase-key.json")
-FIREBASE_DB_URL = os.getenv("FIREBASE_DB_URL")
+def get_read_stats() -> dict:
+    with _stats_lock:
+        return dict(_read_stats)
 
-if not firebase_admin._apps:
-    cred = credentials.Certificate(FIREBASE_CREDENTIAL_PATH)
 
-    firebase_admin.initialize_app(cred, {
-        'databaseURL': FIREBASE_DB_URL
-    })
+def invalidate_session(session_id: str):
+    _doc_cache.pop(session_id, None)
+    _verified.pop(session_id, None)
+
+
+def _fetch(session_id: str):
+    _count("storage")
+    data = get_storage().get(f"sessions/{session_id}")
+    if not data:
+        return None
+    session = SessionRecord.from_dict(data)
+    _doc_cache[session_id] = session
+    _verified[session_id] = True
+    return session
+
+
+#  Write to storage
+def _store_update(session_id: str, doc: dict) -> str:
+    version = f"{_VERSION_PREFIX}.{next(_version_seq)}"
+    get_storage().update(f"sessions/{session_id}", {**{k: v for k, v in doc.items() if k != VERSION_FIELD},
+                                                     VERSION_FIELD: version})
+    return version
+
+
+def _merge_cached(session_id: str, updates: dict, version: str):
+    cached = _doc_cache.get(session_id)
+    if cached is not None:
+        if cached is not updates:
+            for key, value in as_document(updates).items():
+                # None deletes a field, same as a Firebase update
+                if value is None:
+                    cached.pop(key, None)
+                else:
+                    cached[key] = value
+        cached[VERSION_FIELD] = version
+        _verified[session_id] = True
+    logging.info("[STORAGE UPDATE] /sessions/%s (%s): %s", session_id, version, Summary(updates))
+
 
-#  Write to Firebase
 def update_session_status(session_id: str, updates: dict):
-    ref = db.reference(f"sessions/{session_id}")
-    ref.update(updates)
-    logging.info(f"  Firebase update - /sessions/{session_id}:\n{updates}")
-
-#  Restore from Firebase (used if local session_store is missing)
-def get_session_status(session_id: str):
-    ref = db.reference(f"/sessions/{session_id}")
-    session = ref.get()
-    print(f"  Restored from Firebase - /sessions/{session_id}:\n{session}".encode('utf-8', errors='ignore').decode())
+    _merge_cached(session_id, updates, _store_update(session_id, as_document(updates)))
+
+#  Restore from storage (used if local session_store is missing)
+def get_session_status(session_id: str, refresh: bool = False):
+    """
+    Read a session, serving it from the local cache when possible.
+    The returned dict is shared with the cache — persist edits with update_session_status.
+    """
+    session = None if refresh else _cached_current(session_id)
+    if session is not None:
+        _count("cache")
+        return session
+    session = _fetch(session_id)
+    logging.info("[STORAGE READ] Restored /sessions/%s: %s", session_id, Summary(session))
     return session or {}
 
+def is_session_current(session_id: str) -> bool:
+    """Compare the cached version stamp with storage without pulling the whole document."""
+    cached = _doc_cache.get(session_id)
+    if cached is None:
+        return False
+    _count("version_checks")
+    remote_version = get_storage().get(f"sessions/{session_id}/{VERSION_FIELD}")
+    return remote_version == cached.get(VERSION_FIELD)
+
+def _cached_current(session_id: str):
+    """The cached copy if it still matches storage; a stale copy is dropped."""
+    cached = _doc_cache.get(session_id)
+    if cached is None or _verified.get(session_id):
+        return cached
+    if is_session_current(session_id):
+        _verified[session_id] = True
+        return cached
+    logging.info(f"[STORAGE CACHE] /sessions/{session_id} changed elsewhere, refetching")
+    invalidate_session(session_id)
+    return None
+
 def get_session_from_firebase(session_id: str) -> dict:
     try:
-        ref = db.reference(f"/sessions/{session_id}")
-        data = ref.get()
+        data = _cached_current(session_id)
+        if data is not None:
+            _count("cache")
+            return data
+        data = _fetch(session_id)
         return data if data else None
     except Exception as e:
         logging.error(f"[FIREBASE READ ERROR] Could not fetch session {session_id}: {e}")
         return None
 
+def public_document(session) -> dict:
+    """A session as the API returns it: no storage bookkeeping fields, no pending deletes."""
+    return {k: v for k, v in as_document(session).items() if v is not None and k not in (VERSION_FIELD, ORIGIN_FIELD)}
+
 def delete_session(session_id: str):
-    ref = db.reference(f"/sessions/{session_id}")
-    ref.delete()
+    get_storage().delete(f"sessions/{session_id}")
+    invalidate_session(session_id)
     logging.info(f"[FIREBASE DELETE] Session {session_id} removed.")
-=======
-def update_session_status(session_id: str, data: dict):
-    ref = db.reference(f"/sessions/{session_id}")
-    print(f"🔥 Writing to Firebase → /sessions/{session_id}:\n{data}")
-    ref.update(data)
 
+def list_sessions() -> list:
+    return get_storage().list("sessions")
+
+def watch_sessions(callback):
+    """Subscribe to session changes; callback receives a storage.StorageEvent."""
+    return get_storage().watch("sessions", callback)
+
+
+# ⚡ Async variants for route handlers — the blocking round trip runs on the
+# I/O pool so the event loop keeps serving other webhooks meanwhile.
+
+async def run_io(fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_io_pool, fn, *args)
+
+def submit_io(fn, *args):
+    """Fire-and-forget from sync code: run `fn(*args)` on the I/O pool, returns its Future."""
+    return _io_pool.submit(fn, *args)
+
+async def update_session_status_async(session_id: str, updates: dict):
+    # Handlers often pass the live session, which the loop keeps mutating: snapshot
+    # it here, write the snapshot on the pool, then touch the cache back on the loop
+    doc = copy.deepcopy(as_document(updates))
+    version = await run_io(_store_update, session_id, doc)
+    _merge_cached(session_id, updates, version)
+
+async def get_session_status_async(session_id: str, refresh: bool = False):
+    if not refresh and _verified.get(session_id):
+        # Checked against storage recently: no I/O at all
+        cached = _doc_cache.get(session_id)
+        if cached is not None:
+            _count("cache")
+            return cached
+    return await run_io(get_session_status, session_id, refresh)
+
+async def get_session_from_firebase_async(session_id: str) -> dict:
+    return await run_io(get_session_from_firebase, session_id)
+
+async def delete_session_async(session_id: str):
+    await run_io(delete_session, session_id)
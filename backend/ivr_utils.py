@@ -10,7 +10,7 @@ from dotenv import load_dotenv
 from difflib import SequenceMatcher
 from gpt_utils import safe_json_parse, client
 from firebase_client import update_session_status, get_session_status
-from tree import update_tree_branch, save_tree_snapshot
+from tree import update_tree_branch
 from audio_utils import wait_for_valid_recording
 
 load_dotenv()
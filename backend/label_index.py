@@ -0,0 +1,232 @@
+# backend/label_index.py
+
+"""
+Inverted index over phone-tree node labels.
+
+    token → {(number, dotted key): term count}
+
+Answers "which numbers have a path to a live agent / lost baggage, and which
+digits reach it" without loading any tree. PhoneTree reports every node it
+creates, relabels or drops (see tree.PhoneTree.number), so crawls keep the
+index current; trees already in storage are loaded once, on first search.
+"""
+
+import re
+import math
+import time
+import heapq
+import bisect
+import logging
+import threading
+from collections import defaultdict
+
+
+SEARCH_DEFAULT_LIMIT = 10
+
+_DIGIT_PREFIX = re.compile(r"^\s*[\d*#]+\s*[:.)-]\s*")
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "for", "from", "if", "in", "is", "it",
+    "me", "my", "of", "on", "or", "our", "please", "press", "say", "the", "this", "to",
+    "want", "with", "would", "you", "your", "i", "like", "need", "about",
+}
+# IVR menus and callers rarely use the same word for the same thing
+_SYNONYMS = {
+    "agent": ("representative", "operator", "person", "associate", "human", "live"),
+    "representative": ("agent", "operator"),
+    "operator": ("agent", "representative"),
+    "human": ("agent", "representative", "person"),
+    "bag": ("baggage", "luggage"),
+    "baggage": ("bag", "luggage"),
+    "luggage": ("baggage", "bag"),
+    "lost": ("missing", "delayed"),
+    "missing": ("lost",),
+    "bill": ("billing", "payment"),
+    "billing": ("bill", "payment"),
+    "payment": ("billing", "pay"),
+    "reservation": ("booking",),
+    "booking": ("reservation",),
+    "change": ("modify", "update"),
+    "cancel": ("cancellation",),
+    "cancellation": ("cancel",),
+}
+SYNONYM_WEIGHT = 0.7
+PREFIX_WEIGHT = 0.5
+
+
+def _stem(token: str) -> str:
+    for suffix in ("ations", "ation", "ings", "ing", "ies", "ed", "s"):
+        if len(token) > len(suffix) + 2 and token.endswith(suffix) and not token.endswith("ss"):
+            return token[:-len(suffix)] + ("y" if suffix == "ies" else "")
+    return token
+
+
+_SYNONYMS = {_stem(k): tuple(_stem(v) for v in values) for k, values in _SYNONYMS.items()}
+
+
+def tokenize(label: str) -> list:
+    """'3: Lost or delayed Baggage' → ['lost', 'delay', 'baggage']"""
+    text = _DIGIT_PREFIX.sub("", str(label or "")).lower()
+    return [_stem(t) for t in _TOKEN.findall(text) if t not in _STOPWORDS and not (len(t) == 1 and t.isdigit())]
+
+
+def _parent(key: str):
+    head, sep, _ = key.rpartition(".")
+    return head if sep else None
+
+
+class LabelIndex:
+    def __init__(self):
+        self._postings = defaultdict(dict)
+        self._docs = {}
+        self._by_number = defaultdict(set)
+        self._sorted_tokens = None
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    # ── updates ───────────────────────────────────────────────────
+
+    def _drop(self, doc):
+        old = self._docs.pop(doc, None)
+        if old is None:
+            return
+        for token in set(old[1]):
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.pop(doc, None)
+                if not postings:
+                    del self._postings[token]
+                    self._sorted_tokens = None
+        self._by_number[doc[0]].discard(doc[1])
+
+    def add(self, number: str, key: str, label: str):
+        doc = (number, key)
+        tokens = tokenize(label)
+        with self._lock:
+            if doc in self._docs and self._docs[doc][0] == label:
+                return
+            self._drop(doc)
+            self._docs[doc] = (label, tokens, math.sqrt(len(tokens)) or 1.0)
+            self._by_number[number].add(key)
+            for token in tokens:
+                if token not in self._postings:
+                    self._sorted_tokens = None
+                self._postings[token][doc] = self._postings[token].get(doc, 0) + 1
+
+    def remove(self, number: str, key: str):
+        with self._lock:
+            self._drop((number, key))
+
+    def remove_number(self, number: str):
+        with self._lock:
+            for key in list(self._by_number.pop(number, ())):
+                self._drop((number, key))
+
+    def index_tree(self, number: str, tree: dict, prefix: str = "root"):
+        """(Re)index every node of a nested tree for one number."""
+        if not number:
+            return
+        self.remove_number(number)
+        stack = [(prefix, tree or {})]
+        while stack:
+            parent_key, children = stack.pop()
+            for digit, node in children.items():
+                if not isinstance(node, dict):
+                    continue
+                key = node.get("key") or f"{parent_key}.{digit}"
+                self.add(number, key, node.get("label", ""))
+                stack.append((key, node.get("children") or {}))
+
+    def load_from_storage(self):
+        """Index every cached tree once (trees/<number>)."""
+        from tree_cache import get_cached_tree
+        from storage import get_storage
+
+        start = time.perf_counter()
+        numbers = get_storage().list("trees")
+        for number in numbers:
+            entry = get_cached_tree(number)
+            if entry:
+                self.index_tree(entry.get("number", number), entry.get("tree", {}))
+        self.loaded = True
+        logging.info(
+            f"[LABEL INDEX] Loaded {len(numbers)} trees, {len(self._docs)} nodes "
+            f"in {(time.perf_counter() - start) * 1000:.0f} ms"
+        )
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.load_from_storage()
+
+    # ── search ────────────────────────────────────────────────────
+
+    def _prefix_matches(self, token: str) -> list:
+        if self._sorted_tokens is None:
+            self._sorted_tokens = sorted(self._postings)
+        tokens = self._sorted_tokens
+        out = []
+        i = bisect.bisect_left(tokens, token)
+        while i < len(tokens) and tokens[i].startswith(token):
+            if tokens[i] != token:
+                out.append(tokens[i])
+            i += 1
+        return out
+
+    def _expand(self, query: str) -> dict:
+        """Query tokens (plus synonyms and prefix completions) → weight."""
+        weights = {}
+        for token in tokenize(query):
+            weights[token] = max(weights.get(token, 0), 1.0)
+            for synonym in _SYNONYMS.get(token, ()):
+                weights[synonym] = max(weights.get(synonym, 0), SYNONYM_WEIGHT)
+            if len(token) >= 3:
+                for completion in self._prefix_matches(token):
+                    weights[completion] = max(weights.get(completion, 0), PREFIX_WEIGHT)
+        return weights
+
+    def search(self, query: str, limit: int = SEARCH_DEFAULT_LIMIT, number: str = None) -> list:
+        """Ranked nodes for `query` (tf-idf over labels), optionally for one number."""
+        with self._lock:
+            total = len(self._docs) or 1
+            scores = defaultdict(float)
+            for token, weight in self._expand(query).items():
+                postings = self._postings.get(token)
+                if not postings:
+                    continue
+                w = weight * math.log(1 + total / len(postings))
+                docs = self._docs
+                for doc, tf in postings.items():
+                    if number and doc[0] != number:
+                        continue
+                    scores[doc] += w * tf / docs[doc][2]
+
+            # Ties go to shallower nodes (fewer digits to dial)
+            ranked = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -len(item[0][1])))
+            return [self._result(doc, score) for doc, score in ranked]
+
+    def _result(self, doc, score: float) -> dict:
+        number, key = doc
+        path, cursor = [], key
+        while cursor and cursor != "root":
+            entry = self._docs.get((number, cursor))
+            path.append(entry[0] if entry else cursor.rsplit(".", 1)[-1])
+            cursor = _parent(cursor)
+        return {
+            "number": number,
+            "key": key,
+            "digits": key.split(".")[1:],
+            "label": self._docs[doc][0],
+            "path": path[::-1],
+            "score": round(score, 4),
+        }
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.loaded,
+            "numbers": sum(1 for keys in self._by_number.values() if keys),
+            "nodes": len(self._docs),
+            "tokens": len(self._postings),
+        }
+
+
+label_index = LabelIndex()
@@ -0,0 +1,84 @@
+# backend/load_test.py
+
+"""
+Small load test for multi-worker deployments.
+
+Start the API with several workers sharing one SQLite store:
+
+    XDIAL_STORAGE=sqlite XDIAL_SHARED_STATE=1 uvicorn main:app --workers 4 --port 8000
+
+then run:
+
+    python load_test.py --base-url http://127.0.0.1:8000 --sessions 50 --reads 20
+
+Each request opens a fresh connection, so consecutive requests for the same
+session land on different workers. Any "Session not found" means a worker
+could not see state written by another one.
+"""
+
+import time
+import argparse
+import statistics
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    res = fn(*args, **kwargs)
+    return res, (time.perf_counter() - start) * 1000
+
+
+def run_session(base_url: str, reads: int, user_id: str) -> dict:
+    result = {"latencies": [], "not_found": 0, "errors": 0}
+    res, ms = timed(requests.post, f"{base_url}/start-recon", json={"query": "delta airlines", "user_id": user_id})
+    result["latencies"].append(ms)
+    if not res.ok:
+        result["errors"] += 1
+        return result
+    session_id = res.json()["session_id"]
+
+    for i in range(reads):
+        if i % 5 == 0:
+            res, ms = timed(requests.post, f"{base_url}/update-path", json={"session_id": session_id, "path": f"root.{i % 9}"})
+        else:
+            res, ms = timed(requests.get, f"{base_url}/session/{session_id}")
+        result["latencies"].append(ms)
+        if res.status_code == 404:
+            result["not_found"] += 1
+        elif not res.ok:
+            result["errors"] += 1
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="X-Dial multi-worker load test")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--reads", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(
+            lambda i: run_session(args.base_url, args.reads, f"load-{i % 8}"),
+            range(args.sessions),
+        ))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(ms for r in results for ms in r["latencies"])
+    total = len(latencies)
+    print(f"Requests:     {total} in {elapsed:.2f}s ({total / elapsed:.1f} req/s)")
+    if latencies:
+        print(f"Latency p50:  {statistics.median(latencies):.1f} ms")
+        print(f"Latency p99:  {latencies[min(total - 1, int(total * 0.99))]:.1f} ms")
+    print(f"Not found:    {sum(r['not_found'] for r in results)}")
+    print(f"Errors:       {sum(r['errors'] for r in results)}")
+
+    stats = requests.get(f"{args.base_url}/session-cache/stats").json()
+    print(f"Worker stats (one worker): {stats}")
+
+
+if __name__ == "__main__":
+    main()
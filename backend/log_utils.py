@@ -0,0 +1,100 @@
+# backend/log_utils.py
+
+"""
+Cheap logging for hot webhook handlers.
+
+- LazyJSON / Summary wrap big objects (trees, sessions, Firebase updates) and
+  only serialize them if the record is actually emitted, and then only up to
+  a size cap — pass them as %s arguments, never inside an f-string.
+- setup_logging() routes every record through a QueueHandler so the slow part
+  (stream/file writes) happens on a background thread.
+"""
+
+import os
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_PREVIEW_CHARS = int(os.getenv("LOG_PREVIEW_CHARS", "1000"))
+
+_listener = None
+
+
+class LazyJSON:
+    """JSON preview built on demand; stops encoding once `limit` characters are produced."""
+
+    __slots__ = ("obj", "limit")
+
+    def __init__(self, obj, limit: int = LOG_PREVIEW_CHARS):
+        self.obj = obj
+        self.limit = limit
+
+    def __str__(self):
+        if hasattr(self.obj, "to_dict"):
+            obj = self.obj.to_dict()
+        else:
+            obj = self.obj
+        out, size = [], 0
+        try:
+            for chunk in json.JSONEncoder(ensure_ascii=False, default=str).iterencode(obj):
+                out.append(chunk)
+                size += len(chunk)
+                if size > self.limit:
+                    return "".join(out)[:self.limit] + "…"
+        except Exception as e:
+            return f"<unserializable {type(obj).__name__}: {e}>"
+        return "".join(out)
+
+
+class Summary:
+    """One-line shape of a dict/list (keys and sizes) instead of its full contents."""
+
+    __slots__ = ("obj", "max_keys")
+
+    def __init__(self, obj, max_keys: int = 12):
+        self.obj = obj
+        self.max_keys = max_keys
+
+    def __str__(self):
+        obj = self.obj
+        if hasattr(obj, "keys") and hasattr(obj, "get"):
+            keys = list(obj.keys())
+            shown = ", ".join(f"{k}={_shape(obj.get(k))}" for k in keys[:self.max_keys])
+            more = f", +{len(keys) - self.max_keys} more" if len(keys) > self.max_keys else ""
+            return "{" + shown + more + "}"
+        return _shape(obj)
+
+
+def _shape(value) -> str:
+    if isinstance(value, (dict, list, tuple)):
+        return f"<{type(value).__name__}:{len(value)}>"
+    if isinstance(value, str) and len(value) > 60:
+        return repr(value[:60] + "…")
+    if hasattr(value, "keys"):
+        return f"<{type(value).__name__}>"
+    return repr(value)
+
+
+def setup_logging(level: str = LOG_LEVEL):
+    """Install a queue-backed root handler; the listener thread does the actual writes."""
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+    stream = logging.StreamHandler()
+    stream.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
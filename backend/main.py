@@ -11,7 +11,7 @@ import urllib.parse
 from uuid import uuid4
 from datetime import datetime
 from gpt_utils import safe_json_parse, client
-from fastapi import FastAPI, Request, HTTPException, Body
+from fastapi import FastAPI, Request, HTTPException, Body, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import Response
 from pydantic import BaseModel
@@ -19,25 +19,48 @@ from twilio.rest import Client
 from twilio.twiml.voice_response import VoiceResponse, Gather
 from audio_utils import wait_for_valid_recording
 from ivr_utils import classify_ivr_type, heard_open_ended_prompt, looks_like_menu, crawl_phase_handler
-from session_memory import session_store
+from session_memory import session_store, session_lock, session_locks
+from shared_state import XDIAL_SHARED_STATE, enable_shared_state, shared_state_stats
+from routing import sticky_routing_middleware, routing_stats, close_forward_session
 from audio_utils import detect_prompt_time
 from fastapi.responses import JSONResponse
 import asyncio
+import copy
+import time
 import os
+from functools import partial
 os.makedirs("recordings", exist_ok=True)
 
 from firebase_client import (
-    update_session_status,
-    get_session_status,
-    get_session_from_firebase,
-    delete_session,
+    public_document,
+    update_session_status_async,
+    get_session_status_async,
+    get_session_from_firebase_async,
+    get_read_stats,
+    delete_session_async,
+    run_io,
 )
 from twilio_utils import (
     initiate_twilio_call,
-    get_ngrok_url,
+    close_twilio_client,
+    callback_query,
+    download_recording,
+    schedule_call,
     router as twilio_router
 )
-from tree import update_tree_branch, save_tree_snapshot
+from tree import get_tree_journal, get_phone_tree, make_key, split_key, ROOT_KEY
+from blob_store import put_blob, append_blob, load_transcript_text, SESSION_BLOB
+from session_model import SessionRecord
+from log_utils import setup_logging, LazyJSON, Summary
+from tree_cache import get_cached_tree, sync_tree, stale_branches, normalize_number
+from label_index import label_index
+from dial_planner import plan_route, route_to
+from crawl_coordinator import crawl_coordinator, CRAWL_MAX_DEPTH
+from call_scheduler import call_scheduler, DialError, TERMINAL_CALL_STATUSES, UNANSWERED_CALL_STATUSES, LANE_INTERACTIVE, LANE_BULK
+from fair_queue import whisper_queue, gpt_queue
+from timing_store import recommend as recommend_timing, learn_from_recording
+from public_url import start_public_url_refresh, stop_public_url_refresh
+from call_navigator import CRAWL_IN_CALL, NAV_MAX_NODES_PER_CALL, mark_nav_options, pick_target
 
 
 
@@ -46,26 +69,14 @@ openai.api_key = os.getenv("OPENAI_API_KEY")
 client = openai.OpenAI()
 twilio_client = Client(os.getenv("TWILIO_SID"), os.getenv("TWILIO_AUTH_TOKEN"))
 FROM_NUMBER = os.getenv("TWILIO_FROM_NUMBER")
+DIRECT_DIAL_LISTEN = int(os.getenv("DIRECT_DIAL_LISTEN", "60"))  # seconds recorded at the destination
+BRANCH_LISTEN_TIMEOUT = int(os.getenv("BRANCH_LISTEN_TIMEOUT", "15"))  # silence before a branch counts as a leaf
+LEAF_RECORD_MAX = int(os.getenv("LEAF_RECORD_MAX", "60"))          # seconds recorded at a replayed node
+LEAF_RECORD_SILENCE = int(os.getenv("LEAF_RECORD_SILENCE", "6"))   # silence that ends its menu
 
 
 
 
-def get_node_by_path(tree, path):
-    parts = path.split(".")
-    node = tree
-    for part in parts[1:]:  # Skip root
-        if "children" in node and part in node["children"]:
-            node = node["children"][part]
-        else:
-            return None
-    return node
-
-
-
-
-app = FastAPI()
-app.include_router(twilio_router)
-
 # /x-dial/backend/main.py
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
@@ -76,9 +87,12 @@ import logging
 from dotenv import load_dotenv
 load_dotenv()
 
-from firebase_client import update_session_status
 
 app = FastAPI()
+app.include_router(twilio_router)
+
+# Route Twilio callbacks to the worker that owns their session
+app.middleware("http")(sticky_routing_middleware)
 
 # Allow CORS for development
 
@@ -92,20 +106,21 @@ app.add_middleware(
 
 
 
-logging.basicConfig(level=logging.INFO)
-
-
-# Session memory (mock database)
-session_store = {}
-
-# Logger
-logging.basicConfig(level=logging.INFO)
+# Logger (queue-backed, writes happen on a background thread)
+setup_logging()
 
 # Request Model
 
 class ReconRequest(BaseModel):
     query: str
     user_id: str
+    revalidate: bool = False  # re-crawl stale branches of a cached tree in the background
+    lane: str = LANE_INTERACTIVE  # "bulk" for background mapping; queued behind interactive calls
+
+
+class DirectDialRequest(BaseModel):
+    session_id: str
+    query: str = None  # defaults to the session's query
 
 
 # Response Model
@@ -140,92 +155,218 @@ def get_phone_number_from_query(query: str) -> str:
 
 
 @app.get("/session-ready/{session_id}")
-def session_ready(session_id: str):
-    session = get_session_status(session_id)
+async def session_ready(session_id: str):
+    session = session_store.get(session_id) or await get_session_status_async(session_id)
     return {"ready": session.get("recording_ready") and session.get("whisper_finished")}
 
 
 
 @app.post("/start-recon")
-async def start_recon(request: ReconRequest):
+async def start_recon(request: ReconRequest, background_tasks: BackgroundTasks):
     session_id = str(uuid4())
     timestamp = datetime.utcnow().isoformat()
-    tree = tree = {}
     phone_number = get_phone_number_from_query(request.query)
 
-    session = {
-        "user_id": request.user_id,
-        "query": request.query,
-        "created_at": timestamp,
-        "status": "initializing",
-        "path": "root",
-        "tree": tree,
-        "resolved_number": phone_number,
-        "speech_history": [],
-        "last_menu": {},
-        "pending_digits": [],
-        "menu_repeat_count": 0,
-        "tree_path_stack": [],
-    }
+    # 🌲 Serve a tree someone already mapped for this number instead of starting empty
+    cached = await run_io(get_cached_tree, phone_number)
+    tree = copy.deepcopy(cached["tree"]) if cached else {}
+    stale = stale_branches(cached) if cached else []
+
+    session = SessionRecord(
+        user_id=request.user_id,
+        query=request.query,
+        created_at=timestamp,
+        status="cached" if cached else "initializing",
+        path="root",
+        tree=tree,
+        resolved_number=phone_number,
+    )
+    session["lane"] = request.lane if request.lane in (LANE_INTERACTIVE, LANE_BULK) else LANE_INTERACTIVE
+    if cached:
+        session["tree_source"] = "cache"
+        session["tree_updated_at"] = cached.get("updated_at")
+        logging.info(f"[TREE CACHE HIT] {phone_number} | stale branches: {stale}")
     session_store[session_id] = session
 
     logging.info(f"[LOOKUP] Resolved phone number: {phone_number}")
     logging.info(f"[SESSION CREATED] ID: {session_id} for query: '{request.query}'")
-    logging.info(f"[FIREBASE UPDATE] Session Tree: {json.dumps(session.get('tree', {}), indent=2)[:1000]}")
+    logging.info("[FIREBASE UPDATE] Session Tree: %s", LazyJSON(session.get("tree", {})))
 
+    # 🔥 Persist the full session so any worker can pick up its webhooks
+    await update_session_status_async(session_id, session)
 
+    if cached and stale and request.revalidate:
+        background_tasks.add_task(revalidate_tree, session_id, stale)
 
-@app.post("/start-recon", response_model=SessionInitResponse)
-async def start_recon(request: ReconRequest):
-    session_id = str(uuid4())
-    timestamp = datetime.utcnow().isoformat()
+    # 🎯 With a mapped tree we can already tell which digits reach the request
+    route = plan_route(tree, request.query, normalize_number(phone_number)) if tree else None
 
-    session_store[session_id] = {
-        "user_id": request.user_id,
-        "query": request.query,
+    return {
+        "session_id": session_id,
+        "status": session["status"],
         "created_at": timestamp,
-        "status": "initializing"
+        "query": request.query,
+        "tree": tree,
+        "resolved_number": phone_number,
+        "tree_source": session.get("tree_source", "crawl"),
+        "stale_branches": stale,
+        "route": route,
     }
 
-    logging.info(f"[SESSION CREATED] ID: {session_id} for query: '{request.query}'")
 
-    # 🔥 Firebase update with test phone tree
+async def revalidate_tree(session_id: str, stale_digits: list):
+    """Re-crawl only the stale top-level branches of a cached tree."""
+    async with session_lock(session_id):
+        session = session_store.get(session_id) or await get_session_status_async(session_id)
+        updates = {"status": "revalidating", "ivr_type": "menu"}
+        session.update(updates)
+        await update_session_status_async(session_id, updates)
 
-    update_session_status(session_id, {
-        "status": "initializing",
-        "query": request.query,
-        "created_at": timestamp,
+    logging.info(f"[TREE REVALIDATE] {session_id} re-crawling branches {stale_digits}")
+    # Nobody is waiting on a revalidation: it always runs in the bulk lane
+    await crawl_coordinator.enqueue(
+        session_id, normalize_number(session.get("resolved_number")), [make_key([d]) for d in stale_digits],
+        lane=LANE_BULK,
+    )
 
-        "tree": tree
-    })
 
-    return {
-        "session_id": session_id,
-        "status": "initializing",
-        "created_at": timestamp,
-        "query": request.query,
-        "tree": tree,
-        "resolved_number": phone_number
-    }
+# 🕸️ Branch crawling: the coordinator dials queued branches concurrently within its limits
+
+async def dial_branch(session_id: str, key: str):
+    return await initiate_twilio_call(session_id=session_id, digit_path=key, navigate=CRAWL_IN_CALL)
+
+
+async def finish_crawl(session_id: str):
+    """Every queued branch has been explored: mark the session complete and publish the tree."""
+    async with session_lock(session_id):
+        session = session_store.get(session_id) or await get_session_status_async(session_id)
+        if not session:
+            return
+        updates = {"completed": True, "status": "completed"}
+        session.update(updates)
+        if session.get("failed_branches"):
+            logging.warning(f"[TREE COMPLETED] {session_id} finished without branches {session['failed_branches']}")
+        else:
+            logging.info(f"[TREE COMPLETED] All branches explored for {session_id}")
+        await update_session_status_async(session_id, updates)
+        await run_io(sync_tree, session.get("resolved_number"), session["tree"], session_id)
+        await get_tree_journal(session["query"], session_id).save(session["tree"], force=True)
+
+
+def session_lane(session_id: str):
+    return (session_store.get(session_id) or {}).get("lane")
+
+
+async def session_user(session_id: str):
+    # An evicted cache entry must not bill the session to the shared "anonymous" quota
+    session = session_store.get(session_id) or await get_session_status_async(session_id) or {}
+    return session.get("user_id")
+
+
+crawl_coordinator.dial = dial_branch
+crawl_coordinator.on_idle = finish_crawl
+call_scheduler.lane_of = session_lane
+call_scheduler.user_of = session_user
+
+@app.post("/dial-direct")
+async def dial_direct(request: DirectDialRequest):
+    """Place one call that plays the DTMF route to the best-matching node of the cached tree."""
+    session_id = request.session_id
+    async with session_lock(session_id):
+        session = session_store.get(session_id) or await get_session_status_async(session_id)
+        if not session:
+            raise HTTPException(status_code=404, detail="Session not found")
+
+        query = request.query or session.get("query", "")
+        plan = plan_route(
+            session.get("tree") or {}, query,
+            normalize_number(session.get("resolved_number")),
+            root_pause=session.get("calculated_pause"),
+        )
+        if not plan:
+            raise HTTPException(status_code=404, detail="No node in the mapped tree matches this request")
+
+        updates = {"dial_plan": plan, "status": "dialing_direct"}
+        session.update(updates)
+        await update_session_status_async(session_id, updates)
+
+    try:
+        call_sid = await schedule_call(
+            session_id, label=f"direct {plan['key']}", send_digits=plan["send_digits"], target_key=plan["key"]
+        )
+    except DialError as e:
+        logging.error(f"[DIAL DIRECT ERROR] {e}")
+        raise HTTPException(status_code=500, detail="Twilio call failed to start.")
+    return {"status": "calling" if call_sid else "queued", "call_sid": call_sid, "session_id": session_id, "route": plan}
+
+
+async def remember_call_sid(session_id: str, call_sid: str):
+    """Link the session to its discovery / query call once the scheduler has placed it."""
+    async with session_lock(session_id):
+        session = session_store.get(session_id) or await get_session_status_async(session_id)
+        if session is not None:
+            session["twilio_call_sid"] = call_sid
+        await update_session_status_async(session_id, {"twilio_call_sid": call_sid})
+
+
+async def _retry_branch(session_id: str, session: dict, branch: str, status: str):
+    if await crawl_coordinator.retry(session_id, normalize_number(session.get("resolved_number")), branch):
+        logging.warning(f"[BRANCH RETRY] {branch}: call ended {status}, dialing it again")
+        return
+    logging.error(f"[BRANCH GIVE UP] {branch}: call ended {status} after retries, left unexplored")
+    async with session_lock(session_id):
+        session = session_store.get(session_id) or await get_session_status_async(session_id) or session
+        failed = sorted(set(session.get("failed_branches") or []) | {branch})
+        session["failed_branches"] = failed
+        await update_session_status_async(session_id, {"failed_branches": failed})
+
 
 @app.post("/twilio/status-callback")
 async def status_callback(request: Request):
     form = await request.form()
     call_sid = form.get("CallSid")
     session_id = request.query_params.get("session_id")
+    branch = request.query_params.get("branch") or ""
 
     if not session_id:
         logging.warning("[STATUS CALLBACK] Missing session_id in callback")
         return Response(status_code=400)
 
-    session = get_session_status(session_id)
-    if not session:
-        logging.warning(f"[STATUS CALLBACK] No session found for session_id: {session_id}")
-        return Response(status_code=404)
-
-    session["twilio_call_sid"] = call_sid
-    update_session_status(session_id, session)
-    logging.info(f"[CALL LINKED] CallSid {call_sid} now mapped to session {session_id}")
+    async with session_lock(session_id):
+        session = session_store.get(session_id) or await get_session_status_async(session_id)
+        if not session:
+            logging.warning(f"[STATUS CALLBACK] No session found for session_id: {session_id}")
+            return Response(status_code=404)
+
+        # Only write the field we own so concurrent callbacks don't overwrite each other;
+        # branch calls are tracked by the scheduler and must not replace the session's own call SID
+        updates = {}
+        if not branch and session.get("twilio_call_sid") != call_sid:
+            session["twilio_call_sid"] = call_sid
+            updates["twilio_call_sid"] = call_sid
+
+        # A navigation call that ended on its way to a branch never heard it: dial it again
+        lost = None
+        nav_calls = session.get("nav_calls") or {}
+        if form.get("CallStatus") in TERMINAL_CALL_STATUSES and call_sid in nav_calls:
+            lost = nav_calls.pop(call_sid)
+            session["nav_calls"] = nav_calls or None
+            updates["nav_calls"] = nav_calls or None
+        if updates:
+            await update_session_status_async(session_id, updates)
+    if "twilio_call_sid" in updates:
+        logging.info(f"[CALL LINKED] CallSid {call_sid} now mapped to session {session_id}")
+
+    if lost:
+        logging.warning(f"[NAV LOST] {call_sid} ended before reaching {lost} — re-queuing")
+        await crawl_coordinator.enqueue(session_id, normalize_number(session.get("resolved_number")), [lost])
+    elif form.get("CallStatus") in UNANSWERED_CALL_STATUSES and branch.startswith(f"{ROOT_KEY}."):
+        # A crawl branch call that never connected explored nothing: dial it again before
+        # its slot is freed below, so the crawl isn't reported idle without it
+        await _retry_branch(session_id, session, branch, form.get("CallStatus"))
+    # A finished call frees its scheduler slot for the next queued dial
+    if form.get("CallStatus") in TERMINAL_CALL_STATUSES:
+        await call_scheduler.call_finished(call_sid)
     return Response(status_code=204)
 
 
@@ -236,39 +377,40 @@ async def start_crawl(request: Request):
     say_query = data.get("say_query", False)
     number = data.get("phone_number")
 
-    existing_session = session_store.get(session_id) or get_session_status(session_id) or {}
-
-    query = data.get("query") or existing_session.get("query", "Hello. Please route this call.")
-    to_number = number or existing_session.get("resolved_number")
-
-    if not to_number or not session_id:
-        raise HTTPException(status_code=400, detail="Missing phone number or session ID")
-
-    # 🚫 BLOCK if whisper isn't finished and trying to speak query
-    if say_query and not existing_session.get("whisper_finished"):
-        logging.info(f"[BLOCKED CALL] Whisper not finished, deferring say_query call for {session_id}")
-        existing_session["query_pending"] = True
-        update_session_status(session_id, existing_session)
-        return JSONResponse({"status": "waiting_for_whisper"}, status_code=202)
-
-    # 🧠 Prime session for IVR crawling
-    session_store[session_id] = {
-        **existing_session,
-        "resolved_number": to_number,
-        "query": query,
-        "status": "starting",
-        "path": "root",
-        "pending_digits": [],
-        "reroute_count": 0,
-        "retry_attempts": 0,
-        "should_check_speech": True,
-        "speech_history": [],
-        "last_menu": {},
-        "menu_repeat_count": 0,
-        "tree_path_stack": [],
-    }
+    async with session_lock(session_id):
+        existing_session = session_store.get(session_id) or await get_session_status_async(session_id) or {}
 
-    session = session_store.get(session_id) or get_session_status(session_id)
+        query = data.get("query") or existing_session.get("query", "Hello. Please route this call.")
+        to_number = number or existing_session.get("resolved_number")
+
+        if not to_number or not session_id:
+            raise HTTPException(status_code=400, detail="Missing phone number or session ID")
+
+        # 🚫 BLOCK if whisper isn't finished and trying to speak query
+        if say_query and not existing_session.get("whisper_finished"):
+            logging.info(f"[BLOCKED CALL] Whisper not finished, deferring say_query call for {session_id}")
+            existing_session["query_pending"] = True
+            await update_session_status_async(session_id, {"query_pending": True})
+            return JSONResponse({"status": "waiting_for_whisper"}, status_code=202)
+
+        # 🧠 Prime session for IVR crawling
+        session_store[session_id] = SessionRecord.from_dict({
+            **existing_session,
+            "resolved_number": to_number,
+            "query": query,
+            "status": "starting",
+            "path": "root",
+            "pending_digits": [],
+            "reroute_count": 0,
+            "retry_attempts": 0,
+            "should_check_speech": True,
+            "speech_history": [],
+            "last_menu": {},
+            "menu_repeat_count": 0,
+            "tree_path_stack": [],
+        })
+
+        session = session_store.get(session_id) or await get_session_status_async(session_id)
 
     # ⏳ If whisper done, wait before speaking query
     if session.get("recording_ready") and session.get("whisper_finished") and not say_query:
@@ -286,13 +428,15 @@ async def start_crawl(request: Request):
             elif ivr_type == "open-ended":
                 logging.info("[LOOP 2 OPEN-ENDED] Recalling to inject GPT-shortened query.")
 
-        call_sid = initiate_twilio_call(to_number=to_number, session_id=session_id, say_query=say_query)
-        session["twilio_call_sid"] = call_sid
-        update_session_status(session_id, session)
+        # Queued calls are linked to the session whenever they get dialed
+        call_sid = await schedule_call(
+            session_id, to_number, label="say_query" if say_query else "discovery", say_query=say_query,
+            on_dialed=partial(remember_call_sid, session_id),
+        )
 
-        logging.info(f"[CRAWLER STARTED] Calling {to_number} | SID: {call_sid}")
+        logging.info(f"[CRAWLER STARTED] Calling {to_number} | SID: {call_sid or 'queued'}")
         return {
-            "status": "calling",
+            "status": "calling" if call_sid else "queued",
             "call_sid": call_sid,
             "session_id": session_id,
             "query": query,
@@ -333,14 +477,10 @@ async def crawler_entry(request: Request):
     session_id = request.query_params.get("session_id")
     digit = request.query_params.get("digit")
     say_query_flag = request.query_params.get("say_query") == "true"
+    play_digits = request.query_params.get("play_digits")
+    branch = request.query_params.get("branch")
 
-    session = session_store.get(session_id) or get_session_status(session_id)
-    session.setdefault("speech_history", [])
-    session.setdefault("last_menu", {})
-    session.setdefault("pending_digits", [])
-    session.setdefault("menu_repeat_count", 0)
-    session.setdefault("tree_path_stack", [])
-
+    session = session_store.get(session_id) or await get_session_status_async(session_id)
     if not session:
         logging.warning(f"[FALLBACK] No session found for {session_id}")
         vr = VoiceResponse()
@@ -348,11 +488,57 @@ async def crawler_entry(request: Request):
         vr.hangup()
         return Response(content=str(vr), media_type="application/xml")
 
+    session_store[session_id] = session
+    session.setdefault("speech_history", [])
+    session.setdefault("last_menu", {})
+    session.setdefault("pending_digits", [])
+    session.setdefault("menu_repeat_count", 0)
+    session.setdefault("tree_path_stack", [])
+
     user_query = session.get("query", "Hello. Please route this call.")
     logging.info(f"[CRAWLER ENTRY] SID={session_id} | digit={digit} | say_query_flag={say_query_flag} | user_query={user_query}")
 
     vr = VoiceResponse()
 
+    # 🎯 Direct dial: play the planned DTMF route, then record only the destination
+    if play_digits:
+        target = request.query_params.get("target")
+        logging.info(f"[DIRECT DIAL] SID={session_id} | target={target} | digits={play_digits}")
+        vr.play(digits=play_digits)
+        vr.record(
+            maxLength=DIRECT_DIAL_LISTEN,
+            playBeep=False,
+            transcribe="true",
+            action=f"/twilio/recording-status?{callback_query(session_id, target=target)}",
+            method="POST",
+            trim="do-not-trim"
+        )
+        return Response(content=str(vr), media_type="application/xml")
+
+    # 🕸️ Coordinated branch call: press the path to the branch, then listen to its menu
+    if branch:
+        route = route_to(session.get("tree"), branch, root_pause=session.get("calculated_pause"))
+        logging.info(f"[CRAWLER ENTRY] Branch {branch} via {route['digits']} (pauses {route['pauses']})")
+        timing = await run_io(partial(
+            recommend_timing, session.get("resolved_number"), branch,
+            defaults={"max_length": LEAF_RECORD_MAX, "timeout": LEAF_RECORD_SILENCE, "listen": BRANCH_LISTEN_TIMEOUT},
+        ))
+        if request.query_params.get("nav"):
+            _listen_at_branch(vr, session_id, branch, route["send_digits"], nav="1", listen=timing["listen"])
+            return Response(content=str(vr), media_type="application/xml")
+
+        # Prefix replay: only the node the route lands on is recorded
+        vr.play(digits=route["send_digits"])
+        vr.record(
+            maxLength=timing["max_length"],
+            timeout=timing["timeout"],
+            playBeep=False,
+            action=f"/twilio/leaf-recording?{callback_query(session_id, branch=branch)}",
+            method="POST",
+            trim="do-not-trim"
+        )
+        return Response(content=str(vr), media_type="application/xml")
+
     # 🧠 Digit-based follow-up
     if digit:
         logging.info(f"[CRAWLER ENTRY] Pressed digit: {digit}")
@@ -361,7 +547,7 @@ async def crawler_entry(request: Request):
             timeout=90,
             speech_timeout='auto',
             transcribe="true",
-            action=f'/twilio/crawler-branch?session_id={session_id}',
+            action=f'/twilio/crawler-branch?{callback_query(session_id)}',
             method='POST'
         )
         gather.say("Please hold while we gather the IVR options...")
@@ -370,7 +556,7 @@ async def crawler_entry(request: Request):
             maxLength=90,
             playBeep=False,
             transcribe="true",
-            action=f"/twilio/recording-status?session_id={session_id}",
+            action=f"/twilio/recording-status?{callback_query(session_id)}",
             method="POST"
         )
         return Response(content=str(vr), media_type="application/xml")
@@ -378,7 +564,9 @@ async def crawler_entry(request: Request):
     # 🎙️ Say the rephrased user query
     elif say_query_flag:
         try:
-            gpt_response = client.chat.completions.create(
+            gpt_response = await gpt_queue.run(
+                session.get("user_id"),
+                client.chat.completions.create,
                 model="gpt-4o",
                 messages=[
                     {
@@ -403,7 +591,8 @@ async def crawler_entry(request: Request):
 
         # Pull dynamic pause from previous session timing analysis
 
-        pause_length = session.get("calculated_pause", 19)
+        root_timing = await run_io(recommend_timing, session.get("resolved_number"), "root")
+        pause_length = (root_timing["learned"] and root_timing["pause"]) or session.get("calculated_pause", 19)
         logging.info(f"[CRAWLER ENTRY] Say query mode - Pausing {pause_length}s before speaking...")
 
         vr.pause(length=pause_length)
@@ -414,7 +603,7 @@ async def crawler_entry(request: Request):
             input='dtmf speech',
             timeout=90,
             speech_timeout='auto',
-            action=f"/twilio/crawler-branch?session_id={session_id}",
+            action=f"/twilio/crawler-branch?{callback_query(session_id)}",
             method='POST'
         )
         vr.append(gather)
@@ -426,7 +615,7 @@ async def crawler_entry(request: Request):
             maxLength=90,
             playBeep=False,
             transcribe="true",
-            action=f"/twilio/recording-status?session_id={session_id}",
+            action=f"/twilio/recording-status?{callback_query(session_id)}",
             method="POST"
         )
 
@@ -442,20 +631,25 @@ async def crawler_entry(request: Request):
             return Response(content=str(vr), media_type="application/xml")
 
         logging.info("[CRAWLER ENTRY] Passive listen mode (Init Discovery)")
-        session["should_check_speech"] = True
-        session["ivr_type"] = "unknown"
-        session["ivr_phase"] = "init_discovery"
+        updates = {"should_check_speech": True, "ivr_type": "unknown", "ivr_phase": "init_discovery"}
+        session.update(updates)
         session_store[session_id] = session
+        # Write through: with shared state the next callback may land on another worker
+        await update_session_status_async(session_id, updates)
 
-        total_passive_listen = 90  # Increase passive listening time here
-        logging.info(f"[DELAY] Using extended passive listen: {total_passive_listen}s")
+        # Learned from earlier crawls of this number; 90s (and Twilio's 5s silence) until then
+        root_timing = await run_io(recommend_timing, session.get("resolved_number"), "root")
+        total_passive_listen = root_timing["max_length"]
+        logging.info(f"[DELAY] Passive listen: {total_passive_listen}s, silence timeout {root_timing['timeout']}s "
+                     f"({'learned from ' + str(root_timing['samples']) + ' calls' if root_timing['learned'] else 'default'})")
 
         # ⏸ Let Twilio record for the full duration to catch entire IVR prompt
         vr.record(
             maxLength=total_passive_listen,
+            timeout=root_timing["timeout"],
             playBeep=False,
             transcribe="true",
-            action=f"/twilio/crawler-branch?session_id={session_id}",
+            action=f"/twilio/crawler-branch?{callback_query(session_id)}",
             method="POST",
             trim="do-not-trim"
         )
@@ -479,44 +673,63 @@ from difflib import SequenceMatcher
 
 @app.post("/twilio/crawler-branch")
 async def crawler_branch(request: Request):
+    await request.form()
+    # Callbacks for one session apply in order; other sessions run in parallel
+    async with session_lock(request.query_params.get("session_id")):
+        return await _handle_crawler_branch(request)
+
+
+async def _handle_crawler_branch(request: Request):
     form = await request.form()
     digits = form.get("Digits")
     speech = (form.get("SpeechResult") or "").strip()
     logging.info(f"[SPEECH RECEIVED] → {speech}")
     session_id = request.query_params.get("session_id")
     branch_digit = request.query_params.get("branch_digit") 
-    session = session_store.get(session_id) or get_session_status(session_id)
-    session.setdefault("speech_history", [])
-    session.setdefault("last_menu", {})
-    session.setdefault("pending_digits", [])
-    session.setdefault("menu_repeat_count", 0)
-    session.setdefault("tree_path_stack", [])
-
+    session = session_store.get(session_id)
     if not session:
         logging.warning(f"[FALLBACK] Session ID {session_id} not found in memory. Attempting Firebase pull...")
-        session = get_session_from_firebase(session_id)
+        session = await get_session_from_firebase_async(session_id)
         if not session:
             raise HTTPException(status_code=404, detail="Session not found")
         session_store[session_id] = session
         logging.info("[FALLBACK SUCCESS] Session restored from Firebase.")
 
+    session.setdefault("speech_history", [])
+    session.setdefault("last_menu", {})
+    session.setdefault("pending_digits", [])
+    session.setdefault("menu_repeat_count", 0)
+    session.setdefault("tree_path_stack", [])
+
+    branch = request.query_params.get("branch")
+    if branch:
+        children = await _record_branch_menu(session_id, session, branch, speech, form.get("CallSid"))
+        if request.query_params.get("nav"):
+            hops = int(request.query_params.get("hops") or 1)
+            return await _navigate_next(session_id, session, branch, children, form.get("CallSid"), hops)
+        if children:
+            await crawl_coordinator.enqueue(session_id, normalize_number(session.get("resolved_number")), children)
+        vr = VoiceResponse()
+        vr.say("Thanks. Response captured. Goodbye.")
+        vr.hangup()
+        return Response(content=str(vr), media_type="application/xml")
+
     if len(speech) < 6 and session.get("retry_attempts", 0) < 1:
         logging.info("[SHORT SPEECH] Retrying IVR capture due to empty/short speech")
         session["retry_attempts"] = 1
-        call = twilio_client.calls.create(
-            to=form.get("To"),
-            from_=FROM_NUMBER,
-            url=f"{get_ngrok_url()}/twilio/crawler-entry?session_id={session_id}&branch_digit={branch_digit}"
+        await update_session_status_async(session_id, {"retry_attempts": 1})
+        call_sid = await schedule_call(
+            session_id, form.get("To"), priority=0, label="retry", wait=0, branch_digit=branch_digit
         )
-        logging.info(f"[SHORT SPEECH RECALL] SID: {call.sid}")
+        logging.info(f"[SHORT SPEECH RECALL] SID: {call_sid or 'queued'}")
         vr = VoiceResponse()
         vr.say("Retrying. Please hold.")
         vr.hangup()
         return Response(content=str(vr), media_type="application/xml")
 
-    # Prefer Whisper transcript if available
-    if session.get("whisper_segments"):
-        combined_speech = " ".join(seg["text"] for seg in session["whisper_segments"])
+    # Prefer Whisper transcript if available (segments are loaded from the blob store on demand)
+    if session.get("whisper_segments_ref") or session.get("whisper_segments"):
+        combined_speech = await run_io(load_transcript_text, session)
     else:
         last_speech = session.get("last_speech", "")
         combined_speech = f"{last_speech} {speech}".strip()
@@ -524,9 +737,19 @@ async def crawler_branch(request: Request):
     session["last_speech"] = combined_speech
     logging.info(f"[COMBINED SPEECH] → {combined_speech}")
 
+    # Only the last 3 utterances stay inline for loop detection; the full log is a blob
     session["speech_history"].append(speech.strip())
     if len(session["speech_history"]) > 3:
         session["speech_history"].pop(0)
+    # One log per session: concurrent branch calls append to it, each line tagged with its call
+    session["speech_log_ref"] = await run_io(
+        append_blob, session_id, SESSION_BLOB, "speech_history", {"call_sid": form.get("CallSid"), "text": speech.strip()},
+    )
+    await update_session_status_async(session_id, {
+        "last_speech": combined_speech,
+        "speech_history": session["speech_history"],
+        "speech_log_ref": session["speech_log_ref"],
+    })
 
     def all_similar(history, threshold=0.9):
         return all(
@@ -536,15 +759,14 @@ async def crawler_branch(request: Request):
 
     if len(session["speech_history"]) == 3 and all_similar(session["speech_history"]):
         logging.warning("[REPEATED MENU DETECTED] Breaking recursion to prevent infinite loop.")
-        update_session_status(session_id, {"loop_detected": True})
+        await update_session_status_async(session_id, {"loop_detected": True})
         vr = VoiceResponse()
         vr.say("We’ve reached a repeated menu. Ending session to avoid a loop. Goodbye.")
         vr.hangup()
         return Response(content=str(vr), media_type="application/xml")
 
-    session = get_session_status(session_id)
     if session["ivr_type"] == "menu" and not session.get("last_menu"):
-        result = crawl_phase_handler(session, combined_speech, digit=branch_digit)
+        result = await gpt_queue.run(session.get("user_id"), crawl_phase_handler, session, combined_speech, digit=branch_digit)
 
     ivr_type = result["ivr_type"]
     action = result["action"]
@@ -552,6 +774,7 @@ async def crawler_branch(request: Request):
 
     session["ivr_type"] = ivr_type
     session_store[session_id] = session
+    await update_session_status_async(session_id, {"ivr_type": ivr_type})
 
     if not session.get("whisper_finished"):
         logging.warning(f"[BLOCK INJECTION] Whisper not finished. Delaying second call for session {session_id}")
@@ -560,8 +783,8 @@ async def crawler_branch(request: Request):
     if action == "inject_query" and not session.get("query_spoken"):
         logging.info("[QUERY INJECTION] Phase handler says to inject query")
         session["query_spoken"] = True
-        update_session_status(session_id, session)
-        call = initiate_twilio_call(to_number=form.get("To"), session_id=session_id, say_query=True)
+        await update_session_status_async(session_id, session)
+        await schedule_call(session_id, form.get("To"), label="say_query", wait=0, say_query=True)
         vr = VoiceResponse()
         vr.say("Redirecting with your request.")
         vr.hangup()
@@ -570,58 +793,39 @@ async def crawler_branch(request: Request):
 
     if action == "parse_menu":
         try:
-            parsed_raw = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": (
-                            "Extract only the spoken menu options from the transcript. "
-                            "Return a flat JSON object and nothing else."
-                        )
-                    },
-                    {"role": "user", "content": combined_speech}
-                ]
-            ).choices[0].message.content.strip()
+            node_key = make_key(session.get("tree_path_stack", []))
+            parsed_options = await _parse_menu_options(session, session_id, form.get("CallSid"), node_key, combined_speech)
 
-            logging.warning(f"[GPT PARSE] Raw: {parsed_raw}")
-            parsed_options = safe_json_parse(parsed_raw)
-            if parsed_options:
-                session["tree"] = {str(k): v for k, v in parsed_options.items()}
-                update_session_status(session_id, session)
-                logging.info(f"[TREE PARSED] Updated session tree with menu options: {parsed_options}")
-
-            # Inject parsed menu into the tree
-            path = session.get("tree_path_stack", [])
-            node = session["tree"]
-            for digit in path:
-                node = node.setdefault(digit, {"label": "", "children": {}})["children"]
-
-            for k, v in parsed_options.items():
-                node[k] = {"label": v, "children": {}}
-                update_tree_branch(session["tree"], session["path"], parsed_options, ivr_type="menu")
-                save_tree_snapshot(session["query"], session_id, session["tree"])
-                update_session_status(session_id, session)
-            logging.info(f"[TREE UPDATE] Injected menu at path {' > '.join(path)}")
+            # The menu just heard belongs to the branch this call dialed
+            phone_tree = get_phone_tree(session_id, session, normalize_number(session.get("resolved_number")))
 
-
-            if not parsed_options:
+            if parsed_options:
+                # 📓 Journal only the nodes this menu touched; checkpoint the full tree now and then
+                journal = get_tree_journal(session["query"], session_id)
+                phone_tree.add_options(node_key, parsed_options, ivr_type="menu", on_change=journal.on_change)
+                await journal.save(session["tree"])
+                logging.info(f"[TREE UPDATE] Injected menu at {node_key}: %s", Summary(parsed_options))
+
+                # Share the freshly mapped menu with every later session for this number;
+                # only subtrees whose hashes changed are written
+                await run_io(
+                    sync_tree, session.get("resolved_number"), session["tree"], session_id,
+                    [branch_digit] if branch_digit else None,
+                )
+            else:
                 logging.warning("[GPT PARSE ERROR] Empty or malformed JSON from GPT.")
-                fallback_tree_path = session.get("path", "root")
-                fallback_node = get_node_by_path(session["tree"], fallback_tree_path)
-                if fallback_node:
-                    fallback_node["label"] += " [GPT parse error]"
-                    fallback_node["parse_error"] = True
-                update_session_status(session_id, session)
+                fallback_node = phone_tree.get(node_key)
+                if fallback_node and not fallback_node.get("parse_error"):
+                    phone_tree.insert(node_key, label=f"{fallback_node['label']} [GPT parse error]", parse_error=True)
 
             if parsed_options and parsed_options != session.get("last_menu"):
                 session["last_menu"] = parsed_options
-                session["pending_digits"] = list(parsed_options.keys())
+                session["pending_digits"] = mark_nav_options(phone_tree, node_key, parsed_options)
                 session["menu_repeat_count"] = 0
             else:
                 session["menu_repeat_count"] += 1
 
-            update_session_status(session_id, session)
+            await update_session_status_async(session_id, session)
 
         except Exception as e:
             logging.error(f"[MENU PARSE ERROR] {e}")
@@ -634,24 +838,25 @@ async def crawler_branch(request: Request):
     if action == "wait":
         logging.info("[PHASE HANDLER] No action required yet — waiting for next speech input")
 
-    if not session["pending_digits"]:
+    # ⬇️ Hand every pending branch to the coordinator; siblings are dialed concurrently
+    if session["pending_digits"]:
+        base = session.get("tree_path_stack", [])
+        keys = [make_key(base + [d]) for d in session["pending_digits"]]
+        session["pending_digits"] = []
+        updates = {"pending_digits": None, "status": "crawling"}
+        if CRAWL_IN_CALL:
+            # One navigation call per concurrency slot; each walks the rest from the shared frontier
+            keys, session["nav_frontier"] = keys[:crawl_coordinator.per_number_limit], keys[crawl_coordinator.per_number_limit:]
+            updates["nav_frontier"] = session["nav_frontier"] or None
+        logging.info("[TREE DUMP] %s", LazyJSON(session["tree"]))
+        await update_session_status_async(session_id, updates)
+        await crawl_coordinator.enqueue(session_id, normalize_number(session.get("resolved_number")), keys)
+    elif not crawl_coordinator.is_crawling(session_id):
         session["completed"] = True
         logging.info("[TREE COMPLETED] All digits explored — marking session complete")
-        update_session_status(session_id, session)
-
-    # ⬇️ Trigger the next call recursively
-    if session["pending_digits"]:
-        next_digit = session["pending_digits"].pop(0)
-        call = twilio_client.calls.create(
-            to=form.get("To"),
-            from_=FROM_NUMBER,
-            url=f"{get_ngrok_url()}/twilio/crawler-entry?session_id={session_id}&digit={next_digit}&branch_digit={next_digit}"
-        )
-        logging.info(f"[RECURSE DTMF] {next_digit} | SID: {call.sid}")
-        session["tree_path_stack"].append(next_digit)
-    # ⬇️ Dump current tree to terminal for inspection
-        logging.info(f"[TREE DUMP] {json.dumps(session['tree'], indent=2)[:1000]}")
-        update_session_status(session_id, session)
+        await update_session_status_async(session_id, session)
+        await run_io(sync_tree, session.get("resolved_number"), session["tree"], session_id)
+        await get_tree_journal(session["query"], session_id).save(session["tree"], force=True)
 
 
     vr = VoiceResponse()
@@ -665,23 +870,208 @@ async def crawler_branch(request: Request):
 
 
 
+async def _parse_menu_options(session, session_id: str, call_sid: str, node_key: str, transcript: str) -> dict:
+    """Ask GPT for the menu options in a transcript; {digit: label} or {} if none could be parsed."""
+    try:
+        completion = await gpt_queue.run(
+            session.get("user_id"),
+            client.chat.completions.create,
+            model="gpt-4o",
+            messages=[
+                {
+                    "role": "system",
+                    "content": (
+                        "Extract only the spoken menu options from the transcript. "
+                        "Return a flat JSON object and nothing else."
+                    )
+                },
+                {"role": "user", "content": transcript}
+            ]
+        )
+        parsed_raw = completion.choices[0].message.content.strip()
+    except Exception as e:
+        logging.error(f"[MENU PARSE ERROR] {node_key}: {e}")
+        return {}
+
+    logging.warning(f"[GPT PARSE] {node_key} Raw: {parsed_raw}")
+    session["gpt_menu_raw_ref"] = await run_io(put_blob, session_id, call_sid, f"gpt_menu_{node_key}", parsed_raw)
+    return {str(k): v for k, v in (safe_json_parse(parsed_raw) or {}).items()}
+
+
+def _repeats_parent(phone_tree, key: str, options: dict) -> bool:
+    """True if the menu heard at `key` is just its parent's menu again (back/repeat loops)."""
+    parent = phone_tree.get(make_key(split_key(key)[:-1]))
+    siblings = {d: c.get("label") for d, c in (parent or {}).get("children", {}).items()}
+    return bool(siblings) and siblings == {d: f"{d}: {label}" for d, label in options.items()}
+
+
+def _listen_at_branch(vr, session_id: str, branch: str, send_digits: str, nav=None, hops: int = None,
+                      listen: int = BRANCH_LISTEN_TIMEOUT):
+    """Press `send_digits`, then hand whatever menu plays at `branch` to crawler-branch."""
+    action = f'/twilio/crawler-branch?{callback_query(session_id, branch=branch, nav=nav, hops=hops)}'
+    vr.play(digits=send_digits)
+    vr.append(Gather(input='speech', timeout=listen, speech_timeout='auto', action=action, method='POST'))
+    # Nothing heard: report the branch as a leaf
+    vr.redirect(action, method='POST')
+
+
+async def _record_branch_menu(session_id: str, session, branch: str, speech: str, call_sid: str,
+                              pause: float = None) -> list:
+    """
+    Attach the menu heard at `branch` to the tree; returns the child keys still to explore.
+    `pause` is the measured wait before that menu accepts digits, kept on the node for route replay.
+    """
+    number = normalize_number(session.get("resolved_number"))
+    phone_tree = get_phone_tree(session_id, session, number)
+    journal = get_tree_journal(session["query"], session_id)
+    if pause is not None:
+        phone_tree.insert(branch, pause=pause, on_change=journal.on_change)
+    revalidating = session.get("status") == "revalidating"
+    options = await _parse_menu_options(session, session_id, call_sid, branch, speech) if len(speech) >= 6 else {}
+
+    changed, children = None, []
+    if not options:
+        logging.info(f"[CRAWL LEAF] {branch}: no menu heard")
+        phone_tree.insert(branch, ivr_type="leaf", on_change=journal.on_change)
+    elif _repeats_parent(phone_tree, branch, options):
+        logging.warning(f"[REPEATED MENU DETECTED] {branch} replays its parent menu — not descending")
+        phone_tree.insert(branch, loop_detected=True, on_change=journal.on_change)
+    elif revalidating:
+        # Re-crawl of a cached branch: the menu heard now replaces the cached one
+        changed = phone_tree.set_options(branch, options, ivr_type="menu", on_change=journal.on_change)
+        mark_nav_options(phone_tree, branch, options, on_change=journal.on_change)
+        if not changed:
+            logging.info(f"[TREE REVALIDATE] {branch} unchanged — nothing to sync")
+    else:
+        phone_tree.add_options(branch, options, ivr_type="menu", on_change=journal.on_change)
+        explore = mark_nav_options(phone_tree, branch, options, on_change=journal.on_change)
+        if len(split_key(branch)) < CRAWL_MAX_DEPTH:
+            children = [f"{branch}.{d}" for d in explore]
+        logging.info(f"[TREE UPDATE] Injected menu at {branch}: %s", Summary(options))
+    await journal.save(session["tree"])
+
+    # Concurrent branch calls are serialized by the session lock, so this write is safe
+    await update_session_status_async(session_id, {"tree": session["tree"]})
+    if changed != [] or pause is not None:
+        await run_io(sync_tree, number, session["tree"], session_id, split_key(branch)[:1])
+    return children
+
+
+@app.post("/twilio/leaf-recording")
+async def leaf_recording(request: Request, background_tasks: BackgroundTasks):
+    """<Record> action of a prefix-replay call: end the call, transcribe the node's audio afterwards."""
+    form = await request.form()
+    session_id = request.query_params.get("session_id")
+    branch = request.query_params.get("branch")
+    if session_id and branch and form.get("RecordingUrl"):
+        crawl_coordinator.expect(session_id)
+        background_tasks.add_task(_learn_leaf, session_id, branch, form.get("RecordingUrl"), form.get("CallSid"))
+
+    vr = VoiceResponse()
+    vr.hangup()
+    return Response(content=str(vr), media_type="application/xml")
+
+
+async def _learn_leaf(session_id: str, branch: str, recording_url: str, call_sid: str):
+    """Whisper the node's recording: its transcript is the node's menu, its prompt time the node's pause."""
+    try:
+        transcript, pause, timing = "", None, None
+        local_path = await download_recording(recording_url, call_sid)
+        if local_path:
+            try:
+                timing = await whisper_queue.run(await session_user(session_id), detect_prompt_time, local_path)
+            except Exception as e:
+                logging.error(f"[LEAF WHISPER ERROR] {branch}: {e}")
+        number = (session_store.get(session_id) or await get_session_status_async(session_id) or {}).get("resolved_number")
+        if timing is None:
+            # Nothing was heard, so nothing is known: an empty transcript would mark the
+            # node a leaf, and sync_tree would copy that false leaf into the shared tree
+            if await crawl_coordinator.retry(session_id, normalize_number(number), branch):
+                logging.warning(f"[LEAF RETRY] {branch}: recording unavailable, dialing it again")
+            else:
+                logging.error(f"[LEAF GIVE UP] {branch}: no usable recording after retries, left unexplored")
+            return
+
+        transcript = " ".join(seg["text"] for seg in timing.get("segments", [])).strip()
+        if timing.get("menu_start") is not None or timing.get("open_ended_start") is not None:
+            pause = float(timing["calculated_pause"])
+        try:
+            # The recording starts right as the node is reached, so its timings are the node's own
+            learned = await run_io(learn_from_recording, number, branch, timing)
+            if learned["learned"] and learned["pause"]:
+                pause = float(learned["pause"])
+        except Exception as e:
+            logging.error(f"[LEAF TIMING ERROR] {branch}: {e}")
+        logging.info(f"[LEAF RECORDED] {branch} | pause={pause} | {len(transcript)} chars")
+
+        async with session_lock(session_id):
+            session = session_store.get(session_id) or await get_session_status_async(session_id)
+            if not session:
+                return
+            session_store[session_id] = session
+            children = await _record_branch_menu(session_id, session, branch, transcript, call_sid, pause=pause)
+        if children:
+            await crawl_coordinator.enqueue(session_id, normalize_number(session.get("resolved_number")), children)
+    finally:
+        await crawl_coordinator.resolve(session_id)
+
+
+async def _navigate_next(session_id: str, session, at: str, children: list, call_sid: str, hops: int):
+    """
+    Keep a navigation call going: move within the call to the cheapest branch
+    still to explore, or hang up and let a fresh call dial the next one from the root.
+    """
+    number = normalize_number(session.get("resolved_number"))
+    phone_tree = get_phone_tree(session_id, session, number)
+    frontier = children + [k for k in session.get("nav_frontier") or [] if k not in children]
+    nav_calls = session.get("nav_calls") or {}
+    nav_calls.pop(call_sid, None)
+
+    # After a leaf (or a repeated menu) we don't know which menu the call is in
+    in_menu = (phone_tree.get(at) or {}).get("ivr_type") == "menu" and not phone_tree.get(at).get("loop_detected")
+    move = pick_target(phone_tree, frontier, at) if in_menu and hops < NAV_MAX_NODES_PER_CALL else None
+
+    vr, restart = VoiceResponse(), []
+    if move:
+        target, plan = move
+        frontier.remove(target)
+        nav_calls[call_sid] = target
+        logging.info(f"[NAV MOVE] {call_sid} {at} → {target} via {plan['digits']} (hop {hops + 1})")
+        timing = await run_io(partial(recommend_timing, number, target, defaults={"listen": BRANCH_LISTEN_TIMEOUT}))
+        _listen_at_branch(vr, session_id, target, plan["send_digits"], nav="1", hops=hops + 1, listen=timing["listen"])
+    else:
+        restart, frontier = frontier[:1], frontier[1:]
+        logging.info(f"[NAV END] {call_sid} at {at} after {hops} nodes; next from the root: {restart}")
+        vr.say("Thanks. Response captured. Goodbye.")
+        vr.hangup()
+
+    session["nav_frontier"], session["nav_calls"] = frontier or None, nav_calls or None
+    await update_session_status_async(session_id, {"nav_frontier": frontier or None, "nav_calls": nav_calls or None})
+    if restart:
+        await crawl_coordinator.enqueue(session_id, number, restart)
+    return Response(content=str(vr), media_type="application/xml")
+
+
 @app.post("/update-path")
 async def update_path(data: dict):
     session_id = data.get("session_id")
     path = data.get("path")
     logging.info(f"[PATH UPDATED] {session_id} → {path}")
-    update_session_status(session_id, {"path": path})
+    session = session_store.get(session_id)
+    if session is not None:
+        session["path"] = path
+    await update_session_status_async(session_id, {"path": path})
     return {"ok": True}
 
 @app.get("/session/{session_id}")
 async def get_session(session_id: str):
-    session = session_store.get(session_id) or get_session_status(session_id)
-    session_store[session_id] = session
-    logging.info(f"[FIREBASE UPDATE] Session Tree: {json.dumps(session.get('tree', {}), indent=2)[:1000]}")
-
+    session = session_store.get(session_id) or await get_session_status_async(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
-    return session
+
+    session_store[session_id] = session
+    logging.debug("[SESSION READ] Session Tree: %s", LazyJSON(session.get("tree", {})))
+    return public_document(session)
 
 @app.post("/twilio/gather")
 async def gather_result(request: Request):
@@ -701,30 +1091,76 @@ async def gather_result(request: Request):
     return Response(content=str(vr), media_type="application/xml")
 
 @app.post("/clear-session")
-def clear(session_id: str):
-    delete_session(session_id)
+async def clear(session_id: str):
+    await delete_session_async(session_id)
+    session_store.pop(session_id, None)
     return {"status": "deleted"}
 
 
+@app.get("/tree-search")
+async def tree_search(q: str, limit: int = 10, number: str = None):
+    """Ranked tree nodes across every mapped number whose labels match `q`."""
+    if not label_index.loaded:
+        await run_io(label_index.ensure_loaded)
+    start = time.perf_counter()
+    results = label_index.search(q, limit=limit, number=normalize_number(number) if number else None)
+    return {
+        "query": q,
+        "results": results,
+        "took_ms": round((time.perf_counter() - start) * 1000, 2),
+    }
 
-        "tree": {
-            "1": {"key": "1", "label": "1: Sales", "selected": False},
-            "2": {"key": "2", "label": "2: Support", "selected": False},
-            "3": {"key": "3", "label": "3: Billing", "selected": False}
-        }
-    })
 
-    return SessionInitResponse(
-        session_id=session_id,
-        status="initializing",
-        created_at=timestamp
-    )
+@app.get("/session-cache/stats")
+def session_cache_stats():
+    return {
+        **session_store.stats(),
+        "label_index": label_index.stats(),
+        "reads": get_read_stats(),
+        "locks": session_locks.stats(),
+        "shared_state": shared_state_stats(),
+        "routing": routing_stats(),
+        "crawl": crawl_coordinator.stats(),
+        "calls": call_scheduler.stats(),
+    }
 
 
-@app.get("/session/{session_id}")
-async def get_session(session_id: str):
-    session = session_store.get(session_id)
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-    return session
+@app.get("/fair-queues/stats")
+def fair_queue_stats():
+    """Per-user in-flight and queued work for dialing, Whisper and GPT."""
+    return {
+        "dial": call_scheduler.stats()["users"],
+        "whisper": whisper_queue.stats(),
+        "gpt": gpt_queue.stats(),
+    }
+
+
+@app.get("/call-scheduler/stats")
+def call_scheduler_stats():
+    """Queue depth, wait times and throttling of outbound calls, per lane."""
+    return {"scheduler": call_scheduler.stats(), "crawl": crawl_coordinator.stats()}
+
+
+@app.on_event("startup")
+def start_shared_state():
+    if XDIAL_SHARED_STATE:
+        enable_shared_state()
+
+
+@app.on_event("startup")
+async def resolve_public_url():
+    # Webhook URLs are built from this cache; calls never look up the tunnel themselves
+    await start_public_url_refresh()
+
+
+@app.on_event("shutdown")
+def flush_session_cache():
+    # Write every cached session back before the worker exits
+    session_store.flush()
+
 
+@app.on_event("shutdown")
+async def close_http_clients():
+    await stop_public_url_refresh()
+    await close_twilio_client()
+    await close_forward_session()
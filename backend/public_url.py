@@ -0,0 +1,87 @@
+# backend/public_url.py
+
+"""
+Public base URL for Twilio webhooks.
+
+Twilio has to reach crawler-entry, recording-status and status-callback from
+the internet. The base URL comes from PUBLIC_BASE_URL when set (a deployed
+host, or a reserved ngrok domain), otherwise from the local ngrok agent's
+tunnel API. Either way it is resolved once and cached; a background task
+re-reads the tunnel API every PUBLIC_URL_REFRESH seconds so a restarted
+tunnel is picked up, and a failed lookup keeps the last known URL instead of
+failing calls. Building a callback URL never does network I/O.
+"""
+
+import os
+import asyncio
+import logging
+import requests
+
+from firebase_client import run_io
+
+
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").strip().rstrip("/")
+NGROK_API_URL = os.getenv("NGROK_API_URL", "http://127.0.0.1:4040/api/tunnels")
+PUBLIC_URL_REFRESH = float(os.getenv("PUBLIC_URL_REFRESH", "60"))
+NGROK_API_TIMEOUT = 3
+
+_base_url = PUBLIC_BASE_URL or None
+_refresh_task = None
+
+
+def _tunnel_url():
+    res = requests.get(NGROK_API_URL, timeout=NGROK_API_TIMEOUT)
+    tunnels = res.json().get("tunnels") or []
+    # Twilio wants https; the agent may also expose an http twin of the same tunnel
+    urls = sorted((t.get("public_url") or "" for t in tunnels), key=lambda u: not u.startswith("https://"))
+    return urls[0].rstrip("/") if urls and urls[0] else None
+
+
+def refresh_public_url():
+    """Re-read the tunnel API; keeps the cached URL when the lookup fails. Returns the current URL."""
+    global _base_url
+    if PUBLIC_BASE_URL:
+        return _base_url
+    try:
+        url = _tunnel_url()
+    except Exception as e:
+        logging.error(f"[PUBLIC URL] Tunnel lookup failed, keeping {_base_url}: {e}")
+        return _base_url
+    if url and url != _base_url:
+        logging.info(f"[PUBLIC URL] {_base_url} → {url}")
+        _base_url = url
+    return _base_url
+
+
+def public_base_url():
+    """The cached base URL; None until PUBLIC_BASE_URL or a tunnel lookup provided one."""
+    return _base_url
+
+
+def public_url(path: str, query: str = "") -> str:
+    base = public_base_url()
+    if not base:
+        raise RuntimeError("Public base URL unknown: set PUBLIC_BASE_URL or start ngrok")
+    return f"{base}{path}?{query}" if query else f"{base}{path}"
+
+
+async def _refresh_loop():
+    while True:
+        await asyncio.sleep(PUBLIC_URL_REFRESH)
+        await run_io(refresh_public_url)
+
+
+async def start_public_url_refresh():
+    """Resolve the URL now and, for tunnels, keep it fresh in the background."""
+    global _refresh_task
+    url = await run_io(refresh_public_url)
+    logging.info(f"[PUBLIC URL] Using {url} ({'PUBLIC_BASE_URL' if PUBLIC_BASE_URL else 'ngrok'})")
+    if not PUBLIC_BASE_URL and _refresh_task is None:
+        _refresh_task = asyncio.create_task(_refresh_loop())
+
+
+async def stop_public_url_refresh():
+    global _refresh_task
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+        _refresh_task = None
@@ -0,0 +1,164 @@
+# backend/routing.py
+
+"""
+Sticky routing of Twilio callbacks.
+
+Each session is owned by one worker, picked with a consistent hash of its
+session_id. Callback URLs carry the owner as a `shard` token, and any worker
+that receives a /twilio/* webhook for a session it does not own forwards it to
+the owner. Per-session memory (session dicts, transcript blobs, locks) then
+stays hot on a single worker, and adding a worker only moves ~1/N of sessions.
+
+Configure every worker with the same list and its own id:
+
+    XDIAL_WORKERS="w0=http://127.0.0.1:8001,w1=http://127.0.0.1:8002"
+    XDIAL_WORKER_ID=w0
+
+With no XDIAL_WORKERS set, routing is disabled and everything is handled locally.
+"""
+
+import os
+import bisect
+import hashlib
+import logging
+import aiohttp
+from fastapi import Request
+from fastapi.responses import Response
+
+
+XDIAL_WORKERS = os.getenv("XDIAL_WORKERS", "")
+XDIAL_WORKER_ID = os.getenv("XDIAL_WORKER_ID", "")
+ROUTING_VNODES = int(os.getenv("ROUTING_VNODES", "64"))
+FORWARD_TIMEOUT = float(os.getenv("ROUTING_FORWARD_TIMEOUT", "15"))
+FORWARDED_HEADER = "X-XDial-Forwarded"
+
+# Hop-by-hop headers that must not be copied onto the forwarded request
+_SKIP_HEADERS = {"host", "content-length", "connection", "keep-alive", "transfer-encoding"}
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes."""
+
+    def __init__(self, nodes=(), vnodes: int = ROUTING_VNODES):
+        self.vnodes = vnodes
+        self._points = []
+        self._owners = {}
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: str):
+        for i in range(self.vnodes):
+            point = _hash(f"{node}#{i}")
+            self._owners[point] = node
+            bisect.insort(self._points, point)
+
+    def remove(self, node: str):
+        self._points = [p for p in self._points if self._owners[p] != node]
+        self._owners = {p: n for p, n in self._owners.items() if n != node}
+
+    def get(self, key: str):
+        if not self._points:
+            return None
+        idx = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[self._points[idx]]
+
+
+def _parse_workers(spec: str) -> dict:
+    workers = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        worker_id, _, url = item.partition("=")
+        workers[worker_id.strip()] = url.strip().rstrip("/")
+    return workers
+
+
+workers = _parse_workers(XDIAL_WORKERS)
+ring = HashRing(workers)
+# Forwarding is plain async HTTP on its own pooled session, so a burst of webhooks
+# never takes threads from the storage I/O pool
+_http = None
+_stats = {"local": 0, "forwarded": 0, "forward_errors": 0}
+
+
+def routing_enabled() -> bool:
+    return bool(workers) and XDIAL_WORKER_ID in workers
+
+
+def shard_for(session_id: str):
+    """Worker id that owns this session, or None when routing is off."""
+    if not routing_enabled() or not session_id:
+        return None
+    return ring.get(session_id)
+
+
+def shard_params(session_id: str) -> dict:
+    """Extra query params to put on every callback URL for this session."""
+    shard = shard_for(session_id)
+    return {"shard": shard} if shard else {}
+
+
+def _owner_for(request: Request):
+    # An explicit token wins so in-flight calls keep their owner while the ring changes
+    shard = request.query_params.get("shard")
+    if shard in workers:
+        return shard
+    return shard_for(request.query_params.get("session_id"))
+
+
+def _forward_session() -> aiohttp.ClientSession:
+    global _http
+    if _http is None or _http.closed:
+        _http = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=FORWARD_TIMEOUT))
+    return _http
+
+
+async def close_forward_session():
+    global _http
+    if _http is not None:
+        await _http.close()
+        _http = None
+
+
+async def _forward(request: Request, owner: str) -> Response:
+    url = f"{workers[owner]}{request.url.path}"
+    if request.url.query:
+        url = f"{url}?{request.url.query}"
+    body = await request.body()
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in _SKIP_HEADERS}
+    headers[FORWARDED_HEADER] = XDIAL_WORKER_ID
+
+    async with _forward_session().request(request.method, url, data=body, headers=headers) as res:
+        return Response(
+            content=await res.read(),
+            status_code=res.status,
+            media_type=res.headers.get("content-type"),
+        )
+
+
+async def sticky_routing_middleware(request: Request, call_next):
+    """Forward /twilio/* callbacks to the worker that owns their session."""
+    if not routing_enabled() or not request.url.path.startswith("/twilio/") \
+            or FORWARDED_HEADER in request.headers:
+        return await call_next(request)
+
+    owner = _owner_for(request)
+    if owner is None or owner == XDIAL_WORKER_ID:
+        _stats["local"] += 1
+        return await call_next(request)
+
+    try:
+        response = await _forward(request, owner)
+        _stats["forwarded"] += 1
+        return response
+    except Exception as e:
+        # Owner unreachable: shared state lets us handle it here instead of dropping the webhook
+        _stats["forward_errors"] += 1
+        logging.error(f"[ROUTING ERROR] Could not forward {request.url.path} to {owner}: {e}")
+        return await call_next(request)
+
+
+def routing_stats() -> dict:
+    return {**_stats, "worker_id": XDIAL_WORKER_ID, "workers": list(workers)}
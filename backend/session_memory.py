@@ -3,7 +3,302 @@
 """
 Shared in-memory session store for X-Dial backend.
 Used to persist session states across requests without needing constant Firebase reads.
+
+The store is a bounded cache: least-recently-used sessions are evicted once the
+entry or byte budget is exceeded, and sessions idle for longer than the TTL are
+dropped on the next access. Evicted sessions are written back to persistent
+storage so nothing is lost when a worker sheds memory. Write-backs run on the
+I/O pool after the cache lock is released, so an eviction triggered inside a
+request handler never waits on the network.
 """
 
-# Global in-memory session dictionary
-session_store = {}
+import os
+import sys
+import copy
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from session_model import SessionRecord
+
+
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "500"))
+SESSION_CACHE_MAX_BYTES = int(os.getenv("SESSION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "3600"))
+
+_MISSING = object()
+
+
+def approx_size(obj, _seen=None) -> int:
+    """
+    Rough deep size of a JSON-like object in bytes.
+    Walks dicts, lists, tuples, sets and slots-based records; shared objects are only counted once.
+    """
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += approx_size(k, _seen) + approx_size(v, _seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += approx_size(item, _seen)
+    elif hasattr(type(obj), "__slots__"):
+        # Slots-based records (SessionRecord, Segments)
+        for name in type(obj).__slots__:
+            size += approx_size(getattr(obj, name, None), _seen)
+    return size
+
+
+def _snapshot(session):
+    # Records encode to their compact binary form, far cheaper than a deepcopy of the segment arrays
+    return session.to_bytes() if isinstance(session, SessionRecord) else copy.deepcopy(session)
+
+
+def _write_back_to_firebase(session_id: str, session: dict):
+    # Imported lazily so importing the store never touches Firebase credentials
+    from firebase_client import update_session_status
+    update_session_status(session_id, session)
+
+
+def _submit_io(fn, *args):
+    from firebase_client import submit_io
+    return submit_io(fn, *args)
+
+
+class SessionCache:
+    """
+    LRU + idle-TTL session cache with a byte budget.
+
+    Keeps the dict surface the handlers already use (`get`, `[]`, `in`, `pop`).
+    Sizes are measured when a session is stored; sessions mutated in place are
+    re-measured the next time they are assigned back into the store.
+    """
+
+    def __init__(self, max_entries: int = SESSION_CACHE_MAX_ENTRIES, max_bytes: int = SESSION_CACHE_MAX_BYTES,
+                 ttl: float = SESSION_CACHE_TTL, write_back=_write_back_to_firebase, clock=time.monotonic,
+                 submit=_submit_io):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.write_back = write_back
+        self._submit = submit
+        self._clock = clock
+        self._lock = threading.RLock()
+        # session_id -> [session, size_bytes, last_access]
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # Evicted sessions still being written back; a read in the meantime gets them back
+        self._writing = {}
+        # Write-backs collected under the lock, submitted once it is released
+        self._queued = []
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions_lru": 0,
+            "evictions_ttl": 0,
+            "evictions_bytes": 0,
+            "flushes": 0,
+            "write_backs": 0,
+            "write_back_errors": 0,
+        }
+
+    # ── dict surface ──────────────────────────────────────────────
+
+    def get(self, session_id, default=None):
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None and session_id in self._writing:
+                # Storage may not have it yet: revive the in-flight copy instead of reading a stale one
+                self._put(session_id, self._writing[session_id])
+                entry = self._entries[session_id]
+                self._stats["hits"] += 1
+            elif entry is None or self._expired(entry):
+                if entry is not None:
+                    self._evict(session_id, "evictions_ttl")
+                self._stats["misses"] += 1
+                entry = None
+            else:
+                entry[2] = self._clock()
+                self._entries.move_to_end(session_id)
+                self._stats["hits"] += 1
+        self._drain()
+        return default if entry is None else entry[0]
+
+    def __getitem__(self, session_id):
+        session = self.get(session_id, _MISSING)
+        if session is _MISSING:
+            raise KeyError(session_id)
+        return session
+
+    def __setitem__(self, session_id, session):
+        with self._lock:
+            self._put(session_id, session)
+        self._drain()
+
+    def __delitem__(self, session_id):
+        with self._lock:
+            entry = self._entries.pop(session_id)
+            self._bytes -= entry[1]
+
+    def __contains__(self, session_id):
+        return self.get(session_id, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self._entries)
+
+    def pop(self, session_id, default=None):
+        """Drop a session without writing it back (e.g. after it was deleted remotely)."""
+        with self._lock:
+            self._writing.pop(session_id, None)
+            entry = self._entries.pop(session_id, None)
+            if entry is None:
+                return default
+            self._bytes -= entry[1]
+            return entry[0]
+
+    def _put(self, session_id, session):
+        size = approx_size(session)
+        old = self._entries.pop(session_id, None)
+        if old is not None:
+            self._bytes -= old[1]
+        self._entries[session_id] = [session, size, self._clock()]
+        self._bytes += size
+        self._enforce_limits(keep=session_id)
+
+    # ── eviction ──────────────────────────────────────────────────
+
+    def _expired(self, entry) -> bool:
+        return self.ttl > 0 and self._clock() - entry[2] > self.ttl
+
+    def _evict(self, session_id, reason: str):
+        session, size, _ = self._entries.pop(session_id)
+        self._bytes -= size
+        self._stats[reason] += 1
+        logging.info(f"[SESSION EVICT] {session_id} ({reason}, ~{size} bytes)")
+        if self.write_back is None:
+            return
+        # Snapshot now: the live session may be revived and mutated while the copy is written
+        self._writing[session_id] = session
+        self._queued.append((session_id, session, _snapshot(session)))
+
+    def _drain(self) -> list:
+        """Hand queued write-backs to the I/O pool. Call without holding the lock."""
+        with self._lock:
+            queued, self._queued = self._queued, []
+        return [self._submit(self._write_back, *item) for item in queued]
+
+    def _write_back(self, session_id, session, snapshot):
+        try:
+            if isinstance(snapshot, bytes):
+                snapshot = SessionRecord.from_bytes(snapshot)
+            self.write_back(session_id, snapshot)
+            with self._lock:
+                self._stats["write_backs"] += 1
+        except Exception as e:
+            with self._lock:
+                self._stats["write_back_errors"] += 1
+            logging.error(f"[SESSION WRITE-BACK ERROR] {session_id}: {e}")
+        finally:
+            with self._lock:
+                if self._writing.get(session_id) is session:
+                    del self._writing[session_id]
+
+    def _enforce_limits(self, keep=None):
+        self._expire()
+        while len(self._entries) > self.max_entries:
+            self._evict(next(iter(self._entries)), "evictions_lru")
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            oldest = next(iter(self._entries))
+            if oldest == keep:
+                break
+            self._evict(oldest, "evictions_bytes")
+
+    def expire(self) -> int:
+        """Evict every idle session past the TTL. Returns how many were dropped."""
+        with self._lock:
+            dropped = self._expire()
+        self._drain()
+        return dropped
+
+    def _expire(self) -> int:
+        # Entries are kept in access order, so idle sessions sit at the front
+        dropped = 0
+        while self._entries:
+            oldest = next(iter(self._entries))
+            if not self._expired(self._entries[oldest]):
+                break
+            self._evict(oldest, "evictions_ttl")
+            dropped += 1
+        return dropped
+
+    def flush(self):
+        """Write back and drop every cached session, waiting for the writes (used on shutdown)."""
+        with self._lock:
+            for sid in list(self._entries):
+                self._evict(sid, "flushes")
+        for future in self._drain():
+            future.result()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "writing_back": len(self._writing),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+            }
+
+
+class SessionLocks:
+    """
+    One asyncio lock per session, created on demand and dropped once nobody
+    holds or waits on it. asyncio.Lock wakes waiters in FIFO order, so Twilio
+    callbacks for the same session apply in arrival order while different
+    sessions never contend.
+    """
+
+    def __init__(self):
+        # session_id -> [lock, holders + waiters]
+        self._locks = {}
+        self._stats = {"acquired": 0, "contended": 0}
+
+    @asynccontextmanager
+    async def hold(self, session_id: str):
+        entry = self._locks.get(session_id)
+        if entry is None:
+            entry = self._locks[session_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        if entry[0].locked():
+            self._stats["contended"] += 1
+        try:
+            async with entry[0]:
+                self._stats["acquired"] += 1
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._locks.pop(session_id, None)
+
+    def stats(self) -> dict:
+        return {**self._stats, "active": len(self._locks)}
+
+
+# Global in-memory session cache
+session_store = SessionCache()
+session_locks = SessionLocks()
+
+
+def session_lock(session_id: str):
+    """`async with session_lock(sid):` around any read-modify-write of a session."""
+    return session_locks.hold(session_id)
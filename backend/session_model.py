@@ -0,0 +1,326 @@
+# backend/session_model.py
+
+"""
+Typed session record for X-Dial.
+
+Sessions used to be free-form dicts patched with setdefault all over main.py.
+SessionRecord gives them a fixed, slots-based layout while keeping the dict
+surface the handlers use (`session["x"]`, `.get`, `.setdefault`, `.pop`), so
+records and plain Firebase documents can be passed around interchangeably.
+
+to_dict() / from_dict() convert to and from the Firebase/JSON document shape.
+Apart from defaults filled in for missing modelled fields, a document
+round-trips as it came in: unknown keys are kept in `extra`, legacy
+list-shaped whisper_segments stay lists, and a field set to None (or popped)
+is written back as None so a storage update deletes it.
+
+Encodings for local caches (the session cache snapshots evicted sessions with
+them instead of deep-copying the record):
+- to_json() / from_json(): the same document as compact JSON
+- to_bytes() / from_bytes(): a struct-framed binary form — the document minus
+  whisper_segments as compact JSON, then the segment timings as raw
+  little-endian doubles. Plain data only, nothing is executed on decode.
+"""
+
+import json
+import struct
+import sys
+from array import array
+from dataclasses import dataclass, field, fields
+
+
+_SEGMENT_CORE = ("start", "end", "text")
+
+
+@dataclass(slots=True)
+class Segments:
+    """
+    Whisper segments as parallel arrays instead of one dict per segment.
+    Any per-segment keys beyond start/end/text (tokens, words, logprobs) are
+    kept in `rest` so converting an old document back is exact.
+    """
+    start: array = field(default_factory=lambda: array("d"))
+    end: array = field(default_factory=lambda: array("d"))
+    text: list = field(default_factory=list)
+    rest: list = None
+    legacy: bool = False  # came in as Whisper's list of dicts; written back the same way
+
+    @classmethod
+    def from_whisper(cls, segments: list, keep_rest: bool = True) -> "Segments":
+        seg = cls(
+            array("d", (s.get("start", 0.0) for s in segments)),
+            array("d", (s.get("end", 0.0) for s in segments)),
+            [s.get("text", "") for s in segments],
+        )
+        if keep_rest:
+            rest = [{k: v for k, v in s.items() if k not in _SEGMENT_CORE} for s in segments]
+            seg.rest = rest if any(rest) else None
+        return seg
+
+    @classmethod
+    def coerce(cls, value) -> "Segments":
+        """Accept a Segments, a compact dict or a legacy list of segment dicts."""
+        if value is None:
+            return cls()
+        if isinstance(value, cls):
+            return value
+        if isinstance(value, dict):
+            return cls.from_dict(value)
+        seg = cls.from_whisper(value)
+        seg.legacy = True
+        return seg
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Segments":
+        return cls(
+            array("d", data.get("start", [])),
+            array("d", data.get("end", [])),
+            list(data.get("text", [])),
+            data.get("rest"),
+        )
+
+    def to_dict(self) -> dict:
+        data = {"start": self.start.tolist(), "end": self.end.tolist(), "text": list(self.text)}
+        if self.rest:
+            data["rest"] = self.rest
+        return data
+
+    def to_list(self) -> list:
+        """Back to Whisper's list-of-dicts shape."""
+        out = []
+        for i, text in enumerate(self.text):
+            seg = {"start": self.start[i], "end": self.end[i], "text": text}
+            if self.rest:
+                seg.update(self.rest[i])
+            out.append(seg)
+        return out
+
+    def joined_text(self) -> str:
+        return " ".join(self.text)
+
+    def __len__(self):
+        return len(self.text)
+
+
+@dataclass(slots=True)
+class SessionRecord:
+    user_id: str = None
+    query: str = None
+    created_at: str = None
+    status: str = None
+    path: str = "root"
+    resolved_number: str = None
+    tree: dict = field(default_factory=dict)
+    tree_source: str = None
+    tree_updated_at: float = None
+
+    # crawl state
+    ivr_type: str = None
+    ivr_phase: str = None
+    speech_history: list = field(default_factory=list)
+    last_menu: dict = field(default_factory=dict)
+    pending_digits: list = field(default_factory=list)
+    menu_repeat_count: int = 0
+    tree_path_stack: list = field(default_factory=list)
+    retry_attempts: int = None
+    reroute_count: int = None
+    should_check_speech: bool = None
+    completed: bool = None
+    loop_detected: bool = None
+
+    # call / whisper state
+    twilio_call_sid: str = None
+    recording_ready: bool = None
+    whisper_finished: bool = None
+    calculated_pause: float = None
+    timing_debug: dict = None
+    whisper_summary: dict = None
+    whisper_segments: Segments = None
+    whisper_segments_ref: dict = None
+    speech_log_ref: dict = None
+    gpt_menu_raw_ref: dict = None
+    query_pending: bool = None
+    query_spoken: bool = None
+    last_speech: str = None
+
+    # any key not modelled above, kept verbatim
+    extra: dict = field(default_factory=dict)
+    # keys explicitly set to None or popped; to_dict emits them as None (a delete)
+    cleared: set = field(default_factory=set)
+
+    # ── conversion ────────────────────────────────────────────────
+
+    @classmethod
+    def from_dict(cls, data) -> "SessionRecord":
+        if isinstance(data, cls):
+            return data
+        record = cls()
+        for key, value in (data or {}).items():
+            record[key] = value
+        return record
+
+    def to_dict(self) -> dict:
+        out = dict.fromkeys(self.cleared)
+        for name in _FIELD_NAMES:
+            value = getattr(self, name)
+            if value is None:
+                continue
+            if isinstance(value, Segments):
+                value = value.to_list() if value.legacy else value.to_dict()
+            out[name] = value
+        out.update(self.extra)
+        return out
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, text) -> "SessionRecord":
+        return cls.from_dict(json.loads(text))
+
+    def to_bytes(self) -> bytes:
+        doc = self.to_dict()
+        seg = self.whisper_segments
+        if seg is None:
+            return _HEADER.pack(_BINARY_MAGIC, 0, 0) + _compact(doc)
+        del doc["whisper_segments"]
+        flags = _SEG_PRESENT | (_SEG_LEGACY if seg.legacy else 0)
+        body = _compact(doc)
+        tail = _compact([seg.text, seg.rest])
+        return b"".join((
+            _HEADER.pack(_BINARY_MAGIC, flags, len(seg)), _LENGTH.pack(len(body)), body,
+            _le_bytes(seg.start), _le_bytes(seg.end), tail,
+        ))
+
+    @classmethod
+    def from_bytes(cls, blob: bytes) -> "SessionRecord":
+        magic, flags, count = _HEADER.unpack_from(blob)
+        if magic != _BINARY_MAGIC:
+            raise ValueError("Not an encoded SessionRecord")
+        offset = _HEADER.size
+        if not flags & _SEG_PRESENT:
+            return cls.from_dict(json.loads(blob[offset:]))
+        (length,) = _LENGTH.unpack_from(blob, offset)
+        offset += _LENGTH.size
+        record = cls.from_dict(json.loads(blob[offset:offset + length]))
+        offset += length
+        width = 8 * count
+        start, end = _le_array(blob[offset:offset + width]), _le_array(blob[offset + width:offset + 2 * width])
+        text, rest = json.loads(blob[offset + 2 * width:])
+        record.whisper_segments = Segments(start, end, text, rest, legacy=bool(flags & _SEG_LEGACY))
+        return record
+
+    # ── dict surface used by the handlers ─────────────────────────
+
+    def __getitem__(self, key):
+        if key in _FIELD_SET:
+            value = getattr(self, key)
+            if value is None:
+                raise KeyError(key)
+            return value
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        if value is None:
+            self.cleared.add(key)
+        else:
+            self.cleared.discard(key)
+        if key in _FIELD_SET:
+            if key == "whisper_segments" and value is not None:
+                value = Segments.coerce(value)
+            setattr(self, key, value)
+        elif value is None:
+            self.extra.pop(key, None)
+        else:
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.pop(key)
+
+    def __contains__(self, key):
+        if key in _FIELD_SET:
+            return getattr(self, key) is not None
+        return key in self.extra
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __bool__(self):
+        return True
+
+    def keys(self):
+        return [name for name in _FIELD_NAMES if getattr(self, name) is not None] + list(self.extra)
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self.get(key, default)
+
+    def pop(self, key, *default):
+        if key in _FIELD_SET:
+            value = getattr(self, key)
+            if value is None:
+                if default:
+                    return default[0]
+                raise KeyError(key)
+            setattr(self, key, None)
+            self.cleared.add(key)
+            return value
+        if key in self.extra:
+            self.cleared.add(key)
+        return self.extra.pop(key, *default)
+
+    def update(self, other=(), **kwargs):
+        items = other.items() if hasattr(other, "items") else other
+        for key, value in items:
+            self[key] = value
+        for key, value in kwargs.items():
+            self[key] = value
+
+
+_FIELD_NAMES = tuple(f.name for f in fields(SessionRecord) if f.name not in ("extra", "cleared"))
+_FIELD_SET = frozenset(_FIELD_NAMES)
+
+# to_bytes framing: magic, segment flags, segment count [, document length]
+_BINARY_MAGIC = b"XSR2"
+_HEADER = struct.Struct("<4sBI")
+_LENGTH = struct.Struct("<I")
+_SEG_PRESENT, _SEG_LEGACY = 1, 2
+
+
+def _compact(value) -> bytes:
+    return json.dumps(value, separators=(",", ":")).encode()
+
+
+def _le_bytes(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values = array("d", values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _le_array(raw: bytes) -> array:
+    values = array("d")
+    values.frombytes(raw)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def as_document(session) -> dict:
+    """Plain dict for storage/JSON, whether given a SessionRecord or a dict."""
+    return session.to_dict() if isinstance(session, SessionRecord) else session
@@ -0,0 +1,61 @@
+# backend/shared_state.py
+
+"""
+Shared session state for running several uvicorn workers on one box.
+
+Every worker keeps its own in-memory session_store, but all of them read and
+write the same storage backend (use XDIAL_STORAGE=sqlite for a local file shared
+by N processes). When another worker changes a session, the change log tells us
+and the local copies are dropped, so the next access reads the fresh document.
+
+Enable with XDIAL_SHARED_STATE=1, then e.g.:
+
+    XDIAL_STORAGE=sqlite XDIAL_SHARED_STATE=1 uvicorn main:app --workers 4
+"""
+
+import os
+import logging
+from storage import get_storage, split_path, PROCESS_ORIGIN
+from session_memory import session_store
+from firebase_client import invalidate_session, watch_sessions
+
+
+XDIAL_SHARED_STATE = os.getenv("XDIAL_SHARED_STATE", "0").lower() in ("1", "true", "yes")
+
+_watch_handle = None
+_stats = {"remote_changes": 0, "invalidations": 0}
+
+
+def _on_session_change(event):
+    # The backend only reports other processes' writes; our own copies are already current
+    parts = split_path(event.path)
+    if len(parts) < 2:
+        return
+    session_id = parts[1]
+    _stats["remote_changes"] += 1
+    if session_store.pop(session_id, None) is not None:
+        _stats["invalidations"] += 1
+    invalidate_session(session_id)
+
+
+def enable_shared_state():
+    """Subscribe to session changes from other workers. Safe to call more than once."""
+    global _watch_handle
+    if _watch_handle is not None:
+        return
+    # Eviction write-back stays on so fields a handler only set in memory still reach
+    # storage; a change from another worker drops our copy first (_on_session_change),
+    # so a write-back never replays a copy older than that change
+    _watch_handle = watch_sessions(_on_session_change)
+    logging.info(f"[SHARED STATE] Watching session changes via {type(get_storage()).__name__} as {PROCESS_ORIGIN}")
+
+
+def disable_shared_state():
+    global _watch_handle
+    if _watch_handle is not None:
+        _watch_handle.close()
+        _watch_handle = None
+
+
+def shared_state_stats() -> dict:
+    return {**_stats, "enabled": _watch_handle is not None, "origin": PROCESS_ORIGIN}
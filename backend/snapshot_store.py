@@ -0,0 +1,320 @@
+# backend/snapshot_store.py
+
+"""
+Content-addressed snapshot store for phone trees.
+
+Full tree snapshots are mostly the same subtrees over and over, across
+timestamps and across sessions for the same number. Here every JSON object in a
+tree is stored once under the hash of its content; an object's nested objects
+(e.g. a node's "children" map and each child) are stored as references, so
+a snapshot that changed one leaf only adds the objects on that leaf's path.
+
+    <SNAPSHOT_STORE_DIR>/
+        objects.pack     zlib-compressed objects, appended back to back
+        objects.idx      "<hash> <offset> <length>" per object
+        manifests.jsonl  {"name", "root", "created_at", ...} per snapshot
+
+Objects live in one pack file rather than one file each — tree nodes are a
+few hundred bytes and would otherwise each cost a full filesystem block.
+Any snapshot is rebuilt on demand with load(name) / get_tree(root).
+
+Migrate an existing snapshots/ directory and report the savings:
+
+    python snapshot_store.py migrate --dir snapshots
+    python snapshot_store.py stats
+"""
+
+import os
+import re
+import sys
+import copy
+import json
+import time
+import zlib
+import hashlib
+import logging
+import argparse
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_STORE_DIR = os.getenv("SNAPSHOT_STORE_DIR", os.path.join(SNAPSHOT_DIR, "store"))
+SNAPSHOT_ZLIB_LEVEL = int(os.getenv("SNAPSHOT_ZLIB_LEVEL", "6"))
+
+# Preset dictionary for the tiny per-node objects; changing it makes existing packs unreadable
+_ZDICT = b'{"r":{"children":""},"v":{"ivr_type":"menu","key":"root.","label":": Unknown","selected":false}}'
+
+
+def _canonical(obj) -> bytes:
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _compress(raw: bytes) -> bytes:
+    c = zlib.compressobj(SNAPSHOT_ZLIB_LEVEL, zdict=_ZDICT)
+    return c.compress(raw) + c.flush()
+
+
+def _decompress(packed: bytes) -> bytes:
+    d = zlib.decompressobj(zdict=_ZDICT)
+    return d.decompress(packed) + d.flush()
+
+
+class SnapshotStore:
+    def __init__(self, directory: str = SNAPSHOT_STORE_DIR):
+        self.directory = directory
+        self.pack_path = os.path.join(directory, "objects.pack")
+        self.idx_path = os.path.join(directory, "objects.idx")
+        self.manifest_path = os.path.join(directory, "manifests.jsonl")
+        self._index = {}
+        self._idx_pos = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    # ── objects ───────────────────────────────────────────────────
+
+    def _load_index(self):
+        # Read whatever other processes appended since we last looked
+        if not os.path.exists(self.idx_path):
+            return
+        with open(self.idx_path, "r", encoding="utf-8") as f:
+            f.seek(self._idx_pos)
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                digest, offset, length = line.split()
+                self._index[digest] = (int(offset), int(length))
+                self._idx_pos += len(line.encode("utf-8"))
+
+    def has(self, digest: str) -> bool:
+        if digest not in self._index:
+            self._load_index()
+        return digest in self._index
+
+    def _write_objects(self, objects: list):
+        """Append (digest, raw) pairs that are not stored yet."""
+        with self._lock, open(self.pack_path, "ab") as pack:
+            if fcntl:
+                fcntl.flock(pack, fcntl.LOCK_EX)
+            try:
+                self._load_index()
+                lines = []
+                for digest, raw in objects:
+                    if digest in self._index:
+                        continue
+                    packed = _compress(raw)
+                    offset = pack.seek(0, os.SEEK_END)
+                    pack.write(packed)
+                    self._index[digest] = (offset, len(packed))
+                    lines.append(f"{digest} {offset} {len(packed)}\n")
+                pack.flush()
+                if lines:
+                    with open(self.idx_path, "a", encoding="utf-8") as idx:
+                        idx.write("".join(lines))
+                    self._idx_pos += sum(len(line) for line in lines)
+            finally:
+                if fcntl:
+                    fcntl.flock(pack, fcntl.LOCK_UN)
+
+    def put_tree(self, tree: dict) -> str:
+        """Store a tree (any JSON object); returns the hash of its root object."""
+        if not isinstance(tree, dict):
+            raise ValueError("Snapshots must be JSON objects")
+        pending = {}
+
+        def put(value):
+            if not isinstance(value, dict):
+                return None
+            obj = {"v": {}, "r": {}}
+            for k, v in value.items():
+                ref = put(v)
+                if ref is None:
+                    obj["v"][k] = v
+                else:
+                    obj["r"][k] = ref
+            raw = _canonical(obj)
+            digest = hashlib.sha1(raw).hexdigest()[:20]
+            if digest not in self._index:
+                pending[digest] = raw
+            return digest
+
+        root = put(tree)
+        if pending:
+            self._write_objects(list(pending.items()))
+        return root
+
+    def get_tree(self, root: str) -> dict:
+        """Rebuild the tree stored under `root`."""
+        cache = {}
+        handle = open(self.pack_path, "rb")
+
+        def get(digest):
+            if digest in cache:
+                # Identical subtrees are decoded once but returned as independent copies
+                return copy.deepcopy(cache[digest])
+            if not self.has(digest):
+                raise KeyError(f"Unknown snapshot object {digest}")
+            offset, length = self._index[digest]
+            handle.seek(offset)
+            obj = json.loads(_decompress(handle.read(length)))
+            value = dict(obj["v"])
+            for k, ref in obj["r"].items():
+                value[k] = get(ref)
+            cache[digest] = value
+            return value
+
+        try:
+            return get(root)
+        finally:
+            handle.close()
+
+    # ── named snapshots ───────────────────────────────────────────
+
+    def save(self, name: str, tree, **meta) -> dict:
+        manifest = {"name": name, "root": self.put_tree(tree), "created_at": time.time(), **meta}
+        with self._lock, open(self.manifest_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(manifest, separators=(",", ":")) + "\n")
+        return manifest
+
+    def manifests(self) -> list:
+        if not os.path.exists(self.manifest_path):
+            return []
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def load(self, name: str):
+        """Latest snapshot saved under `name`, or None."""
+        found = None
+        for manifest in self.manifests():
+            if manifest["name"] == name:
+                found = manifest
+        return self.get_tree(found["root"]) if found else None
+
+    def stats(self) -> dict:
+        sizes = {
+            name: os.path.getsize(path) if os.path.exists(path) else 0
+            for name, path in (("pack", self.pack_path), ("index", self.idx_path), ("manifests", self.manifest_path))
+        }
+        return {"objects": len(self._index), "snapshots": len(self.manifests()), **sizes, "bytes": sum(sizes.values())}
+
+
+_store = None
+
+
+def get_snapshot_store() -> SnapshotStore:
+    global _store
+    if _store is None:
+        _store = SnapshotStore()
+    return _store
+
+
+# ── CLI ───────────────────────────────────────────────────────────
+
+# TreeJournal checkpoints: <slug>_<session>.snapshot.<seq>.json
+_CHECKPOINT_NAME = re.compile(r"\.snapshot\.\d+\.json$")
+
+
+def _is_checkpoint(name: str, data: dict) -> bool:
+    # By name, and by either schema the journal has written ({seq, ts, root} or {seq, ts, offset, tree})
+    return bool(_CHECKPOINT_NAME.search(name)) or ("seq" in data and ("offset" in data or "root" in data))
+
+
+def migrate(directory: str = SNAPSHOT_DIR, keep: bool = False, store: SnapshotStore = None) -> dict:
+    """
+    Move every full-JSON snapshot in `directory` into the store. Timestamped
+    snapshots become manifests under their old file name; journal checkpoints
+    (*.snapshot.<seq>.json) keep their file but store a root hash in place of the tree.
+    Checkpoints that already hold a root hash are left alone, and nothing is
+    rewritten or deleted until its copy has been read back from the store.
+    """
+    store = store or get_snapshot_store()
+    before = after_files = migrated = 0
+    start_bytes = store.stats()["bytes"]
+
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not name.endswith(".json") or not os.path.isfile(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            try:
+                data = json.load(f)
+            except ValueError:
+                logging.warning(f"[SNAPSHOT MIGRATE] Skipping unreadable {name}")
+                continue
+        if not isinstance(data, dict):
+            logging.warning(f"[SNAPSHOT MIGRATE] Skipping {name}: not a JSON object")
+            continue
+        size = os.path.getsize(path)
+
+        if _is_checkpoint(name, data):
+            if not isinstance(data.get("tree"), dict):
+                continue  # already migrated (or written straight to the store)
+            checkpoint = {k: v for k, v in data.items() if k != "tree"}
+            checkpoint["root"] = store.put_tree(data["tree"])
+            if store.get_tree(checkpoint["root"]) != data["tree"]:
+                logging.error(f"[SNAPSHOT MIGRATE] {name}: stored copy does not match, file left as is")
+                continue
+            before += size
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(checkpoint, f, separators=(",", ":"))
+            os.replace(tmp_path, path)
+            after_files += os.path.getsize(path)
+        else:
+            if store.get_tree(store.put_tree(data)) != data:
+                logging.error(f"[SNAPSHOT MIGRATE] {name}: stored copy does not match, file kept")
+                continue
+            store.save(name[:-len(".json")], data, source=name)
+            before += size
+            if keep:
+                after_files += size
+            else:
+                os.remove(path)
+        migrated += 1
+
+    after = after_files + store.stats()["bytes"] - start_bytes
+    report = {
+        "files": migrated,
+        "bytes_before": before,
+        "bytes_after": after,
+        "saved_pct": round(100 * (1 - after / before), 1) if before else 0.0,
+    }
+    logging.info(f"[SNAPSHOT MIGRATE] {report}")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="X-Dial snapshot store")
+    sub = parser.add_subparsers(dest="command", required=True)
+    m = sub.add_parser("migrate", help="move full JSON snapshots into the store")
+    m.add_argument("--dir", default=SNAPSHOT_DIR)
+    m.add_argument("--keep", action="store_true", help="keep the original files")
+    sub.add_parser("stats", help="show store size")
+    r = sub.add_parser("restore", help="print a snapshot as JSON")
+    r.add_argument("name")
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        report = migrate(args.dir, keep=args.keep)
+        print(f"Migrated:     {report['files']} files")
+        print(f"Before:       {report['bytes_before']:,} bytes")
+        print(f"After:        {report['bytes_after']:,} bytes")
+        print(f"Saved:        {report['saved_pct']}%")
+    elif args.command == "stats":
+        print(json.dumps(get_snapshot_store().stats(), indent=2))
+    elif args.command == "restore":
+        tree = get_snapshot_store().load(args.name)
+        if tree is None:
+            print(f"No snapshot named {args.name}", file=sys.stderr)
+            return 1
+        print(json.dumps(tree, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
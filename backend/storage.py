@@ -0,0 +1,443 @@
+# backend/storage.py
+
+"""
+Pluggable storage backends for X-Dial session data.
+
+Paths are slash-separated like Firebase Realtime DB paths ("sessions/<id>/tree").
+Two engines share the same interface:
+
+- FirebaseStorage: the hosted Realtime DB (credentials are loaded on first use)
+- SQLiteStorage:   a local embedded store in WAL mode, for on-prem runs,
+                   benchmarks and tests that must not touch the network
+
+Pick one with XDIAL_STORAGE=firebase|sqlite (default: firebase).
+"""
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import logging
+import threading
+from collections import namedtuple, OrderedDict
+
+
+XDIAL_STORAGE = os.getenv("XDIAL_STORAGE", "firebase")
+XDIAL_SQLITE_PATH = os.getenv("XDIAL_SQLITE_PATH", "xdial.db")
+FIREBASE_CREDENTIAL_PATH = os.getenv("FIREBASE_CREDENTIAL_PATH", "firebase-key.json")
+FIREBASE_DB_URL = os.getenv("FIREBASE_DB_URL")
+
+# Emitted to watch() callbacks; `path` is absolute, `origin` identifies the writing process
+# when the backend knows it (None otherwise). `data` is not fetched (always None): watchers
+# only need to know what changed, and get() whatever they still care about
+StorageEvent = namedtuple("StorageEvent", ["path", "data", "origin"], defaults=(None,))
+
+# Identifies this process in change logs so workers can tell their own writes apart
+PROCESS_ORIGIN = f"{socket.gethostname()}:{os.getpid()}"
+
+# Firebase has no change log, so writes stamp the document with their origin instead
+ORIGIN_FIELD = "_origin"
+
+
+def split_path(path: str) -> list:
+    return [p for p in (path or "").strip("/").split("/") if p]
+
+
+def join_path(*parts) -> str:
+    return "/".join(p for part in parts for p in split_path(part))
+
+
+class SessionStorage:
+    """Interface every storage engine implements."""
+
+    def get(self, path: str):
+        raise NotImplementedError
+
+    def set(self, path: str, value):
+        raise NotImplementedError
+
+    def update(self, path: str, updates: dict):
+        """
+        Multi-path update: each key is a path relative to `path` and its value
+        replaces whatever is stored there. A value of None deletes the location.
+        """
+        raise NotImplementedError
+
+    def delete(self, path: str):
+        raise NotImplementedError
+
+    def transaction(self, path: str, fn):
+        """
+        Atomically replace the value at `path` with `fn(current)` (current is None
+        when nothing is stored) and return the new value. `fn` may run more than
+        once on contention, so it must not have side effects.
+        """
+        raise NotImplementedError
+
+    def list(self, path: str) -> list:
+        """Child keys directly under `path` (shallow)."""
+        raise NotImplementedError
+
+    def watch(self, path: str, callback):
+        """
+        Call `callback(StorageEvent)` whenever another process changes something at
+        or below `path`; this process's own writes are not reported.
+        Returns a handle with a close() method.
+        """
+        raise NotImplementedError
+
+
+class FirebaseStorage(SessionStorage):
+    """
+    Firebase Realtime DB. Writes inside a document also set its ORIGIN_FIELD
+    in the same update, so listeners can skip this process's own changes.
+    Transactions can't carry the field, so their committed values are
+    remembered briefly and matched against incoming events instead.
+    """
+
+    OWN_WRITES_KEPT = 1024
+
+    def __init__(self, credential_path: str = FIREBASE_CREDENTIAL_PATH, db_url: str = FIREBASE_DB_URL):
+        self.credential_path = credential_path
+        self.db_url = db_url
+        self._db = None
+        self._init_lock = threading.Lock()
+        self._own_lock = threading.Lock()
+        self._own_writes = OrderedDict()  # path -> value this process's transaction wrote there
+
+    def _ref(self, path: str):
+        if self._db is None:
+            with self._init_lock:
+                if self._db is None:
+                    import firebase_admin
+                    from firebase_admin import credentials, db
+                    if not firebase_admin._apps:
+                        cred = credentials.Certificate(self.credential_path)
+                        firebase_admin.initialize_app(cred, {
+                            'databaseURL': self.db_url
+                        })
+                    self._db = db
+        return self._db.reference(f"/{join_path(path)}")
+
+    def get(self, path: str):
+        value = self._ref(path).get()
+        depth = len(split_path(path))
+        if isinstance(value, dict) and depth <= 2:
+            docs = value.values() if depth == 1 else [value]
+            for doc in docs:
+                if isinstance(doc, dict):
+                    doc.pop(ORIGIN_FIELD, None)
+        return value
+
+    def set(self, path: str, value):
+        parts = split_path(path)
+        if len(parts) < 2 or value is None:
+            self._ref(path).set(value)
+        elif len(parts) == 2:
+            self._ref(path).set({**value, ORIGIN_FIELD: PROCESS_ORIGIN} if isinstance(value, dict) else value)
+        else:
+            self.update(join_path(*parts[:-1]), {parts[-1]: value})
+
+    def update(self, path: str, updates: dict):
+        parts = split_path(path)
+        if len(parts) < 2:
+            self._ref(path).update(updates)
+            return
+        # One multi-path update at the document, so the origin lands in the same event
+        inner = "/".join(parts[2:])
+        doc_updates = {join_path(inner, key): value for key, value in updates.items()}
+        doc_updates[ORIGIN_FIELD] = PROCESS_ORIGIN
+        self._ref(join_path(*parts[:2])).update(doc_updates)
+
+    def delete(self, path: str):
+        self._ref(path).delete()
+
+    def transaction(self, path: str, fn):
+        key = join_path(path)
+
+        def remembered(current):
+            # Recorded before the value is sent, so the echo can't arrive first
+            value = fn(current)
+            with self._own_lock:
+                self._own_writes[key] = value
+                self._own_writes.move_to_end(key)
+                while len(self._own_writes) > self.OWN_WRITES_KEPT:
+                    self._own_writes.popitem(last=False)
+            return value
+
+        return self._ref(path).transaction(remembered)
+
+    def list(self, path: str) -> list:
+        keys = (self._ref(path).get(shallow=True) or {}).keys()
+        return [key for key in keys if key != ORIGIN_FIELD]
+
+    def _origin_of(self, path: str, data):
+        if isinstance(data, dict) and ORIGIN_FIELD in data:
+            return data[ORIGIN_FIELD]
+        with self._own_lock:
+            if path in self._own_writes and self._own_writes[path] == data:
+                del self._own_writes[path]
+                return PROCESS_ORIGIN
+        return None
+
+    def watch(self, path: str, callback):
+        base = join_path(path)
+
+        def on_event(event):
+            changed = join_path(base, event.path)
+            origin = self._origin_of(changed, event.data)
+            if origin != PROCESS_ORIGIN:
+                callback(StorageEvent(changed, None, origin))
+
+        return self._ref(base).listen(on_event)
+
+
+class _Watcher:
+    def __init__(self, storage, path: str, callback, interval: float):
+        self._storage = storage
+        self._path = split_path(path)
+        self._callback = callback
+        self._interval = interval
+        self._stop = threading.Event()
+        self._last_seq = storage._last_change_seq()
+        self._thread = threading.Thread(target=self._run, name=f"sqlite-watch:{path}", daemon=True)
+        self._thread.start()
+
+    def _affects(self, changed: list) -> bool:
+        n = min(len(changed), len(self._path))
+        return changed[:n] == self._path[:n]
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            try:
+                for seq, path, origin in self._storage._changes_since(self._last_seq):
+                    self._last_seq = seq
+                    if origin != PROCESS_ORIGIN and self._affects(split_path(path)):
+                        self._callback(StorageEvent(path, None, origin))
+            except Exception as e:
+                logging.error(f"[SQLITE WATCH ERROR] {e}")
+
+    def close(self):
+        self._stop.set()
+
+
+class SQLiteStorage(SessionStorage):
+    """
+    Embedded store backed by one SQLite file in WAL mode.
+
+    Data is kept as one JSON document per `<collection>/<id>` row, so a session
+    read is a single primary-key lookup. Every write is appended to a change log
+    that watchers poll, which also works across processes sharing the file.
+    """
+
+    CHANGE_LOG_RETENTION = 3600  # seconds of change history kept for watchers
+
+    def __init__(self, path: str = XDIAL_SQLITE_PATH, watch_interval: float = 0.2):
+        self.path = path
+        self.watch_interval = watch_interval
+        self._local = threading.local()
+        self._writes = 0
+        with self._conn() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS docs (
+                    collection TEXT NOT NULL,
+                    doc_id TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    PRIMARY KEY (collection, doc_id)
+                ) WITHOUT ROWID
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS changes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    path TEXT NOT NULL,
+                    ts REAL NOT NULL,
+                    origin TEXT
+                )
+            """)
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(changes)")]
+            if "origin" not in columns:
+                conn.execute("ALTER TABLE changes ADD COLUMN origin TEXT")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ── document helpers ──────────────────────────────────────────
+
+    def _load(self, conn, collection: str, doc_id: str):
+        row = conn.execute(
+            "SELECT value FROM docs WHERE collection = ? AND doc_id = ?", (collection, doc_id)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _store(self, conn, collection: str, doc_id: str, value):
+        if value is None or value == {}:
+            conn.execute("DELETE FROM docs WHERE collection = ? AND doc_id = ?", (collection, doc_id))
+        else:
+            conn.execute(
+                "INSERT OR REPLACE INTO docs (collection, doc_id, value) VALUES (?, ?, ?)",
+                (collection, doc_id, json.dumps(value, separators=(",", ":"))),
+            )
+
+    @staticmethod
+    def _set_in(doc, parts: list, value):
+        if not parts:
+            return value
+        if not isinstance(doc, dict):
+            doc = {}
+        node = doc
+        for part in parts[:-1]:
+            child = node.get(part)
+            if not isinstance(child, dict):
+                child = node[part] = {}
+            node = child
+        if value is None:
+            node.pop(parts[-1], None)
+        else:
+            node[parts[-1]] = value
+        return doc
+
+    def _apply(self, writes: list):
+        """Apply [(segments, value)] atomically and log the changed paths."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            docs = {}
+            for parts, value in writes:
+                if len(parts) == 1:
+                    conn.execute("DELETE FROM docs WHERE collection = ?", (parts[0],))
+                    for doc_id, doc_value in (value or {}).items():
+                        docs[(parts[0], doc_id)] = doc_value
+                    continue
+                key = (parts[0], parts[1])
+                if key not in docs:
+                    docs[key] = self._load(conn, *key)
+                docs[key] = self._set_in(docs[key], parts[2:], value)
+            for (collection, doc_id), value in docs.items():
+                self._store(conn, collection, doc_id, value)
+            now = time.time()
+            # One change row per touched document keeps watchers cheap
+            changed = sorted({"/".join(parts[:2]) for parts, _ in writes})
+            conn.executemany(
+                "INSERT INTO changes (path, ts, origin) VALUES (?, ?, ?)",
+                [(p, now, PROCESS_ORIGIN) for p in changed],
+            )
+            self._writes += 1
+            if self._writes % 500 == 0:
+                conn.execute("DELETE FROM changes WHERE ts < ?", (now - self.CHANGE_LOG_RETENTION,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _last_change_seq(self) -> int:
+        row = self._conn().execute("SELECT MAX(seq) FROM changes").fetchone()
+        return row[0] or 0
+
+    def _changes_since(self, seq: int) -> list:
+        return self._conn().execute(
+            "SELECT seq, path, origin FROM changes WHERE seq > ? ORDER BY seq", (seq,)
+        ).fetchall()
+
+    # ── SessionStorage ────────────────────────────────────────────
+
+    def get(self, path: str):
+        parts = split_path(path)
+        conn = self._conn()
+        if not parts:
+            raise ValueError("Reading the storage root is not supported")
+        if len(parts) == 1:
+            rows = conn.execute("SELECT doc_id, value FROM docs WHERE collection = ?", (parts[0],)).fetchall()
+            return {doc_id: json.loads(value) for doc_id, value in rows} or None
+        node = self._load(conn, parts[0], parts[1])
+        for part in parts[2:]:
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node
+
+    def set(self, path: str, value):
+        parts = split_path(path)
+        if not parts:
+            raise ValueError("Writing the storage root is not supported")
+        self._apply([(parts, value)])
+
+    def update(self, path: str, updates: dict):
+        base = split_path(path)
+        writes = [(base + split_path(key), value) for key, value in updates.items()]
+        if any(not parts for parts in writes):
+            raise ValueError("Writing the storage root is not supported")
+        self._apply(writes)
+
+    def delete(self, path: str):
+        self.set(path, None)
+
+    def transaction(self, path: str, fn):
+        parts = split_path(path)
+        if len(parts) < 2:
+            raise ValueError("Transactions run on a document or a location inside one")
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            doc = self._load(conn, parts[0], parts[1])
+            current = doc
+            for part in parts[2:]:
+                current = current.get(part) if isinstance(current, dict) else None
+            value = fn(current)
+            self._store(conn, parts[0], parts[1], self._set_in(doc, parts[2:], value))
+            conn.execute(
+                "INSERT INTO changes (path, ts, origin) VALUES (?, ?, ?)",
+                ("/".join(parts[:2]), time.time(), PROCESS_ORIGIN),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def list(self, path: str) -> list:
+        parts = split_path(path)
+        conn = self._conn()
+        if not parts:
+            return [row[0] for row in conn.execute("SELECT DISTINCT collection FROM docs")]
+        if len(parts) == 1:
+            return [row[0] for row in conn.execute(
+                "SELECT doc_id FROM docs WHERE collection = ? ORDER BY doc_id", (parts[0],)
+            )]
+        node = self.get(path)
+        return list(node.keys()) if isinstance(node, dict) else []
+
+    def watch(self, path: str, callback):
+        return _Watcher(self, path, callback, self.watch_interval)
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> SessionStorage:
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                if XDIAL_STORAGE == "sqlite":
+                    _storage = SQLiteStorage()
+                elif XDIAL_STORAGE == "firebase":
+                    _storage = FirebaseStorage()
+                else:
+                    raise ValueError(f"Unknown XDIAL_STORAGE backend: {XDIAL_STORAGE}")
+                logging.info(f"[STORAGE] Using {type(_storage).__name__}")
+    return _storage
+
+
+def set_storage(storage: SessionStorage):
+    """Swap the active backend (benchmarks, local runs)."""
+    global _storage
+    with _storage_lock:
+        _storage = storage
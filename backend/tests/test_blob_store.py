@@ -0,0 +1,66 @@
+# backend/tests/test_blob_store.py
+
+import json
+import os
+
+import pytest
+
+import blob_store
+from blob_store import put_blob, get_blob, append_blob, load_transcript_text, SESSION_BLOB
+
+
+@pytest.fixture(autouse=True)
+def blob_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(blob_store, "XDIAL_BLOB_DIR", str(tmp_path))
+    monkeypatch.setattr(blob_store, "_cache", type(blob_store._cache)())
+    return tmp_path
+
+
+def forget_cache():
+    blob_store._cache.clear()
+
+
+def test_put_and_get_round_trip():
+    data = {"segments": [{"start": 0.0, "end": 1.0, "text": "hello"}] * 50}
+    ref = put_blob("s1", "CA1", "whisper_segments", data)
+    assert ref["bytes"] < ref["raw_bytes"]
+    forget_cache()
+    assert get_blob(ref) == data
+
+
+def test_missing_blob_returns_default():
+    assert get_blob({"blob": "s1/CA1/nothing"}, default=[]) == []
+    assert get_blob(None, default="x") == "x"
+
+
+def test_branch_calls_append_to_one_session_log():
+    refs = [append_blob("s1", SESSION_BLOB, "speech_history", {"call_sid": f"CA{i}", "text": f"menu {i}"})
+            for i in range(3)]
+    assert len({ref["blob"] for ref in refs}) == 1
+    assert refs[-1]["bytes"] > refs[0]["bytes"]
+    forget_cache()
+    assert [line["call_sid"] for line in get_blob(refs[-1])] == ["CA0", "CA1", "CA2"]
+
+
+def test_append_updates_a_cached_log():
+    ref = append_blob("s1", SESSION_BLOB, "speech_history", "one")
+    assert get_blob(ref) == ["one"]
+    append_blob("s1", SESSION_BLOB, "speech_history", "two")
+    assert get_blob(ref) == ["one", "two"]
+
+
+def test_append_carries_over_a_list_stored_with_put_blob(blob_dir):
+    ref = put_blob("s1", SESSION_BLOB, "speech_history", ["old"])
+    append_blob("s1", SESSION_BLOB, "speech_history", "new")
+    assert not os.path.exists(blob_store._blob_path(ref["blob"]))
+    forget_cache()
+    assert get_blob(ref) == ["old", "new"]
+    with open(blob_store._lines_path(ref["blob"]), encoding="utf-8") as f:
+        assert [json.loads(line) for line in f] == ["old", "new"]
+
+
+def test_transcript_loads_offloaded_segments():
+    ref = put_blob("s1", "CA1", "whisper_segments", [{"start": 0.0, "end": 1.0, "text": "press one"},
+                                                    {"start": 1.0, "end": 2.0, "text": "press two"}])
+    forget_cache()
+    assert load_transcript_text({"whisper_segments_ref": ref}) == "press one press two"
@@ -0,0 +1,223 @@
+# backend/tests/test_call_scheduler.py
+
+import asyncio
+import itertools
+
+import pytest
+
+import call_scheduler
+from call_scheduler import CallScheduler, TokenBucket, DialError, LANE_BULK, LANE_INTERACTIVE
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+async def settle():
+    # Let launch tasks started by pump() run their dial
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def make_scheduler(**kwargs):
+    clock = FakeClock()
+    options = dict(account_limit=4, interactive_reserve=1, number_concurrency=10, number_rate=600,
+                   number_burst=10, user_quota_base=10, clock=clock)
+    options.update(kwargs)
+    return CallScheduler(**options), clock
+
+
+_sids = itertools.count()
+
+
+def dialer():
+    """A dial that places a call with a fresh SID."""
+    return lambda: f"CA{next(_sids)}"
+
+
+# ── TokenBucket ───────────────────────────────────────────────────
+
+def test_token_bucket_allows_burst_then_waits_for_refill():
+    bucket = TokenBucket(per_minute=6, burst=2, now=0.0)
+    for _ in range(2):
+        assert bucket.ready(0.0)
+        bucket.take(0.0)
+    assert not bucket.ready(0.0)
+    assert bucket.wait(0.0) == pytest.approx(10.0)
+    assert not bucket.ready(9.9)
+    assert bucket.ready(10.0)
+
+
+def test_token_bucket_never_exceeds_burst():
+    bucket = TokenBucket(per_minute=60, burst=3, now=0.0)
+    bucket.take(0.0)
+    assert bucket.ready(3600.0)
+    assert bucket.tokens == 3
+
+
+def test_rate_limited_number_waits_for_its_bucket():
+    async def scenario():
+        scheduler, clock = make_scheduler(number_rate=6, number_burst=1)
+        first = await scheduler.submit("s1", "+1555", dialer())
+        second = await scheduler.submit("s1", "+1555", dialer())
+        await settle()
+        assert first.call_sid and second.started is None
+        assert scheduler.stats()["throttled_rate"] >= 1
+
+        clock.now += 10
+        await scheduler.pump()
+        await settle()
+        assert second.call_sid
+    asyncio.run(scenario())
+
+
+# ── lanes and reserve ─────────────────────────────────────────────
+
+def test_interactive_reserve_is_kept_from_bulk_jobs():
+    async def scenario():
+        scheduler, _ = make_scheduler(account_limit=3, interactive_reserve=1)
+        bulk = [await scheduler.submit(f"b{i}", f"+1{i}", dialer(), lane=LANE_BULK) for i in range(3)]
+        await settle()
+        assert [job.started is not None for job in bulk] == [True, True, False]
+
+        interactive = await scheduler.submit("i", "+19", dialer(), lane=LANE_INTERACTIVE)
+        await settle()
+        assert interactive.call_sid
+        assert scheduler.stats()["in_flight"] == 3
+        assert bulk[2].started is None
+    asyncio.run(scenario())
+
+
+def test_submit_returns_before_the_dial_completes():
+    async def scenario():
+        scheduler, _ = make_scheduler()
+        gate = asyncio.Event()
+
+        async def slow_dial():
+            await gate.wait()
+            return "CA-slow"
+
+        job = await scheduler.submit("s1", "+1", slow_dial)
+        assert not job.dialed.done()
+        assert scheduler.stats()["dialing"] == 1
+        gate.set()
+        assert await job.dialed == "CA-slow"
+    asyncio.run(scenario())
+
+
+# ── user quotas ───────────────────────────────────────────────────
+
+def test_user_quota_holds_extra_jobs_until_a_call_finishes():
+    async def scenario():
+        scheduler, _ = make_scheduler(user_quota_base=1)
+        scheduler.user_of = lambda session_id: "alice" if session_id.startswith("a") else "bob"
+        first = await scheduler.submit("a1", "+11", dialer())
+        second = await scheduler.submit("a2", "+12", dialer())
+        other = await scheduler.submit("b1", "+13", dialer())
+        await settle()
+        assert first.call_sid and other.call_sid
+        assert second.started is None
+        assert scheduler.stats()["users"]["alice"] == {"in_flight": 1, "queued": 1, "quota": 1}
+
+        await scheduler.call_finished(first.call_sid)
+        await settle()
+        assert second.call_sid
+    asyncio.run(scenario())
+
+
+def test_async_user_hook_is_awaited():
+    async def scenario():
+        scheduler, _ = make_scheduler()
+
+        async def user_of(session_id):
+            return "carol"
+
+        scheduler.user_of = user_of
+        job = await scheduler.submit("s1", "+1", dialer())
+        assert job.user_id == "carol"
+    asyncio.run(scenario())
+
+
+# ── cancel / finish / errors ──────────────────────────────────────
+
+def test_cancel_drops_only_queued_jobs_of_the_session():
+    async def scenario():
+        scheduler, _ = make_scheduler(account_limit=1, interactive_reserve=0)
+        done = []
+        running = await scheduler.submit("s1", "+1", dialer(), label="branch:1", on_done=done.append)
+        queued = await scheduler.submit("s1", "+1", dialer(), label="branch:2", on_done=done.append)
+        kept = await scheduler.submit("s1", "+1", dialer(), label="other", on_done=done.append)
+        await settle()
+
+        assert await scheduler.cancel("s1", label_prefix="branch:") == 1
+        assert await queued.dialed is None
+        assert done == [queued]
+        assert running.call_sid and scheduler.has_jobs("s1")
+        assert scheduler.stats()["cancelled"] == 1
+
+        await scheduler.call_finished(running.call_sid)
+        await settle()
+        assert kept.call_sid
+    asyncio.run(scenario())
+
+
+def test_failed_dial_raises_dial_error_and_frees_the_slot():
+    async def scenario():
+        scheduler, _ = make_scheduler(account_limit=1, interactive_reserve=0)
+        failed = await scheduler.submit("s1", "+1", lambda: None)
+        after = await scheduler.submit("s2", "+2", dialer())
+        with pytest.raises(DialError):
+            await failed.dialed
+        await settle()
+        assert after.call_sid
+        assert scheduler.stats()["dial_errors"] == 1
+    asyncio.run(scenario())
+
+
+def test_finish_reported_before_the_dial_returns_is_applied():
+    async def scenario():
+        scheduler, _ = make_scheduler()
+        gate = asyncio.Event()
+
+        async def slow_dial():
+            await gate.wait()
+            return "CA-early"
+
+        job = await scheduler.submit("s1", "+1", slow_dial)
+        await settle()
+        assert await scheduler.call_finished("CA-early") is None
+        gate.set()
+        await job.dialed
+        await settle()
+        assert scheduler.stats()["in_flight"] == 0
+        assert scheduler.stats()["finished_early"] == 1
+    asyncio.run(scenario())
+
+
+def test_calls_without_a_status_callback_are_reaped():
+    async def scenario():
+        scheduler, clock = make_scheduler(call_timeout=60)
+        job = await scheduler.submit("s1", "+1", dialer())
+        await settle()
+        clock.now += 61
+        await scheduler.pump()
+        assert job not in scheduler._in_flight
+        assert scheduler.stats()["timed_out"] == 1
+    asyncio.run(scenario())
+
+
+# ── per-process share ─────────────────────────────────────────────
+
+def test_limits_are_split_across_local_worker_processes(monkeypatch):
+    monkeypatch.setattr(call_scheduler, "CALL_ACCOUNT_LIMIT", 10)
+    monkeypatch.setattr(call_scheduler, "CALL_NUMBER_RATE", 6.0)
+    monkeypatch.setattr(call_scheduler, "CALL_NUMBER_BURST", 3.0)
+    monkeypatch.setattr(call_scheduler, "XDIAL_LOCAL_WORKERS", 4)
+    scheduler = CallScheduler(interactive_reserve=1)
+    assert scheduler.account_limit == 2
+    assert scheduler.number_rate == pytest.approx(1.5)
+    assert scheduler.number_burst == 1.0
@@ -0,0 +1,68 @@
+# backend/tests/test_crawl_coordinator.py
+
+import asyncio
+import itertools
+
+from call_scheduler import CallScheduler
+from crawl_coordinator import CrawlCoordinator, CRAWL_BRANCH_RETRIES
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def make_coordinator():
+    scheduler = CallScheduler(account_limit=4, interactive_reserve=0, number_concurrency=4, number_rate=600,
+                              number_burst=10, user_quota_base=10)
+    coordinator = CrawlCoordinator(scheduler)
+    sids = itertools.count()
+    dialed, idle = [], []
+
+    async def dial(session_id, key):
+        dialed.append(key)
+        return f"CA{next(sids)}"
+
+    async def on_idle(session_id):
+        idle.append(session_id)
+
+    coordinator.dial, coordinator.on_idle = dial, on_idle
+    return coordinator, scheduler, dialed, idle
+
+
+def test_unanswered_branch_is_redialed_before_the_crawl_goes_idle():
+    async def scenario():
+        coordinator, scheduler, dialed, idle = make_coordinator()
+        await coordinator.enqueue("s1", "+1555", ["root.1"])
+        await settle()
+
+        # Status callback order for a busy branch call: retry first, then free the slot
+        assert await coordinator.retry("s1", "+1555", "root.1")
+        await scheduler.call_finished("CA0")
+        await settle()
+        assert dialed == ["root.1", "root.1"]
+        assert idle == [] and coordinator.is_crawling("s1")
+
+        await scheduler.call_finished("CA1")
+        await settle()
+        assert idle == ["s1"]
+    asyncio.run(scenario())
+
+
+def test_branch_retries_are_bounded():
+    async def scenario():
+        coordinator, scheduler, dialed, idle = make_coordinator()
+        await coordinator.enqueue("s1", "+1555", ["root.2"])
+        await settle()
+        for attempt in range(CRAWL_BRANCH_RETRIES):
+            assert await coordinator.retry("s1", "+1555", "root.2")
+            await scheduler.call_finished(f"CA{attempt}")
+            await settle()
+
+        assert not await coordinator.retry("s1", "+1555", "root.2")
+        await scheduler.call_finished(f"CA{CRAWL_BRANCH_RETRIES}")
+        await settle()
+        assert len(dialed) == CRAWL_BRANCH_RETRIES + 1
+        assert idle == ["s1"]
+        assert coordinator.stats()["retries_exhausted"] == 1
+    asyncio.run(scenario())
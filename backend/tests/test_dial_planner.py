@@ -0,0 +1,75 @@
+# backend/tests/test_dial_planner.py
+
+import pytest
+
+from dial_planner import (
+    NgramRanker, DIAL_LEVEL_PAUSE, DIAL_ROOT_PAUSE, dtmf_route, get_ranker, plan_route, route_to,
+)
+
+
+def airline_tree() -> dict:
+    return {
+        "1": {"key": "root.1", "label": "1: Reservations", "pause": 4.0, "children": {
+            "1": {"key": "root.1.1", "label": "1: Change an existing booking", "children": {}},
+            "2": {"key": "root.1.2", "label": "2: New booking", "children": {}},
+        }},
+        "2": {"key": "root.2", "label": "2: Lost or delayed baggage", "children": {
+            "3": {"key": "root.2.3", "label": "3: File a claim", "children": {}},
+        }},
+    }
+
+
+# ── route_to pauses ───────────────────────────────────────────────
+
+def test_route_uses_default_pauses():
+    route = route_to(airline_tree(), "root.2.3")
+    assert route["digits"] == ["2", "3"]
+    assert route["pauses"] == [DIAL_ROOT_PAUSE, DIAL_LEVEL_PAUSE]
+
+
+def test_route_uses_learned_parent_pause_and_root_override():
+    route = route_to(airline_tree(), "root.1.1", root_pause=2.5)
+    assert route["pauses"] == [2.5, 4.0]
+    assert route["send_digits"] == "wwwww1wwwwwwww1"
+
+
+def test_route_to_unmapped_key_falls_back_to_defaults():
+    route = route_to({}, "root.9.9", root_pause=1)
+    assert route["pauses"] == [1.0, DIAL_LEVEL_PAUSE]
+
+
+def test_dtmf_route_pads_each_digit_with_half_second_waits():
+    assert dtmf_route(["1", "#"], [1.0, 0.2])["send_digits"] == "ww1#"
+
+
+# ── n-gram ranker (user-042) ──────────────────────────────────────
+
+def test_ngram_ranker_scores_by_cosine_similarity():
+    ranker = NgramRanker(["lost baggage", "new booking", ""])
+    scores = ranker.scores("lost baggage")
+    assert scores[0] == pytest.approx(1.0)
+    assert scores[0] > scores[1]
+    assert scores[2] == 0
+    assert not ranker.scores("zzzz").any()
+
+
+def test_plan_route_picks_the_best_node_and_its_route():
+    plan = plan_route(airline_tree(), "I want to change my booking", root_pause=3)
+    assert plan["key"] == "root.1.1"
+    assert plan["digits"] == ["1", "1"]
+    assert plan["pauses"] == [3.0, 4.0]
+    assert plan["alternatives"]
+
+
+def test_plan_route_returns_none_without_a_confident_match():
+    assert plan_route(airline_tree(), "qqqq xxxx") is None
+    assert plan_route({}, "baggage") is None
+
+
+def test_ranker_cache_follows_labels_without_touching_the_tree():
+    tree = airline_tree()
+    ranker = get_ranker(tree, "+1")
+    assert get_ranker(tree, "+1") is ranker
+    tree["2"]["label"] = "2: Flight status"
+    assert get_ranker(tree, "+1") is not ranker
+    assert "hash" not in str(tree)
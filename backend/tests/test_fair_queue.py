@@ -0,0 +1,93 @@
+# backend/tests/test_fair_queue.py
+
+import asyncio
+import threading
+
+import pytest
+
+from fair_queue import FairClock, FairQueue
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def blocker():
+    """A blocking job for the queue's pool, released from the test."""
+    gate = threading.Event()
+    return gate, lambda: gate.wait(5) and "done"
+
+
+def test_fair_clock_interleaves_a_light_user_with_a_backlog():
+    clock = FairClock(weight=lambda user: 1.0)
+    heavy = [clock.tag("heavy") for _ in range(3)]
+    light = clock.tag("light")
+    assert light < heavy[1]
+
+
+def test_queue_respects_concurrency_and_user_quota():
+    async def scenario():
+        queue = FairQueue("test", concurrency=2, user_quota_base=1)
+        gate, job = blocker()
+        tasks = [asyncio.create_task(queue.run(user, job)) for user in ("a", "a", "b")]
+        await settle()
+        stats = queue.stats()
+        assert stats["running"] == 2
+        assert stats["users"]["a"] == {"in_flight": 1, "queued": 1, "quota": 1}
+        assert stats["over_quota"] >= 1
+        gate.set()
+        assert await asyncio.gather(*tasks) == ["done"] * 3
+        assert queue.stats()["running"] == 0
+    asyncio.run(scenario())
+
+
+def test_cancelled_queued_job_is_not_counted_or_run():
+    async def scenario():
+        queue = FairQueue("test", concurrency=1, user_quota_base=5)
+        gate, job = blocker()
+        ran = []
+        running = asyncio.create_task(queue.run("a", job))
+        queued = asyncio.create_task(queue.run("b", ran.append, "b"))
+        await settle()
+        assert queue.stats()["queued"] == 1
+
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        stats = queue.stats()
+        assert stats["queued"] == 0
+        assert "b" not in stats["users"]
+
+        gate.set()
+        await running
+        await settle()
+        assert ran == []
+        stats = queue.stats()
+        assert (stats["started"], stats["running"], stats["queued"], stats["users"]) == (1, 0, 0, {})
+    asyncio.run(scenario())
+
+
+def test_cancelled_running_job_frees_its_slot():
+    async def scenario():
+        queue = FairQueue("test", concurrency=1, user_quota_base=5)
+        gate, job = blocker()
+        running = asyncio.create_task(queue.run("a", job))
+        await settle()
+        assert queue.stats()["running"] == 1
+
+        running.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await running
+        assert queue.stats()["running"] == 0
+        gate.set()
+        assert await queue.run("b", lambda: "next") == "next"
+    asyncio.run(scenario())
+
+
+def test_each_queue_runs_on_its_own_pool():
+    async def scenario():
+        queue = FairQueue("whisper-test", concurrency=1, user_quota_base=1)
+        name = await queue.run("a", lambda: threading.current_thread().name)
+        assert name.startswith("whisper-test-queue")
+    asyncio.run(scenario())
@@ -0,0 +1,90 @@
+# backend/tests/test_firebase_client.py
+
+import asyncio
+import copy
+
+import pytest
+
+import firebase_client
+import storage
+from firebase_client import (
+    VERSION_FIELD, get_session_status, update_session_status, update_session_status_async,
+    invalidate_session, public_document, get_read_stats,
+)
+from storage import SQLiteStorage
+
+
+class RecordingStorage(SQLiteStorage):
+    def __init__(self, path):
+        super().__init__(path)
+        self.calls = []
+
+    def update(self, path, updates):
+        self.calls.append(("update", path, copy.deepcopy(updates)))
+        super().update(path, updates)
+
+    def transaction(self, path, fn):
+        self.calls.append(("transaction", path, None))
+        return super().transaction(path, fn)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    db = RecordingStorage(str(tmp_path / "sessions.db"))
+    monkeypatch.setattr(storage, "_storage", db)
+    yield db
+    for session_id in db.list("sessions"):
+        invalidate_session(session_id)
+
+
+def test_update_writes_fields_and_version_in_one_round_trip(db):
+    update_session_status("s1", {"status": "started", "query": "billing"})
+    assert len(db.calls) == 1
+    kind, path, updates = db.calls[0]
+    assert (kind, path) == ("update", "sessions/s1")
+    assert updates["status"] == "started" and updates[VERSION_FIELD]
+    assert db.get("sessions/s1") == updates
+
+
+def test_versions_are_unique_per_write(db):
+    update_session_status("s1", {"status": "a"})
+    first = db.get(f"sessions/s1/{VERSION_FIELD}")
+    update_session_status("s1", {"status": "b"})
+    assert db.get(f"sessions/s1/{VERSION_FIELD}") != first
+
+
+def test_cached_copy_follows_own_writes(db):
+    update_session_status("s1", {"status": "started"})
+    session = get_session_status("s1")
+    asyncio.run(update_session_status_async("s1", {"status": "crawling", "ivr_type": "menu"}))
+    assert get_session_status("s1") is session
+    assert session["status"] == "crawling" and session[VERSION_FIELD] == db.get(f"sessions/s1/{VERSION_FIELD}")
+
+
+def test_write_from_another_worker_invalidates_the_cached_copy(db, monkeypatch):
+    update_session_status("s1", {"status": "started"})
+    cached = get_session_status("s1")
+    db.update("sessions/s1", {"status": "elsewhere", VERSION_FIELD: "other-worker.1"})
+
+    firebase_client._verified.pop("s1")  # the verify interval has passed
+    reads = get_read_stats()["storage"]
+    fresh = get_session_status("s1")
+    assert fresh is not cached and fresh["status"] == "elsewhere"
+    assert get_read_stats()["storage"] == reads + 1
+
+
+def test_unchanged_session_is_served_after_a_version_check(db):
+    update_session_status("s1", {"status": "started"})
+    cached = get_session_status("s1")
+    firebase_client._verified.pop("s1")
+    reads = get_read_stats()["storage"]
+    assert get_session_status("s1") is cached
+    assert get_read_stats()["storage"] == reads
+
+
+def test_public_document_hides_bookkeeping_and_deletes(db):
+    update_session_status("s1", {"status": "started", "last_speech": "hi"})
+    session = get_session_status("s1")
+    session["last_speech"] = None
+    doc = public_document(session)
+    assert VERSION_FIELD not in doc and "last_speech" not in doc and doc["status"] == "started"
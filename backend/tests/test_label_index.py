@@ -0,0 +1,60 @@
+# backend/tests/test_label_index.py
+
+from label_index import LabelIndex, tokenize
+
+
+def airline_index() -> LabelIndex:
+    index = LabelIndex()
+    index.index_tree("+1111", {
+        "1": {"label": "1: Reservations", "children": {
+            "1": {"label": "1: Change a booking"},
+        }},
+        "2": {"label": "2: Lost or delayed baggage"},
+        "0": {"label": "0: Speak to a representative"},
+    })
+    index.add("+2222", "root.3", "3: Billing questions")
+    return index
+
+
+def test_tokenize_drops_digit_prefix_stopwords_and_stems():
+    assert tokenize("3: Lost or delayed Baggage") == ["lost", "delay", "baggage"]
+    assert tokenize("Press 1 for reservations") == ["reserv"]
+
+
+def test_search_ranks_matching_nodes_with_their_path():
+    results = airline_index().search("lost baggage")
+    assert results[0]["key"] == "root.2"
+    assert results[0]["digits"] == ["2"]
+    top = airline_index().search("change booking")[0]
+    assert top["key"] == "root.1.1"
+    assert top["path"] == ["1: Reservations", "1: Change a booking"]
+
+
+def test_search_expands_synonyms_and_prefixes():
+    index = airline_index()
+    assert index.search("talk to an agent")[0]["key"] == "root.0"
+    assert index.search("luggage")[0]["key"] == "root.2"
+    assert index.search("reser")[0]["key"] == "root.1"
+
+
+def test_search_can_be_limited_to_one_number():
+    index = airline_index()
+    assert [r["number"] for r in index.search("billing")] == ["+2222"]
+    assert index.search("billing", number="+1111") == []
+
+
+def test_remove_and_relabel_update_postings():
+    index = airline_index()
+    index.remove("+1111", "root.2")
+    assert index.search("baggage") == []
+    index.add("+1111", "root.0", "0: Flight status")
+    assert index.search("representative") == []
+    assert index.search("flight")[0]["key"] == "root.0"
+
+
+def test_index_tree_replaces_the_numbers_previous_nodes():
+    index = airline_index()
+    index.index_tree("+1111", {"5": {"label": "5: Pets"}})
+    assert index.search("baggage") == []
+    assert index.stats()["nodes"] == 2
+    assert index.stats()["numbers"] == 2
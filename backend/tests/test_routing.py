@@ -0,0 +1,159 @@
+# backend/tests/test_routing.py
+
+import asyncio
+from collections import Counter
+
+import pytest
+from aiohttp import web
+from fastapi import Request
+from fastapi.responses import Response
+
+import routing
+from routing import HashRing, FORWARDED_HEADER, shard_params, sticky_routing_middleware
+
+
+def make_request(path="/twilio/crawler-branch", query="session_id=s1", body=b"CallSid=CA1", headers=()):
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            return {"type": "http.disconnect"}
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    scope = {
+        "type": "http", "method": "POST", "path": path, "query_string": query.encode(),
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers],
+        "server": ("testserver", 80), "scheme": "http",
+    }
+    return Request(scope, receive)
+
+
+async def handled_locally(request):
+    return Response(content=b"local", status_code=200)
+
+
+@pytest.fixture
+def cluster(monkeypatch):
+    workers = {"w0": "http://w0", "w1": "http://w1", "w2": "http://w2"}
+    monkeypatch.setattr(routing, "workers", workers)
+    monkeypatch.setattr(routing, "ring", HashRing(workers))
+    monkeypatch.setattr(routing, "XDIAL_WORKER_ID", "w0")
+    monkeypatch.setattr(routing, "_stats", Counter())
+    return workers
+
+
+def session_owned_by(owner: str) -> str:
+    return next(f"s{i}" for i in range(1000) if routing.ring.get(f"s{i}") == owner)
+
+
+# ── hash ring ─────────────────────────────────────────────────────
+
+def test_ring_is_stable_and_spreads_keys():
+    ring = HashRing(["w0", "w1", "w2"])
+    owners = Counter(ring.get(f"session-{i}") for i in range(3000))
+    assert set(owners) == {"w0", "w1", "w2"}
+    assert min(owners.values()) > 600
+    assert HashRing(["w2", "w0", "w1"]).get("session-42") == ring.get("session-42")
+
+
+def test_adding_a_worker_moves_only_its_share():
+    keys = [f"session-{i}" for i in range(3000)]
+    ring = HashRing(["w0", "w1", "w2"])
+    before = {key: ring.get(key) for key in keys}
+    ring.add("w3")
+    moved = [key for key in keys if ring.get(key) != before[key]]
+    assert all(ring.get(key) == "w3" for key in moved)
+    assert len(moved) < len(keys) / 2
+
+    ring.remove("w3")
+    assert {key: ring.get(key) for key in keys} == before
+
+
+def test_parse_workers():
+    assert routing._parse_workers(" w0=http://a:1/ , w1=http://b:2,,") == {"w0": "http://a:1", "w1": "http://b:2"}
+
+
+def test_no_shard_token_when_routing_is_off(monkeypatch):
+    monkeypatch.setattr(routing, "workers", {})
+    assert shard_params("s1") == {}
+
+
+def test_shard_token_names_the_owner(cluster):
+    assert shard_params("s1") == {"shard": routing.ring.get("s1")}
+
+
+# ── middleware ────────────────────────────────────────────────────
+
+def test_own_and_non_twilio_requests_stay_local(cluster, monkeypatch):
+    async def no_forward(request, owner):
+        raise AssertionError("forwarded")
+
+    monkeypatch.setattr(routing, "_forward", no_forward)
+    foreign = session_owned_by("w1")
+
+    async def scenario():
+        for request in (
+            make_request(query=f"session_id={session_owned_by('w0')}"),
+            make_request(path="/session/x", query=f"session_id={foreign}"),
+            make_request(query=f"session_id={foreign}", headers=[(FORWARDED_HEADER, "w2")]),
+        ):
+            assert (await sticky_routing_middleware(request, handled_locally)).body == b"local"
+    asyncio.run(scenario())
+
+
+def test_foreign_callbacks_go_to_their_owner(cluster, monkeypatch):
+    owners = []
+
+    async def forward(request, owner):
+        owners.append(owner)
+        return Response(content=b"remote")
+
+    monkeypatch.setattr(routing, "_forward", forward)
+
+    async def scenario():
+        foreign = session_owned_by("w1")
+        await sticky_routing_middleware(make_request(query=f"session_id={foreign}"), handled_locally)
+        # The shard token wins over the ring, so in-flight calls keep their owner
+        await sticky_routing_middleware(make_request(query=f"session_id={foreign}&shard=w2"), handled_locally)
+    asyncio.run(scenario())
+    assert owners == ["w1", "w2"] and routing._stats["forwarded"] == 2
+
+
+def test_unreachable_owner_falls_back_to_local(cluster, monkeypatch):
+    async def down(request, owner):
+        raise ConnectionError("refused")
+
+    monkeypatch.setattr(routing, "_forward", down)
+    request = make_request(query=f"session_id={session_owned_by('w1')}")
+    response = asyncio.run(sticky_routing_middleware(request, handled_locally))
+    assert response.body == b"local" and routing._stats["forward_errors"] == 1
+
+
+def test_forward_relays_query_body_and_marks_the_hop(cluster, monkeypatch):
+    received = {}
+
+    async def owner(request):
+        received.update(query=request.query_string, body=await request.read(), hop=request.headers.get(FORWARDED_HEADER))
+        return web.Response(text="<Response/>", content_type="application/xml", status=201)
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_post("/twilio/crawler-branch", owner)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        cluster["w1"] = f"http://127.0.0.1:{port}"
+        try:
+            response = await routing._forward(make_request(query="session_id=s9&shard=w1"), "w1")
+        finally:
+            await routing.close_forward_session()
+            await runner.cleanup()
+        return response
+
+    response = asyncio.run(scenario())
+    assert received == {"query": "session_id=s9&shard=w1", "body": b"CallSid=CA1", "hop": "w0"}
+    assert response.status_code == 201 and response.body == b"<Response/>"
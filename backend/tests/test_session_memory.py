@@ -0,0 +1,148 @@
+# backend/tests/test_session_memory.py
+
+import asyncio
+from concurrent.futures import Future
+
+from session_memory import SessionCache, SessionLocks, approx_size
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class DeferredPool:
+    """Collects submitted write-backs so a test decides when they run."""
+
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, fn, *args):
+        self.jobs.append((fn, args))
+
+    def run(self):
+        jobs, self.jobs = self.jobs, []
+        for fn, args in jobs:
+            fn(*args)
+
+
+def _done(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def make_cache(**kwargs):
+    written = []
+    pool = DeferredPool()
+    clock = FakeClock()
+    options = dict(max_entries=3, max_bytes=10 ** 9, ttl=60, clock=clock, submit=pool.submit,
+                   write_back=lambda sid, session: written.append((sid, session)))
+    options.update(kwargs)
+    return SessionCache(**options), written, pool, clock
+
+
+def test_least_recently_used_session_is_evicted_and_written_back():
+    cache, written, pool, _ = make_cache()
+    for sid in ("a", "b", "c"):
+        cache[sid] = {"id": sid}
+    cache.get("a")
+    cache["d"] = {"id": "d"}
+    pool.run()
+    assert [sid for sid, _ in written] == ["b"]
+    assert "b" not in cache and "a" in cache
+    assert cache.stats()["evictions_lru"] == 1
+
+
+def test_idle_sessions_expire_after_the_ttl():
+    cache, written, pool, clock = make_cache()
+    cache["a"] = {"id": "a"}
+    clock.now += 61
+    assert cache.get("a") is None
+    pool.run()
+    assert written == [("a", {"id": "a"})]
+    assert cache.stats()["evictions_ttl"] == 1
+
+
+def test_byte_budget_keeps_the_session_just_stored():
+    cache, written, pool, _ = make_cache(max_bytes=approx_size({"blob": "x" * 1000}) + 100)
+    cache["a"] = {"blob": "x" * 1000}
+    cache["b"] = {"blob": "y" * 1000}
+    pool.run()
+    assert "b" in cache and [sid for sid, _ in written] == ["a"]
+
+
+def test_write_back_runs_outside_the_lock_on_a_snapshot():
+    cache, written, pool, _ = make_cache(max_entries=1)
+    session = {"status": "started"}
+    cache["a"] = session
+    cache["b"] = {}
+    assert pool.jobs and written == []           # queued, not run under the lock
+    session["status"] = "changed after eviction"
+    pool.run()
+    assert written == [("a", {"status": "started"})]
+
+
+def test_session_read_during_write_back_is_revived():
+    cache, written, pool, _ = make_cache(max_entries=1)
+    session = {"status": "started"}
+    cache["a"] = session
+    cache["b"] = {}
+    assert cache.get("a") is session             # storage may not have it yet
+    pool.run()
+    assert cache.stats()["writing_back"] == 0
+
+
+def test_pop_drops_without_write_back():
+    cache, written, pool, _ = make_cache()
+    cache["a"] = {"id": "a"}
+    assert cache.pop("a") == {"id": "a"}
+    pool.run()
+    assert written == [] and len(cache) == 0 and cache.stats()["bytes"] == 0
+
+
+def test_write_back_errors_are_counted():
+    def failing(sid, session):
+        raise IOError("storage down")
+
+    cache, _, pool, _ = make_cache(max_entries=1, write_back=failing)
+    cache["a"] = {}
+    cache["b"] = {}
+    pool.run()
+    assert cache.stats()["write_back_errors"] == 1
+
+
+def test_flush_writes_everything_and_waits():
+    written = []
+    cache = SessionCache(write_back=lambda sid, s: written.append(sid),
+                         submit=lambda fn, *args: _done(fn(*args)))
+    cache["a"] = {}
+    cache["b"] = {}
+    cache.flush()
+    assert sorted(written) == ["a", "b"] and len(cache) == 0
+
+
+def test_approx_size_counts_shared_objects_once():
+    shared = ["x" * 100]
+    assert approx_size({"a": shared, "b": shared}) < approx_size({"a": ["x" * 100], "b": ["y" * 100]})
+
+
+def test_session_locks_serialize_one_session_in_order():
+    async def scenario():
+        locks = SessionLocks()
+        order = []
+
+        async def callback(sid, n):
+            async with locks.hold(sid):
+                order.append((sid, n, "in"))
+                await asyncio.sleep(0)
+                order.append((sid, n, "out"))
+
+        await asyncio.gather(callback("s1", 1), callback("s1", 2), callback("s2", 1))
+        s1 = [step for step in order if step[0] == "s1"]
+        assert s1 == [("s1", 1, "in"), ("s1", 1, "out"), ("s1", 2, "in"), ("s1", 2, "out")]
+        assert locks.stats()["active"] == 0 and locks.stats()["contended"] == 1
+    asyncio.run(scenario())
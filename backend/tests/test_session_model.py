@@ -0,0 +1,84 @@
+# backend/tests/test_session_model.py
+
+import json
+
+import pytest
+
+from session_model import SessionRecord, Segments, as_document
+from session_memory import SessionCache
+
+
+WHISPER = [
+    {"start": 0.0, "end": 1.5, "text": "Press one for billing", "tokens": [1, 2]},
+    {"start": 1.5, "end": 3.25, "text": "Press two for support", "tokens": [3]},
+]
+
+
+def make_record(**overrides):
+    doc = {
+        "query": "billing", "status": "in_progress", "resolved_number": "+15550100",
+        "tree": {"number": "+15550100", "tree": {"root": {"children": {}}}},
+        "speech_history": ["hello"], "menu_repeat_count": 2, "calculated_pause": 1.25,
+        "whisper_segments": {"start": [0.0, 1.5], "end": [1.5, 3.25], "text": ["a", "b"]},
+        "custom_flag": {"nested": [1, 2]},
+    }
+    doc.update(overrides)
+    return SessionRecord.from_dict(doc)
+
+
+@pytest.mark.parametrize("encode, decode", [
+    (SessionRecord.to_bytes, SessionRecord.from_bytes),
+    (SessionRecord.to_json, SessionRecord.from_json),
+])
+def test_round_trip_keeps_the_document(encode, decode):
+    record = make_record()
+    copy = decode(encode(record))
+    assert copy.to_dict() == record.to_dict()
+    assert isinstance(copy.whisper_segments, Segments)
+    assert copy.extra == {"custom_flag": {"nested": [1, 2]}}
+
+
+def test_round_trip_keeps_legacy_segments_and_per_segment_keys():
+    record = make_record(whisper_segments=WHISPER)
+    copy = SessionRecord.from_bytes(record.to_bytes())
+    assert copy.whisper_segments.legacy
+    assert copy.to_dict()["whisper_segments"] == WHISPER
+
+
+def test_round_trip_keeps_cleared_fields_as_deletes():
+    record = make_record()
+    record["last_speech"] = None
+    record.pop("whisper_segments")
+    record.pop("custom_flag")
+    for copy in (SessionRecord.from_bytes(record.to_bytes()), SessionRecord.from_json(record.to_json())):
+        doc = copy.to_dict()
+        assert doc["last_speech"] is None and doc["whisper_segments"] is None and doc["custom_flag"] is None
+
+
+def test_record_without_segments_round_trips():
+    record = SessionRecord.from_dict({"query": "x", "status": "started"})
+    assert SessionRecord.from_bytes(record.to_bytes()).to_dict() == record.to_dict()
+
+
+def test_json_is_compact():
+    text = make_record().to_json()
+    assert ", " not in text and ": " not in text
+    assert json.loads(text) == as_document(make_record())
+
+
+def test_from_bytes_rejects_foreign_data():
+    with pytest.raises(ValueError):
+        SessionRecord.from_bytes(b"JUNK" + bytes(16))
+
+
+def test_evicted_record_is_written_back_as_it_was_when_evicted():
+    written = {}
+    cache = SessionCache(max_entries=1, ttl=0, write_back=lambda sid, s: written.setdefault(sid, s.to_dict()),
+                         submit=lambda fn, *args: fn(*args))
+    record = make_record()
+    expected = record.to_dict()
+    cache["s1"] = record
+    cache["s2"] = {"status": "started"}
+    cache._drain()
+    record["status"] = "mutated after eviction"
+    assert written["s1"] == expected
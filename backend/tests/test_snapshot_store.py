@@ -0,0 +1,76 @@
+# backend/tests/test_snapshot_store.py
+
+import json
+import os
+
+import pytest
+
+import snapshot_store
+from snapshot_store import SnapshotStore, migrate
+from tree import PhoneTree, TreeJournal
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = SnapshotStore(str(tmp_path / "snapshots" / "store"))
+    monkeypatch.setattr(snapshot_store, "_store", store)
+    return store
+
+
+def sample_tree() -> dict:
+    tree = PhoneTree()
+    tree.add_options("root", {"1": "Reservations", "2": "Baggage"})
+    tree.add_options("root.1", {"1": "Change a booking"})
+    return tree.to_dict()
+
+
+def test_tree_round_trips_and_shares_subtrees(store):
+    tree = sample_tree()
+    root = store.put_tree(tree)
+    assert store.get_tree(root) == tree
+    objects = store.stats()["objects"]
+    tree["3"] = {"key": "root.3", "label": "3: Agent", "children": {}}
+    store.put_tree(tree)
+    assert store.stats()["objects"] - objects <= 4
+
+
+def test_named_snapshots_load_the_latest_version(store):
+    store.save("delta", {"1": {"label": "old"}})
+    store.save("delta", {"1": {"label": "new"}})
+    assert store.load("delta") == {"1": {"label": "new"}}
+    assert store.load("missing") is None
+
+
+def test_migrate_moves_plain_snapshots_into_manifests(store, tmp_path):
+    path = tmp_path / "snapshots" / "delta_s1_20240101_120000.json"
+    path.write_text(json.dumps(sample_tree()))
+    report = migrate("snapshots", store=store)
+    assert report["files"] == 1
+    assert not path.exists()
+    assert store.load("delta_s1_20240101_120000") == sample_tree()
+
+
+def test_migrate_keeps_journal_checkpoints_replayable(store):
+    journal = TreeJournal("Delta Airlines", "s1")
+    tree = PhoneTree()
+    tree.add_options("root", {"1": "Reservations"}, on_change=journal.on_change)
+    journal.compact(tree.to_dict())
+    tree.add_options("root.1", {"1": "Change a booking"}, on_change=journal.on_change)
+    journal.flush()
+    checkpoint = f"snapshots/delta-airlines_s1.snapshot.{journal.checkpoint_seq}.json"
+    assert os.path.exists(checkpoint)
+
+    report = migrate("snapshots", store=store)
+    assert report["files"] == 0 and report["saved_pct"] == 0.0
+    assert os.path.exists(checkpoint)
+    assert TreeJournal("Delta Airlines", "s1").replay() == tree.to_dict()
+
+
+def test_migrate_moves_trees_out_of_legacy_checkpoints(store, tmp_path):
+    legacy = tmp_path / "snapshots" / "q_s2.snapshot.5.json"
+    legacy.write_text(json.dumps({"seq": 5, "ts": 1.0, "offset": 0, "tree": sample_tree()}))
+    assert migrate("snapshots", store=store)["files"] == 1
+    checkpoint = json.loads(legacy.read_text())
+    assert "tree" not in checkpoint and checkpoint["offset"] == 0
+    assert store.get_tree(checkpoint["root"]) == sample_tree()
@@ -0,0 +1,92 @@
+# backend/tests/test_storage.py
+
+import threading
+import time
+
+import pytest
+
+from storage import SQLiteStorage, split_path, join_path
+
+
+@pytest.fixture
+def db(tmp_path):
+    return SQLiteStorage(str(tmp_path / "xdial.db"), watch_interval=0.01)
+
+
+def test_paths():
+    assert split_path("/sessions//s1/tree/") == ["sessions", "s1", "tree"]
+    assert join_path("sessions", "/s1/", "tree") == "sessions/s1/tree"
+
+
+def test_uses_wal(db):
+    assert db._conn().execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_set_get_nested_paths(db):
+    db.set("sessions/s1", {"status": "started", "tree": {"root": {"label": "Main"}}})
+    assert db.get("sessions/s1/tree/root/label") == "Main"
+    db.set("sessions/s1/tree/root/label", "Menu")
+    assert db.get("sessions/s1") == {"status": "started", "tree": {"root": {"label": "Menu"}}}
+    assert db.get("sessions/s1/missing/deeper") is None
+    assert db.get("sessions") == {"s1": db.get("sessions/s1")}
+
+
+def test_multi_path_update_and_deletes(db):
+    db.set("sessions/s1", {"status": "started", "last_speech": "hi", "tree": {"a": 1}})
+    db.update("sessions/s1", {"status": "crawling", "last_speech": None, "tree/b": 2})
+    assert db.get("sessions/s1") == {"status": "crawling", "tree": {"a": 1, "b": 2}}
+
+    db.update("sessions/s1", {"status": None, "tree": None})
+    assert db.get("sessions/s1") is None
+    assert db.list("sessions") == []
+
+
+def test_list_is_shallow(db):
+    db.set("sessions/b", {"x": 1})
+    db.set("sessions/a", {"y": {"z": 1}})
+    assert db.list("sessions") == ["a", "b"]
+    assert db.list("sessions/a") == ["y"]
+
+
+def test_transactions_are_atomic_across_connections(tmp_path):
+    path = str(tmp_path / "shared.db")
+    workers = [SQLiteStorage(path) for _ in range(4)]
+
+    def bump(db):
+        for _ in range(25):
+            db.transaction("counters/c1/n", lambda n: (n or 0) + 1)
+
+    threads = [threading.Thread(target=bump, args=(db,)) for db in workers]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert workers[0].get("counters/c1/n") == 100
+
+
+def test_failed_transaction_leaves_the_document(db):
+    db.set("sessions/s1", {"n": 1})
+
+    def boom(current):
+        raise RuntimeError("nope")
+
+    with pytest.raises(RuntimeError):
+        db.transaction("sessions/s1/n", boom)
+    assert db.get("sessions/s1/n") == 1
+
+
+def test_watch_reports_other_processes_only(db):
+    seen = []
+    handle = db.watch("sessions/s1", seen.append)
+    try:
+        db.update("sessions/s1", {"status": "own write"})
+        conn = db._conn()
+        conn.execute("INSERT INTO changes (path, ts, origin) VALUES (?, ?, ?)", ("sessions/s1", time.time(), "other:1"))
+        conn.execute("INSERT INTO changes (path, ts, origin) VALUES (?, ?, ?)", ("sessions/s2", time.time(), "other:1"))
+        deadline = time.monotonic() + 2
+        while not seen and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.05)
+    finally:
+        handle.close()
+    assert [(e.path, e.origin) for e in seen] == [("sessions/s1", "other:1")]
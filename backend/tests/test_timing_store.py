@@ -0,0 +1,74 @@
+# backend/tests/test_timing_store.py
+
+import pytest
+
+import storage
+import timing_store
+from session_memory import SessionCache
+from storage import SQLiteStorage
+from timing_store import (
+    DEFAULT_TIMING, TIMING_MAX_SAMPLES, sample_from_segments, record_timing, get_node_timing,
+    recommend, learn_from_recording,
+)
+
+NUMBER = "+18005550100"
+
+
+@pytest.fixture(autouse=True)
+def db(tmp_path, monkeypatch):
+    db = SQLiteStorage(str(tmp_path / "timing.db"))
+    monkeypatch.setattr(storage, "_storage", db)
+    monkeypatch.setattr(timing_store, "_local", SessionCache(max_entries=16, write_back=None))
+    return db
+
+
+def segments(*spans):
+    return [{"start": start, "end": end, "text": f"part {i}"} for i, (start, end) in enumerate(spans)]
+
+
+def test_sample_is_measured_from_the_node_offset():
+    sample = sample_from_segments(segments((5.0, 8.0), (9.5, 12.0), (12.5, 14.0)), ready=9.5, offset=2.0)
+    assert sample == {"prompt_start": 3.0, "ready": 7.5, "prompt_end": 12.0, "max_gap": 1.5}
+
+
+def test_silent_recording_gives_no_sample():
+    assert sample_from_segments([{"start": 0.0, "end": 2.0, "text": "  "}]) is None
+    assert record_timing(NUMBER, "root", None) is None
+
+
+def test_defaults_until_enough_samples():
+    record_timing(NUMBER, "root.1", {"prompt_start": 1.0, "ready": 4.0, "prompt_end": 12.0, "max_gap": 1.0})
+    out = recommend(NUMBER, "root.1")
+    assert out["learned"] is False and out["samples"] == 1
+    assert {k: out[k] for k in DEFAULT_TIMING} == DEFAULT_TIMING
+
+
+def test_learned_parameters_are_tight_and_bounded():
+    for end in (11.0, 12.0, 13.0):
+        record_timing(NUMBER, "root.1", {"prompt_start": 1.0, "ready": 4.0, "prompt_end": end, "max_gap": 0.5})
+    out = recommend(NUMBER, "root.1")
+    assert out["learned"] and out["samples"] == 3
+    assert 12 < out["max_length"] < 90
+    assert out["timeout"] == 2            # lower bound
+    assert out["listen"] == 3 and out["pause"] == 6
+
+
+def test_samples_are_capped_and_shared_through_storage(db):
+    for i in range(TIMING_MAX_SAMPLES + 5):
+        record_timing(NUMBER, "root.2", {"prompt_start": 0.5, "ready": None, "prompt_end": float(i), "max_gap": 1.0})
+    timing_store._local.pop(timing_store._node_path(NUMBER, "root.2"))  # another worker
+    entry = get_node_timing(NUMBER, "root.2")
+    assert len(entry["prompt_end"]) == TIMING_MAX_SAMPLES and entry["prompt_end"][-1] == TIMING_MAX_SAMPLES + 4
+    assert "ready" not in entry
+
+
+def test_node_keys_are_storage_safe(db):
+    record_timing(NUMBER, "root.3.1", {"prompt_start": 1.0, "ready": None, "prompt_end": 5.0, "max_gap": 1.0})
+    assert db.list(f"timing/{NUMBER}") == ["root_3_1"]
+
+
+def test_learn_from_recording_uses_the_menu_start():
+    result = {"segments": segments((1.0, 4.0), (4.5, 9.0)), "menu_start": 4.5}
+    learn_from_recording(NUMBER, "root", result)
+    out = learn_from_recording(NUMBER, "root", result)
+    assert out["learned"] and out["pause"] == 6
@@ -0,0 +1,142 @@
+# backend/tests/test_tree.py
+
+import copy
+
+from label_index import label_index
+from tree import PhoneTree, diff_trees, merge_tree, tree_hash, tree_updates, HASH_FIELD
+
+
+def walk_keys(nested: dict, prefix: str = "root") -> set:
+    keys = set()
+    for digit, node in nested.items():
+        key = f"{prefix}.{digit}"
+        assert node["key"] == key
+        keys.add(key)
+        keys |= walk_keys(node.get("children") or {}, key)
+    return keys
+
+
+def assert_index_matches(tree: PhoneTree):
+    assert set(tree.keys()) - {"root"} == walk_keys(tree.nested)
+    for key in tree.keys():
+        if key != "root":
+            assert tree[key] is _find(tree.nested, key)
+
+
+def _find(nested: dict, key: str):
+    node = {"children": nested}
+    for digit in key.split(".")[1:]:
+        node = node["children"][digit]
+    return node
+
+
+def sample_tree() -> dict:
+    tree = PhoneTree()
+    tree.add_options("root", {"1": "Reservations", "2": "Baggage"}, ivr_type="menu")
+    tree.add_options("root.2", {"1": "Lost bags", "2": "Delayed bags"}, ivr_type="menu")
+    return tree.to_dict()
+
+
+# ── PhoneTree index (user-038) ────────────────────────────────────
+
+def test_insert_creates_missing_ancestors_and_indexes_them():
+    changes = []
+    tree = PhoneTree()
+    tree.insert("root.3.1.4", "4: Agent", on_change=lambda key, fields: changes.append(key))
+    assert [k for k in ("root.3", "root.3.1", "root.3.1.4") if k in tree] == ["root.3", "root.3.1", "root.3.1.4"]
+    assert changes == ["root.3", "root.3.1", "root.3.1.4"]
+    assert_index_matches(tree)
+
+
+def test_remove_drops_the_whole_subtree_from_the_index():
+    tree = PhoneTree(sample_tree())
+    removed = []
+    tree.remove("root.2", on_change=lambda key, fields: removed.append((key, fields)))
+    assert "root.2" not in tree and "root.2.1" not in tree
+    assert removed == [("root.2", None)]
+    assert len(tree) == 1
+    assert_index_matches(tree)
+
+
+def test_set_options_adds_relabels_and_drops_children():
+    tree = PhoneTree(sample_tree())
+    tree.insert("root.2.1.5", "5: Claim status")
+    changed = tree.set_options("root.2", {"1": "Lost baggage", "3": "Pets"})
+    assert set(changed) == {"root.2.1", "root.2.2", "root.2.3"}
+    assert tree["root.2.1"]["label"] == "1: Lost baggage"
+    assert "root.2.1.5" in tree  # subtree of a digit still offered is kept
+    assert "root.2.2" not in tree
+    assert_index_matches(tree)
+    assert tree.set_options("root.2", {"1": "Lost baggage", "3": "Pets"}) == []
+
+
+def test_legacy_shapes_are_indexed_on_load():
+    tree = PhoneTree.from_dict({"key": "root", "ivr_type": "menu", "children": {"1": "Sales", "2": {"label": "2: Support"}}})
+    assert tree["root.1"]["label"] == "1: Sales"
+    assert tree.root["ivr_type"] == "menu"
+    assert_index_matches(tree)
+
+
+def test_tree_with_a_number_keeps_the_label_index_current():
+    number = "+15550000038"
+    try:
+        tree = PhoneTree(number=number)
+        tree.add_options("root", {"1": "Lost baggage"})
+        assert [r["key"] for r in label_index.search("baggage", number=number)] == ["root.1"]
+        tree.relabel("root.1", "1: Flight status")
+        assert label_index.search("baggage", number=number) == []
+        tree.remove("root.1")
+        assert label_index.search("flight", number=number) == []
+    finally:
+        label_index.remove_number(number)
+
+
+# ── Merkle diff and merge (user-039) ──────────────────────────────
+
+def test_diff_reports_added_removed_and_changed_nodes():
+    old = sample_tree()
+    new = copy.deepcopy(old)
+    new["2"]["children"]["1"]["label"] = "1: Lost or damaged bags"
+    new["2"]["children"].pop("2")
+    new["3"] = {"key": "root.3", "label": "3: Agent", "children": {}}
+    assert diff_trees(old, new) == {"added": ["root.3"], "removed": ["root.2.2"], "changed": ["root.2.1"]}
+    assert diff_trees(old, copy.deepcopy(old)) == {"added": [], "removed": [], "changed": []}
+
+
+def test_diff_sees_in_place_mutations_and_stores_no_hashes():
+    old = sample_tree()
+    new = copy.deepcopy(old)
+    assert diff_trees(old, new)["changed"] == []
+    new["1"]["label"] = "1: Bookings"
+    assert diff_trees(old, new)["changed"] == ["root.1"]
+    before = tree_hash(new)
+    new["1"]["label"] = "1: Reservations"
+    assert tree_hash(new) != before
+    assert HASH_FIELD not in str(new)
+
+
+def test_tree_updates_write_only_changed_fields():
+    old = sample_tree()
+    new = copy.deepcopy(old)
+    new["2"]["children"]["2"]["label"] = "2: Delayed baggage"
+    assert tree_updates(old, new, prefix="trees/x/tree") == {"trees/x/tree/2/children/2/label": "2: Delayed baggage"}
+
+
+def test_merge_keeps_unchanged_subtrees_and_deeper_knowledge():
+    base = sample_tree()
+    fresh = copy.deepcopy(base)
+    fresh["2"]["children"] = {}          # re-crawl stopped at this level
+    fresh["2"]["label"] = "2: Baggage services"
+    merged = merge_tree(base, fresh)
+    assert merged["1"] is base["1"]
+    assert merged["2"]["label"] == "2: Baggage services"
+    assert set(merged["2"]["children"]) == {"1", "2"}
+
+
+def test_merge_only_takes_recrawled_branches():
+    base = sample_tree()
+    fresh = {"1": {"key": "root.1", "label": "1: Bookings", "children": {}}}
+    merged = merge_tree(base, fresh, branches=["1"])
+    assert merged["1"]["label"] == "1: Bookings"
+    assert merged["2"] is base["2"]
+    assert "2" not in merge_tree(base, fresh, branches=["2"])
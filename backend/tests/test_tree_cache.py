@@ -0,0 +1,97 @@
+# backend/tests/test_tree_cache.py
+
+import copy
+
+import pytest
+
+import storage
+import tree_cache
+from storage import SQLiteStorage
+from tree import PhoneTree
+from tree_cache import get_cached_tree, sync_tree, normalize_number
+
+NUMBER = "+18005550100"
+
+
+class RecordingStorage(SQLiteStorage):
+    def __init__(self, path):
+        super().__init__(path)
+        self.writes = []
+
+    def update(self, path, updates):
+        self.writes.append(("update", path, copy.deepcopy(updates)))
+        super().update(path, updates)
+
+    def transaction(self, path, fn):
+        self.writes.append(("transaction", path, None))
+        return super().transaction(path, fn)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    db = RecordingStorage(str(tmp_path / "x.db"))
+    monkeypatch.setattr(storage, "_storage", db)
+    tree_cache._local.pop(NUMBER)
+    return db
+
+
+def forget_local():
+    # Another worker: no local copy of the cached tree
+    tree_cache._local.pop(NUMBER)
+
+
+def crawled(*menus) -> dict:
+    tree = PhoneTree()
+    for key, options in menus:
+        tree.add_options(key, options, ivr_type="menu")
+    return tree.to_dict()
+
+
+def test_normalize_number():
+    assert normalize_number("(800) 555-0100") == NUMBER
+    assert normalize_number("1-800-555-0100") == NUMBER
+
+
+def test_sync_writes_only_the_changed_paths(db):
+    sync_tree(NUMBER, crawled(("root", {"1": "Sales", "2": "Support"})), "s1")
+    db.writes.clear()
+
+    session = crawled(("root", {"1": "Sales", "2": "Tech support"}))
+    entry = sync_tree(NUMBER, session, "s2", branches=["2"])
+    assert entry["tree"]["2"]["label"] == "2: Tech support"
+    [(op, path, updates)] = db.writes
+    assert (op, path) == ("update", f"trees/{NUMBER}")
+    assert updates["tree/2/label"] == "2: Tech support"
+    assert not any(k.startswith("tree/1") for k in updates)
+    assert updates["source_session"] == "s2" and "branches/2" in updates
+
+
+def test_added_subtrees_merge_with_ones_added_elsewhere(db):
+    sync_tree(NUMBER, crawled(("root", {"1": "Sales", "2": "Support"})), "s1")
+    base = get_cached_tree(NUMBER)["tree"]
+
+    # Two workers, both starting from the same copy, add menus under root.2
+    first = copy.deepcopy(base)
+    PhoneTree(first).add_options("root.2", {"1": "Billing"})
+    second = copy.deepcopy(base)
+    PhoneTree(second).add_options("root.2", {"2": "Outages"})
+
+    sync_tree(NUMBER, first, "s1", branches=["2"])
+    tree_cache._local[NUMBER] = {**get_cached_tree(NUMBER), "tree": copy.deepcopy(base)}
+    sync_tree(NUMBER, second, "s2", branches=["2"])
+
+    forget_local()
+    stored = get_cached_tree(NUMBER)["tree"]
+    assert set(stored["2"]["children"]) == {"1", "2"}
+    assert stored["1"]["label"] == "1: Sales"
+
+
+def test_branch_sync_keeps_other_branches(db):
+    sync_tree(NUMBER, crawled(("root", {"1": "Sales"}), ("root.1", {"1": "New orders"})), "s1")
+    forget_local()
+    sync_tree(NUMBER, crawled(("root", {"1": "Sales", "3": "Returns"})), "s2", branches=["3"])
+    forget_local()
+    entry = get_cached_tree(NUMBER)
+    assert set(entry["tree"]) == {"1", "3"}
+    assert entry["tree"]["1"]["children"]["1"]["label"] == "1: New orders"
+    assert set(entry["branches"]) == {"1", "3"}
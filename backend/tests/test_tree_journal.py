@@ -0,0 +1,134 @@
+# backend/tests/test_tree_journal.py
+
+import asyncio
+import copy
+import json
+import os
+
+import pytest
+
+import snapshot_store
+import tree as tree_module
+from snapshot_store import SnapshotStore
+from tree import PhoneTree, TreeJournal
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(snapshot_store, "_store", SnapshotStore(str(tmp_path / "snapshots" / "store")))
+    return tmp_path
+
+
+def files(suffix: str) -> list:
+    return sorted(name for name in os.listdir("snapshots") if name.endswith(suffix))
+
+
+def crawl(journal, phone_tree, key, options):
+    phone_tree.add_options(key, options, on_change=journal.on_change)
+
+
+def test_records_are_buffered_until_flushed_then_replayed():
+    journal, phone_tree = TreeJournal("Delta", "s1"), PhoneTree()
+    crawl(journal, phone_tree, "root", {"1": "Reservations", "2": "Baggage"})
+    assert not os.path.exists(journal.journal_path) or os.path.getsize(journal.journal_path) == 0
+
+    journal.flush()
+    assert os.path.getsize(journal.journal_path) > 0
+    assert journal.replay() == phone_tree.to_dict()
+
+
+def test_replay_to_an_earlier_point():
+    journal, phone_tree = TreeJournal("Delta", "s1"), PhoneTree()
+    crawl(journal, phone_tree, "root", {"1": "Reservations"})
+    before, seq = copy.deepcopy(phone_tree.to_dict()), journal.seq
+    crawl(journal, phone_tree, "root.1", {"1": "Change a booking"})
+    assert journal.replay(until_seq=seq) == before
+    assert journal.replay() == phone_tree.to_dict()
+
+
+def test_compaction_checkpoints_and_rotates_the_segment():
+    journal, phone_tree = TreeJournal("Delta", "s1"), PhoneTree()
+    crawl(journal, phone_tree, "root", {"1": "Reservations"})
+    journal.compact(phone_tree.to_dict())
+    assert journal.since_compaction == 0
+    assert journal.journal_path.endswith(f".journal.{journal.checkpoint_seq}.jsonl")
+    with open(f"{journal.base}.snapshot.{journal.checkpoint_seq}.json", encoding="utf-8") as f:
+        assert set(json.load(f)) == {"seq", "ts", "root"}
+
+    crawl(journal, phone_tree, "root.1", {"1": "Change a booking"})
+    journal.flush()
+    assert len(files(".jsonl")) == 2
+    assert TreeJournal("Delta", "s1").replay() == phone_tree.to_dict()
+
+
+def test_records_after_the_checkpoint_go_to_the_next_segment():
+    journal, phone_tree = TreeJournal("Delta", "s1"), PhoneTree()
+    crawl(journal, phone_tree, "root", {"1": "Reservations"})
+    snapshot, seq = copy.deepcopy(phone_tree.to_dict()), journal.seq
+    crawl(journal, phone_tree, "root.1", {"1": "Change a booking"})  # made while the snapshot is written
+    journal.compact(snapshot, seq)
+    journal.flush()
+    assert journal.checkpoint_seq == seq and journal.since_compaction > 0
+    assert journal.replay() == phone_tree.to_dict()
+
+
+def test_new_instance_resumes_the_sequence():
+    journal, phone_tree = TreeJournal("Delta", "s1"), PhoneTree()
+    crawl(journal, phone_tree, "root", {"1": "Reservations", "2": "Baggage"})
+    journal.compact(phone_tree.to_dict())
+    crawl(journal, phone_tree, "root.2", {"1": "Lost bag"})
+    journal.flush()
+    resumed = TreeJournal("Delta", "s1")
+    assert (resumed.seq, resumed.checkpoint_seq) == (journal.seq, journal.checkpoint_seq)
+
+
+def test_old_checkpoints_and_their_segments_are_pruned(monkeypatch):
+    monkeypatch.setattr(tree_module, "TREE_JOURNAL_KEEP_SNAPSHOTS", 2)
+    journal, phone_tree = TreeJournal("Delta", "s1"), PhoneTree()
+    for digit in "1234":
+        crawl(journal, phone_tree, "root", {digit: f"Option {digit}"})
+        journal.compact(phone_tree.to_dict())
+    kept = [seq for seq, _ in journal._checkpoints()]
+    assert len(kept) == 2 and kept[-1] == journal.checkpoint_seq
+    # Only the segment between the two kept checkpoints is left (the newest is still empty)
+    assert [seq for seq, _ in journal._segments()] == [kept[0]]
+    assert journal.replay() == phone_tree.to_dict()
+
+
+def test_save_compacts_when_due(monkeypatch):
+    monkeypatch.setattr(tree_module, "TREE_JOURNAL_COMPACT_EVERY", 3)
+    journal, phone_tree = TreeJournal("Delta", "s1"), PhoneTree()
+
+    async def scenario():
+        crawl(journal, phone_tree, "root", {"1": "Reservations"})
+        await journal.save(phone_tree.to_dict())
+        assert journal.checkpoint_seq == 0 and journal._pending == []
+        crawl(journal, phone_tree, "root", {"2": "Baggage", "3": "Loyalty"})
+        await journal.save(phone_tree.to_dict())
+        assert journal.checkpoint_seq == journal.seq
+    asyncio.run(scenario())
+    assert journal.replay() == phone_tree.to_dict()
+
+
+def test_legacy_journal_with_offset_checkpoints_replays():
+    journal, phone_tree = TreeJournal("Delta", "s1"), PhoneTree()
+    crawl(journal, phone_tree, "root", {"1": "Reservations"})
+    first = [line for _, line in journal._pending]
+    journal._pending = []
+    checkpoint_tree, seq = copy.deepcopy(phone_tree.to_dict()), journal.seq
+    crawl(journal, phone_tree, "root.1", {"1": "Change a booking"})
+    rest = [line for _, line in journal._pending]
+    journal._pending = []
+
+    # The pre-segment layout: one journal file, checkpoints embed the tree and an offset into it
+    with open(journal.legacy_path, "w", encoding="utf-8") as f:
+        f.writelines(first)
+        offset = f.tell()
+        f.writelines(rest)
+    with open(f"{journal.base}.snapshot.{seq}.json", "w", encoding="utf-8") as f:
+        json.dump({"seq": seq, "ts": 0, "offset": offset, "tree": checkpoint_tree}, f)
+
+    legacy = TreeJournal("Delta", "s1")
+    assert legacy.seq == journal.seq
+    assert legacy.replay() == phone_tree.to_dict()
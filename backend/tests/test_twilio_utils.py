@@ -0,0 +1,30 @@
+# backend/tests/test_twilio_utils.py
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+twilio_utils = pytest.importorskip("twilio_utils")
+
+
+class HangingCalls:
+    def __init__(self):
+        self.requests = 0
+
+    async def create_async(self, **params):
+        self.requests += 1
+        await asyncio.Event().wait()
+
+
+def test_create_call_times_out_hung_request(monkeypatch):
+    calls = HangingCalls()
+    monkeypatch.setattr(twilio_utils, "async_twilio_client", lambda: SimpleNamespace(calls=calls))
+    monkeypatch.setattr(twilio_utils, "TWILIO_HTTP_TIMEOUT", 0.05)
+
+    start = time.monotonic()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(twilio_utils.create_call(to="+15550100", from_="+15550199", url="http://x"))
+    assert time.monotonic() - start < 1
+    assert calls.requests == 1  # a timed-out POST may have placed the call: never retried
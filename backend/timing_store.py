@@ -0,0 +1,148 @@
+# backend/timing_store.py
+
+"""
+Learned prompt timing per dialed number and tree node.
+
+Every Whisper pass over a recording made at a known node (the root for
+discovery calls, the node itself for leaf recordings) adds one sample:
+
+    prompt_start   first speech, seconds after the node was reached
+    ready          when the menu / open-ended prompt began (or None)
+    prompt_end     end of the last speech
+    max_gap        longest silence inside the prompt
+
+The last TIMING_MAX_SAMPLES samples are kept under timing/<number>/<node>.
+recommend() turns them into median + spread (robust, MAD-based) and from that
+into tight call parameters, so repeat crawls stop recording 90 s of silence:
+
+    max_length   <Record maxLength>: the whole prompt, with room to spare
+    timeout      <Record timeout>: silence that can't be a pause inside the prompt
+    listen       <Gather timeout>: how long to wait for the prompt to start
+    pause        wait before speaking or pressing digits at this node
+
+With fewer than TIMING_MIN_SAMPLES samples the defaults are returned.
+"""
+
+import os
+import math
+import time
+import logging
+import statistics
+
+from storage import get_storage
+from session_memory import SessionCache
+from tree_cache import normalize_number
+
+
+TIMING_MAX_SAMPLES = int(os.getenv("TIMING_MAX_SAMPLES", "20"))
+TIMING_MIN_SAMPLES = int(os.getenv("TIMING_MIN_SAMPLES", "2"))
+TIMING_SPREAD_K = float(os.getenv("TIMING_SPREAD_K", "2"))    # spreads of headroom on top of the median
+TIMING_MARGIN = float(os.getenv("TIMING_MARGIN", "1.5"))      # seconds, on top of that
+
+DEFAULT_TIMING = {"max_length": 90, "timeout": 5, "listen": 15, "pause": None}
+_BOUNDS = {"max_length": (10, 90), "timeout": (2, 10), "listen": (3, 30), "pause": (1, 60)}
+_FIELDS = ("prompt_start", "ready", "prompt_end", "max_gap")
+
+_local = SessionCache(max_entries=1024, ttl=300, write_back=None)
+
+
+def _node_path(number: str, key: str) -> str:
+    # Storage keys can't contain "." or "#"
+    safe = (key or "root").replace(".", "_").replace("#", "%23")
+    return f"timing/{normalize_number(number)}/{safe}"
+
+
+def sample_from_segments(segments: list, ready=None, offset: float = 0.0) -> dict:
+    """One timing sample from Whisper segments; `offset` is when the node was reached in the recording."""
+    spoken = [s for s in segments or [] if str(s.get("text", "")).strip()]
+    if not spoken:
+        return None
+    gaps = [b["start"] - a["end"] for a, b in zip(spoken, spoken[1:])]
+    return {
+        "prompt_start": round(max(0.0, spoken[0]["start"] - offset), 2),
+        "ready": round(max(0.0, ready - offset), 2) if ready is not None else None,
+        "prompt_end": round(max(0.0, spoken[-1]["end"] - offset), 2),
+        "max_gap": round(max(gaps, default=0.0), 2),
+    }
+
+
+def record_timing(number: str, key: str, sample: dict) -> dict:
+    """Append a sample for a node (keeping the last TIMING_MAX_SAMPLES); returns the stored entry."""
+    if not number or not sample:
+        return None
+    path = _node_path(number, key)
+    now = time.time()
+
+    def append(current):
+        entry = current or {}
+        return {
+            **entry,
+            **{f: ((entry.get(f) or []) + [sample[f]])[-TIMING_MAX_SAMPLES:] for f in _FIELDS if sample.get(f) is not None},
+            "updated_at": now,
+        }
+
+    # Appended to the stored lists, not the local copy: other workers and concurrent
+    # leaves of this one add samples for the same node
+    entry = get_storage().transaction(path, append)
+    _local[path] = entry
+    logging.info(f"[TIMING] {number} {key}: {sample} ({len(entry.get('prompt_end', []))} samples)")
+    return entry
+
+
+def get_node_timing(number: str, key: str):
+    path = _node_path(number, key)
+    entry = _local.get(path)
+    if entry is None:
+        entry = get_storage().get(path)
+        if entry:
+            _local[path] = entry
+    return entry or None
+
+
+def _summary(values: list):
+    """Median and robust spread (1.4826 × median absolute deviation)."""
+    if not values:
+        return None
+    median = statistics.median(values)
+    spread = 1.4826 * statistics.median(abs(v - median) for v in values)
+    return {"median": round(median, 2), "spread": round(spread, 2), "n": len(values)}
+
+
+def _bounded(name: str, value: float):
+    low, high = _BOUNDS[name]
+    return int(min(high, max(low, math.ceil(value))))
+
+
+def summarize(number: str, key: str) -> dict:
+    entry = get_node_timing(number, key) or {}
+    return {f: _summary(entry.get(f) or []) for f in _FIELDS}
+
+
+def recommend(number: str, key: str = "root", defaults: dict = None) -> dict:
+    """Record/Gather/pause parameters for a node, learned from past recordings where possible."""
+    out = {**DEFAULT_TIMING, **(defaults or {}), "learned": False}
+    stats = summarize(number, key) if number else {}
+
+    def upper(field):
+        s = stats.get(field)
+        if not s or s["n"] < TIMING_MIN_SAMPLES:
+            return None
+        return s["median"] + TIMING_SPREAD_K * s["spread"] + TIMING_MARGIN
+
+    for name, field in (("max_length", "prompt_end"), ("timeout", "max_gap"), ("listen", "prompt_start"),
+                        ("pause", "ready")):
+        value = upper(field)
+        if value is not None:
+            out[name] = _bounded(name, value)
+            out["learned"] = True
+    out["samples"] = max((s["n"] for s in stats.values() if s), default=0)
+    return out
+
+
+def learn_from_recording(number: str, key: str, pause_info: dict) -> dict:
+    """Add the sample from a detect_prompt_time() result and return the updated recommendation."""
+    ready = pause_info.get("menu_start")
+    if ready is None:
+        ready = pause_info.get("open_ended_start")
+    record_timing(number, key, sample_from_segments(pause_info.get("segments"), ready))
+    return recommend(number, key)
@@ -1,61 +1,617 @@
 # backend/tree.py
 import os
+import copy
 import json
+import time
+import threading
 from datetime import datetime
 import re
+import hashlib
 from slugify import slugify
 import logging
+from session_memory import SessionCache
+from firebase_client import run_io
+from snapshot_store import get_snapshot_store
+from label_index import label_index
 
 def sanitize_filename(name):
     return re.sub(r'[^a-zA-Z0-9_\-]', '_', name)
 
 def save_tree_snapshot(query: str, session_id: str, tree: dict):
-    os.makedirs("snapshots", exist_ok=True)
+    # Deduplicated against every earlier snapshot; rebuild with get_snapshot_store().load(name)
     slug = slugify(query)
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"snapshots/{slug}_{session_id}_{timestamp}.json"
-    with open(filename, "w", encoding="utf-8") as f:
-        json.dump(tree, f, indent=2)
-    logging.info(f"[SNAPSHOT] Tree saved to {filename}")
-
-
-def update_tree_branch(tree: dict, path: str, options: dict, ivr_type: str = None) -> dict:
-    node = tree
-    parts = path.strip().split(".")
-
-    # Traverse to the parent node
-    for idx, part in enumerate(parts):
-        if idx == 0 and part == "root":
-            continue
-        if "children" not in node:
-            node["children"] = {}
-        node = node["children"]
-        if part not in node:
-            node[part] = {
-                "key": ".".join(parts[:idx+1]),
-                "label": f"{part}: Unknown",
-                "selected": False,
-                "ivr_type": None,
-                "children": {}
-            }
-        node = node[part]
-
-    # Set IVR type metadata if passed
-    if ivr_type:
-        node["ivr_type"] = ivr_type
-
-    # Attach children to this node
-    if "children" not in node:
-        node["children"] = {}
-
-    for opt_key, label in options.items():
-        if opt_key not in node["children"]:
-            node["children"][opt_key] = {
-                "key": f"{node['key']}.{opt_key}",
-                "label": f"{opt_key}: {label}",
-                "selected": False,
-                "ivr_type": None,
-                "children": {}
-            }
+    name = f"{slug}_{session_id}_{timestamp}"
+    manifest = get_snapshot_store().save(name, tree, query=query, session_id=session_id)
+    logging.info(f"[SNAPSHOT] Tree saved as {name} (root {manifest['root']})")
 
+
+# 🌳 Path-indexed phone tree
+#
+# session["tree"] is the nested map the Vue ReconTreeVisualizer renders:
+#     {"1": {"key": "root.1", "label": "1: Billing", "selected": False,
+#            "ivr_type": None, "children": {"2": {"key": "root.1.2", ...}}}}
+# PhoneTree wraps that same dict and keeps a flat key → node index next to it.
+# Both views share the node dicts, so they cannot drift apart, and lookup,
+# insert and relabel by dotted key are O(1) instead of a walk from the root.
+# When the tree knows its (normalized) number, label changes also go to the
+# search index in label_index.py.
+
+ROOT_KEY = "root"
+HASH_FIELD = "hash"  # only in trees written by older versions; stripped on load
+_ROOT_FIELDS = ("key", "label", "selected", "ivr_type", "parse_error", HASH_FIELD)
+
+
+def _node_fields(node: dict) -> dict:
+    return {k: v for k, v in node.items() if k not in ("children", HASH_FIELD)}
+
+
+def make_key(digits) -> str:
+    """['1', '2'] → 'root.1.2'"""
+    return ".".join([ROOT_KEY, *(str(d) for d in digits)])
+
+
+def split_key(key: str) -> list:
+    """'root.1.2' → ['1', '2'] (a leading 'root' is optional)"""
+    parts = [p for p in (key or "").strip().split(".") if p]
+    return parts[1:] if parts and parts[0] == ROOT_KEY else parts
+
+
+def _new_node(key: str, label: str, **fields) -> dict:
+    return {"key": key, "label": label, "selected": False, "ivr_type": None, "children": {}, **fields}
+
+
+class PhoneTree:
+    def __init__(self, nested: dict = None, number: str = None):
+        self.nested = {} if nested is None else nested
+        self.number = number
+        self.root = {"key": ROOT_KEY, "label": ROOT_KEY, "ivr_type": None, "children": self.nested}
+        self._index = {ROOT_KEY: self.root}
+        self._index_subtree(self.root)
+
+    @classmethod
+    def from_dict(cls, data, number: str = None) -> "PhoneTree":
+        """
+        Accept the nested digit → node map, an older root-node shape
+        ({"key": "root", "children": {...}}) or a flat {digit: "label"} menu.
+        """
+        if isinstance(data, cls):
+            return data
+        data = data if data is not None else {}
+        if not isinstance(data.get("children"), dict):
+            return cls(data, number)
+        nested = dict(data["children"])
+        nested.update({k: v for k, v in data.items() if k != "children" and k not in _ROOT_FIELDS})
+        tree = cls(nested, number)
+        if data.get("ivr_type"):
+            tree.root["ivr_type"] = data["ivr_type"]
+        return tree
+
+    def to_dict(self) -> dict:
+        """Nested shape stored in Firebase and rendered by the frontend."""
+        return self.nested
+
+    def _index_subtree(self, node: dict):
+        stack = [node]
+        while stack:
+            parent = stack.pop()
+            children = parent.setdefault("children", {})
+            for digit, child in list(children.items()):
+                key = f"{parent['key']}.{digit}"
+                if not isinstance(child, dict):
+                    # Flat {digit: "label"} entries written by older crawls
+                    child = children[digit] = _new_node(key, f"{digit}: {child}")
+                child.setdefault("key", key)
+                child.setdefault("label", f"{digit}: Unknown")
+                child.pop(HASH_FIELD, None)
+                self._index[child["key"]] = child
+                stack.append(child)
+
+    # ── lookup ────────────────────────────────────────────────────
+
+    def get(self, key: str, default=None):
+        return self._index.get(key or ROOT_KEY, default)
+
+    def __getitem__(self, key: str) -> dict:
+        return self._index[key]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def __len__(self):
+        return len(self._index) - 1
+
+    def keys(self):
+        return self._index.keys()
+
+    def children(self, key: str) -> dict:
+        node = self.get(key)
+        return node["children"] if node else {}
+
+    def _reindex_label(self, key: str, node: dict):
+        if self.number:
+            label_index.add(self.number, key, node.get("label", ""))
+
+    # ── mutation ──────────────────────────────────────────────────
+
+    def insert(self, key: str, label: str = None, on_change=None, **fields) -> dict:
+        """Create the node at `key` (and any missing ancestors) or update it in place."""
+        node = self._index.get(key)
+        if node is None:
+            digits = split_key(key)
+            if not digits:
+                node = self.root
+            else:
+                parent = self._index.get(make_key(digits[:-1])) or self.insert(make_key(digits[:-1]), on_change=on_change)
+                node = _new_node(key, label or f"{digits[-1]}: Unknown", **fields)
+                parent["children"][digits[-1]] = node
+                self._index[key] = node
+                self._reindex_label(key, node)
+                if on_change:
+                    on_change(key, _node_fields(node))
+                return node
+        changes = {k: v for k, v in fields.items() if node.get(k) != v}
+        if label is not None and node.get("label") != label:
+            changes["label"] = label
+        if changes:
+            node.update(changes)
+            if "label" in changes:
+                self._reindex_label(key, node)
+            if on_change:
+                on_change(key, _node_fields(node))
+        return node
+
+    def relabel(self, key: str, label: str, on_change=None) -> dict:
+        node = self._index[key]
+        if node.get("label") != label:
+            node["label"] = label
+            self._reindex_label(key, node)
+            if on_change:
+                on_change(key, _node_fields(node))
+        return node
+
+    def remove(self, key: str, on_change=None):
+        """Drop a node and its subtree; `on_change(key, None)` reports the removal."""
+        digits = split_key(key)
+        node = self._index.get(key)
+        if not digits or node is None:
+            return None
+        self._index[make_key(digits[:-1])]["children"].pop(digits[-1], None)
+        stack = [node]
+        while stack:
+            n = stack.pop()
+            self._index.pop(n["key"], None)
+            if self.number:
+                label_index.remove(self.number, n["key"])
+            stack.extend(n.get("children", {}).values())
+        if on_change:
+            on_change(key, None)
+        return node
+
+    def add_options(self, key: str, options: dict, ivr_type: str = None, on_change=None) -> dict:
+        """Attach a parsed menu ({digit: label}) under `key`; existing children are kept."""
+        node = self.insert(key, on_change=on_change)
+        if ivr_type and node.get("ivr_type") != ivr_type:
+            self.insert(node["key"], ivr_type=ivr_type, on_change=on_change)
+        for digit, label in options.items():
+            child_key = f"{node['key']}.{digit}"
+            if child_key not in self._index:
+                self.insert(child_key, f"{digit}: {label}", on_change=on_change)
+        return node
+
+    def set_options(self, key: str, options: dict, ivr_type: str = None, on_change=None) -> list:
+        """
+        Make the menu under `key` match `options` exactly: add new digits, relabel
+        changed ones and drop digits that are gone. Subtrees of digits that are
+        still offered are kept. Returns the keys that changed (empty = same menu).
+        """
+        changed = []
+
+        def track(k, fields):
+            changed.append(k)
+            if on_change:
+                on_change(k, fields)
+
+        node = self.add_options(key, options, ivr_type=ivr_type, on_change=track)
+        for digit, label in options.items():
+            self.relabel(f"{node['key']}.{digit}", f"{digit}: {label}", on_change=track)
+        for digit in [d for d in node["children"] if d not in options]:
+            self.remove(f"{node['key']}.{digit}", on_change=track)
+        return changed
+
+
+def update_tree_branch(tree, path: str, options: dict, ivr_type: str = None, on_change=None,
+                       number: str = None) -> dict:
+    """
+    Attach menu `options` under the node at dotted `path`, creating missing nodes.
+    `on_change(key, fields)` is called for every node created or modified, which
+    is what the journal records instead of rewriting the whole tree. With
+    `number`, new labels are also added to the label search index.
+    Returns the nested tree (a new dict only if `tree` was in an older shape).
+    """
+    phone_tree = PhoneTree.from_dict(tree, number)
+    phone_tree.add_options(path or ROOT_KEY, options, ivr_type=ivr_type, on_change=on_change)
+    return phone_tree.to_dict()
+
+
+_phone_trees = SessionCache(max_entries=256, write_back=None)
+
+
+def get_phone_tree(session_id: str, session, number: str = None) -> PhoneTree:
+    """
+    Indexed view of session["tree"], kept per session so the index is only
+    rebuilt when the session's tree dict is replaced (e.g. reloaded from storage).
+    """
+    tree = _phone_trees.get(session_id)
+    if tree is None or tree.nested is not session.get("tree"):
+        # Not indexed here: a session's tree may be partial, and the number's full
+        # tree is indexed by tree_cache; nodes this session adds are reported as they land
+        tree = PhoneTree.from_dict(session.get("tree"), number)
+        session["tree"] = tree.to_dict()
+        _phone_trees[session_id] = tree
     return tree
+
+
+
+# 🔐 Merkle hashes per subtree
+#
+# A node's hash covers its own content (label, ivr_type, …) plus its
+# children's hashes. Identical subtrees hash the same wherever they sit, and two
+# trees can be diffed by descending only where hashes differ.
+#
+# Hashes are never stored on the nodes: trees are mutated in many places
+# (PhoneTree, merge_tree, journal replay, handlers), and a cached hash any of
+# them forgot to clear would make diffs and syncs skip real changes. Each
+# diff/merge memoizes hashes for the duration of that one call instead.
+
+_UNHASHED = ("key", "selected", "children", HASH_FIELD)
+
+
+def node_hash(node: dict, memo: dict = None) -> str:
+    """Hash of a node and its subtree. `memo` (id(node) → hash) shares work within one operation."""
+    memo = {} if memo is None else memo
+    cached = memo.get(id(node))
+    if cached:
+        return cached
+    own = {k: v for k, v in node.items() if k not in _UNHASHED}
+    children = sorted((digit, node_hash(child, memo)) for digit, child in (node.get("children") or {}).items())
+    payload = json.dumps([own, children], sort_keys=True, separators=(",", ":"), default=str)
+    memo[id(node)] = digest = hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+    return digest
+
+
+def tree_hash(tree: dict) -> str:
+    """Hash of a whole nested tree. Read-only."""
+    return node_hash({"children": tree or {}})
+
+
+def _without_hashes(node: dict) -> dict:
+    """Copy of a subtree minus any hash fields left by older versions."""
+    out = {k: v for k, v in node.items() if k not in ("children", HASH_FIELD)}
+    if "children" in node:
+        out["children"] = {d: _without_hashes(c) if isinstance(c, dict) else c for d, c in (node["children"] or {}).items()}
+    return out
+
+
+def _storage_path(key: str) -> str:
+    # root.1.2 lives at 1/children/2 inside the stored nested map
+    return "/children/".join(split_key(key))
+
+
+def _walk_diff(old: dict, new: dict, prefix: str, out: list, memo: dict):
+    for digit in sorted(old.keys() | new.keys()):
+        key = f"{prefix}.{digit}"
+        before, after = old.get(digit), new.get(digit)
+        if after is None:
+            out.append(("removed", key, None))
+        elif before is None:
+            out.append(("added", key, after))
+        elif node_hash(before, memo) != node_hash(after, memo):
+            same = _node_fields(before) == _node_fields(after)
+            out.append(("rehashed" if same else "changed", key, after))
+            _walk_diff(before.get("children") or {}, after.get("children") or {}, key, out, memo)
+
+
+def diff_trees(old: dict, new: dict) -> dict:
+    """
+    Keys of subtrees added, removed or changed between two crawls. Subtrees with
+    equal hashes are skipped without being visited, so the cost follows the
+    number of changed nodes rather than the size of the tree.
+    """
+    ops = []
+    _walk_diff(old or {}, new or {}, ROOT_KEY, ops, {})
+    diff = {"added": [], "removed": [], "changed": []}
+    for op, key, _ in ops:
+        if op in diff:
+            diff[op].append(key)
+    return diff
+
+
+def tree_updates(old: dict, new: dict, prefix: str = "", added: dict = None) -> dict:
+    """
+    Multi-path storage update that turns `old` into `new`: added subtrees are
+    written whole, removed ones deleted, and changed nodes only get their own
+    fields rewritten. With `added`, added subtrees are put there (path → subtree)
+    instead, for callers that write them separately.
+    """
+    ops = []
+    _walk_diff(old or {}, new or {}, ROOT_KEY, ops, {})
+    base = f"{prefix}/" if prefix else ""
+    updates = {}
+    for op, key, node in ops:
+        path = base + _storage_path(key)
+        if op == "removed":
+            updates[path] = None
+        elif op == "added":
+            (updates if added is None else added)[path] = _without_hashes(node)
+        else:
+            old_node = _find(old, key)
+            before = _node_fields(old_node)
+            after = _node_fields(node)
+            for field in before.keys() | after.keys():
+                if before.get(field) != after.get(field):
+                    updates[f"{path}/{field}"] = after.get(field)
+            if HASH_FIELD in old_node:
+                updates[f"{path}/{HASH_FIELD}"] = None
+    return updates
+
+
+def _find(tree: dict, key: str):
+    node = {"children": tree}
+    for digit in split_key(key):
+        node = (node.get("children") or {}).get(digit)
+        if node is None:
+            return None
+    return node
+
+
+def _merge_node(base, fresh: dict, memo: dict) -> dict:
+    if base is None:
+        return fresh
+    if node_hash(base, memo) == node_hash(fresh, memo):
+        return base
+    merged = _node_fields(fresh)
+    fresh_children = fresh.get("children") or {}
+    base_children = base.get("children") or {}
+    if not fresh_children:
+        # Not crawled this deep this time; keep what we already knew below it
+        merged["children"] = base_children
+    else:
+        merged["children"] = {d: _merge_node(base_children.get(d), c, memo) for d, c in fresh_children.items()}
+    return merged
+
+
+def merge_subtree(base, fresh: dict) -> dict:
+    """merge_tree for a single node: `fresh` over `base` (which may be None)."""
+    return _merge_node(base, fresh, {})
+
+
+def merge_tree(base: dict, fresh: dict, branches=None) -> dict:
+    """
+    Merge a (partial) re-crawl into a cached tree. Only the top-level
+    `branches` that were re-crawled are taken from `fresh` (all of its branches
+    if None); unchanged subtrees keep the cached objects.
+    """
+    merged, memo = dict(base or {}), {}
+    for digit in (list(fresh) if branches is None else [str(b) for b in branches]):
+        if digit in fresh:
+            merged[digit] = _merge_node(merged.get(digit), fresh[digit], memo)
+        else:
+            merged.pop(digit, None)
+    return merged
+
+
+# 📓 Append-only tree journal
+#
+# Instead of rewriting the full tree on every change, each mutation is appended
+# as one small JSON line:
+#     {"seq": 12, "ts": 1718000000.0, "op": "set", "key": "root.2.1", "fields": {...}}
+# Every TREE_JOURNAL_COMPACT_EVERY records the current tree is checkpointed to
+# {slug}_{session}.snapshot.{seq}.json and the journal rotates to a new segment,
+# {slug}_{session}.journal.{seq}.jsonl, holding only the records after it. Replaying
+# to any point loads the nearest checkpoint and reads its segment; segments older
+# than the TREE_JOURNAL_KEEP_SNAPSHOTS kept checkpoints are deleted with them.
+#
+# Records are buffered in memory as the tree changes and written by save(), which
+# handlers await so file I/O and checkpointing run on the I/O pool, not the loop.
+
+TREE_JOURNAL_COMPACT_EVERY = int(os.getenv("TREE_JOURNAL_COMPACT_EVERY", "200"))
+TREE_JOURNAL_KEEP_SNAPSHOTS = int(os.getenv("TREE_JOURNAL_KEEP_SNAPSHOTS", "5"))
+
+
+def apply_tree_mutation(tree: dict, record: dict) -> dict:
+    """Apply one journal record to a nested tree (the session["tree"] shape)."""
+    digits = split_key(record["key"])
+    if not digits:
+        # Root metadata has no place in the nested map
+        return tree
+
+    children = tree
+    for digit in digits[:-1]:
+        node = children.setdefault(digit, {"children": {}})
+        children = node.setdefault("children", {})
+    if record["op"] == "delete":
+        children.pop(digits[-1], None)
+    else:
+        node = children.setdefault(digits[-1], {"children": {}})
+        node.update(record["fields"])
+    return tree
+
+
+class TreeJournal:
+    def __init__(self, query: str, session_id: str, directory: str = "snapshots"):
+        self.directory = directory
+        self.base = os.path.join(directory, f"{slugify(query)}_{sanitize_filename(session_id)}")
+        # Journals written before segments were introduced: one file, checkpoints hold offsets into it
+        self.legacy_path = f"{self.base}.journal.jsonl"
+        self.journal_path = self._segment_path(0)
+        self.seq = 0
+        self.checkpoint_seq = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._resume()
+
+    @property
+    def since_compaction(self) -> int:
+        return self.seq - self.checkpoint_seq
+
+    def _segment_path(self, seq: int) -> str:
+        return f"{self.base}.journal.{seq}.jsonl"
+
+    def _tail(self, seq: int = None, checkpoint: dict = None):
+        """(journal file, offset) holding the records after a checkpoint, or from the start."""
+        if checkpoint is None:
+            return (self.legacy_path, 0) if os.path.exists(self.legacy_path) else (self._segment_path(0), 0)
+        if "offset" in checkpoint:
+            return self.legacy_path, checkpoint["offset"]
+        return self._segment_path(seq), 0
+
+    @staticmethod
+    def _read(path: str, offset: int = 0):
+        if not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            f.seek(offset)
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def _resume(self):
+        # Pick up the sequence number if this session already has a journal
+        checkpoints = self._checkpoints()
+        if checkpoints:
+            self.seq = self.checkpoint_seq = checkpoints[-1][0]
+            self.journal_path, offset = self._tail(checkpoints[-1][0], self._load_checkpoint(checkpoints[-1][1]))
+        else:
+            self.journal_path, offset = self._tail()
+        for entry in self._read(self.journal_path, offset):
+            self.seq = entry["seq"]
+
+    def _checkpoints(self) -> list:
+        prefix = os.path.basename(self.base) + ".snapshot."
+        found = []
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix) and name.endswith(".json"):
+                seq = name[len(prefix):-len(".json")]
+                if seq.isdigit():
+                    found.append((int(seq), os.path.join(self.directory, name)))
+        return sorted(found)
+
+    def _segments(self) -> list:
+        prefix = os.path.basename(self.base) + ".journal."
+        found = []
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix) and name.endswith(".jsonl"):
+                seq = name[len(prefix):-len(".jsonl")]
+                if seq.isdigit():
+                    found.append((int(seq), os.path.join(self.directory, name)))
+        return sorted(found)
+
+    @staticmethod
+    def _load_checkpoint(path: str) -> dict:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @staticmethod
+    def _checkpoint_tree(checkpoint: dict) -> dict:
+        # Checkpoints written before the snapshot store embed the tree directly
+        if "root" in checkpoint:
+            return get_snapshot_store().get_tree(checkpoint["root"])
+        return checkpoint.get("tree", {})
+
+    def record(self, op: str, key: str, fields: dict = None):
+        self.seq += 1
+        entry = {"seq": self.seq, "ts": time.time(), "op": op, "key": key}
+        if fields is not None:
+            entry["fields"] = fields
+        self._pending.append((self.seq, json.dumps(entry, separators=(",", ":")) + "\n"))
+
+    def on_change(self, key: str, fields: dict):
+        """Callback for PhoneTree / update_tree_branch; fields=None means the node was removed."""
+        if fields is None:
+            self.record("delete", key)
+        else:
+            self.record("set", key, fields)
+
+    def _write_pending(self, upto: int = None):
+        # Called with the lock held; records past `upto` stay buffered for the next segment
+        count = len(self._pending)
+        if upto is not None:
+            count = next((i for i, (seq, _) in enumerate(self._pending) if seq > upto), count)
+        lines = [line for _, line in self._pending[:count]]
+        del self._pending[:count]
+        if lines:
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.writelines(lines)
+
+    def flush(self):
+        """Append buffered records to the current segment (blocking file I/O)."""
+        with self._lock:
+            self._write_pending()
+
+    def compact(self, tree: dict, seq: int = None):
+        """Checkpoint `tree`, the tree as of `seq` (default: now), and start a new journal segment."""
+        with self._lock:
+            seq = self.seq if seq is None else seq
+            self._write_pending(upto=seq)
+            path = f"{self.base}.snapshot.{seq}.json"
+            # The checkpoint itself only holds the root hash; the tree goes to the snapshot store
+            root = get_snapshot_store().put_tree(tree)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"seq": seq, "ts": time.time(), "root": root}, f, separators=(",", ":"))
+            self.checkpoint_seq = seq
+            self.journal_path = self._segment_path(seq)
+            self._prune()
+        logging.info(f"[JOURNAL COMPACT] {path} → {os.path.basename(self.journal_path)}")
+
+    def _prune(self):
+        checkpoints = self._checkpoints()
+        kept = checkpoints[-TREE_JOURNAL_KEEP_SNAPSHOTS:] if TREE_JOURNAL_KEEP_SNAPSHOTS > 0 else checkpoints[-1:]
+        for _, old in checkpoints[:-len(kept)]:
+            os.remove(old)
+        if len(kept) == len(checkpoints):
+            return
+        # History before the oldest kept checkpoint can no longer be replayed
+        oldest = kept[0][0]
+        for seq, segment in self._segments():
+            if seq < oldest:
+                os.remove(segment)
+        if os.path.exists(self.legacy_path) and not any(
+                "offset" in self._load_checkpoint(path) for _, path in kept):
+            os.remove(self.legacy_path)
+
+    async def save(self, tree: dict, force: bool = False):
+        """Write buffered records, checkpointing when due, on the I/O pool."""
+        if force or self.since_compaction >= TREE_JOURNAL_COMPACT_EVERY:
+            # Snapshot on the loop: handlers keep mutating the live tree meanwhile
+            await run_io(self.compact, copy.deepcopy(tree), self.seq)
+        elif self._pending:
+            await run_io(self.flush)
+
+    def replay(self, until_seq: int = None, until_ts: float = None) -> dict:
+        """Rebuild the tree as it was at `until_seq` / `until_ts` (default: latest)."""
+        self.flush()
+        tree, path, offset = {}, *self._tail()
+        for seq, checkpoint_path in reversed(self._checkpoints()):
+            checkpoint = self._load_checkpoint(checkpoint_path)
+            if (until_seq is None or seq <= until_seq) and (until_ts is None or checkpoint["ts"] <= until_ts):
+                tree = self._checkpoint_tree(checkpoint)
+                path, offset = self._tail(seq, checkpoint)
+                break
+        for entry in self._read(path, offset):
+            if (until_seq is not None and entry["seq"] > until_seq) or \
+                    (until_ts is not None and entry["ts"] > until_ts):
+                break
+            apply_tree_mutation(tree, entry)
+        return tree
+
+
+_journals = SessionCache(max_entries=256, write_back=None)
+
+
+def get_tree_journal(query: str, session_id: str) -> TreeJournal:
+    journal = _journals.get(session_id)
+    if journal is None:
+        journal = _journals[session_id] = TreeJournal(query, session_id)
+    return journal
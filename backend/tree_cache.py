@@ -0,0 +1,168 @@
+# backend/tree_cache.py
+
+"""
+Global phone-tree cache keyed by the dialed number.
+
+Once any session maps a number, its tree is stored under trees/<E.164 number>
+with freshness metadata, and every later /start-recon for that number starts
+from it instead of an empty tree. Freshness is tracked per top-level branch so
+revalidation only re-crawls the branches that went stale.
+
+Subtrees are compared by Merkle hash (see tree.node_hash), so sync_tree()
+merges a partial re-crawl into the cached tree and writes only what changed:
+one multi-path update for changed fields, removed nodes and the metadata, plus
+a storage transaction per newly added subtree, scoped to that subtree, so two
+sessions adding the same menu merge instead of overwriting each other.
+store_tree() replaces the whole tree in one transaction on trees/<number>.
+
+    {
+        "number": "+18002211212",
+        "tree": {...},                       # same nested shape as session["tree"]
+        "updated_at": 1718000000.0,
+        "source_session": "<session_id>",
+        "branches": {"1": {"crawled_at": 1718000000.0}, ...}
+    }
+"""
+
+import os
+import re
+import time
+import copy
+import logging
+from storage import get_storage
+from session_memory import SessionCache
+from tree import merge_tree, merge_subtree, tree_updates
+from label_index import label_index
+
+
+TREE_CACHE_MAX_AGE = float(os.getenv("TREE_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+
+# Small local layer so repeat lookups for hot numbers skip storage entirely
+_local = SessionCache(max_entries=256, ttl=300, write_back=None)
+
+
+def normalize_number(number: str) -> str:
+    """'1-800-221-1212', '(800) 221 1212' and '+18002211212' all map to '+18002211212'."""
+    digits = re.sub(r"\D", "", number or "")
+    if len(digits) == 10:
+        digits = "1" + digits
+    return f"+{digits}" if digits else ""
+
+
+def _path(number: str) -> str:
+    return f"trees/{normalize_number(number)}"
+
+
+def get_cached_tree(number: str):
+    """Cache entry for a number, or None if it has never been mapped."""
+    key = normalize_number(number)
+    if not key:
+        return None
+    entry = _local.get(key)
+    if entry is None:
+        entry = get_storage().get(_path(key))
+        if entry:
+            _local[key] = entry
+    return entry or None
+
+
+def _fresh_branches(entry: dict, digits, now: float) -> dict:
+    return {**(entry.get("branches") or {}), **{str(d): {"crawled_at": now} for d in digits}}
+
+
+def store_tree(number: str, tree: dict, session_id: str = None, branches=None):
+    """
+    Save a (partially) crawled tree for a number.
+    `branches` lists the top-level digits that were just crawled; they get a fresh
+    timestamp. Leave it out to mark every top-level branch in `tree` as fresh.
+    """
+    key = normalize_number(number)
+    if not key or not tree:
+        return None
+    now = time.time()
+    fresh = list(tree.keys()) if branches is None else branches
+
+    def replace(current):
+        entry = {**(current or {"number": key}), "tree": copy.deepcopy(tree), "updated_at": now}
+        if session_id:
+            entry["source_session"] = session_id
+        entry["branches"] = _fresh_branches(entry, fresh, now)
+        return entry
+
+    # A transaction keeps other branch metadata written concurrently by other sessions
+    entry = get_storage().transaction(_path(key), replace)
+    _local[key] = entry
+    label_index.index_tree(key, entry["tree"])
+    logging.info(f"[TREE CACHE] Stored {key} ({len(tree)} top-level branches, fresh: {fresh})")
+    return entry
+
+
+def _place(tree: dict, path: str, subtree: dict):
+    # path is a tree_updates path ("tree/1/children/2"); the parent exists in `tree`
+    digits = path.split("/")[1::2]
+    children = tree
+    for digit in digits[:-1]:
+        children = children[digit].setdefault("children", {})
+    children[digits[-1]] = subtree
+
+
+def sync_tree(number: str, tree: dict, session_id: str = None, branches=None):
+    """
+    Merge a session's tree into the cached one and write only the difference.
+    With `branches`, only those top-level digits are taken from `tree`; the rest
+    of the cached tree (possibly refreshed by another session) is left alone.
+
+    The diff is taken against this worker's copy of the cached tree. Changed
+    fields and removed nodes are written as a multi-path update, and each
+    added subtree is merged in a transaction on its own path, so nodes other
+    sessions added meanwhile are kept rather than overwritten.
+    """
+    key = normalize_number(number)
+    if not key or not tree:
+        return None
+    storage = get_storage()
+    now = time.time()
+    fresh = list(tree.keys()) if branches is None else [str(d) for d in branches]
+
+    current = get_cached_tree(key) or {"number": key}
+    old = current.get("tree") or {}
+    merged = copy.deepcopy(merge_tree(old, tree, branches))
+    added = {}
+    updates = tree_updates(old, merged, prefix="tree", added=added)
+    written = len(updates)
+    for path, subtree in added.items():
+        # The node may have been added by another session since our copy was read
+        stored = storage.transaction(f"{_path(key)}/{path}", lambda base, subtree=subtree: merge_subtree(base, subtree))
+        _place(merged, path, stored)
+
+    entry = {**current, "number": key, "tree": merged, "updated_at": now}
+    entry["branches"] = _fresh_branches(entry, fresh, now)
+    updates.update({"number": key, "updated_at": now})
+    updates.update({f"branches/{digit}": entry["branches"][digit] for digit in fresh})
+    if session_id:
+        entry["source_session"] = updates["source_session"] = session_id
+    storage.update(_path(key), updates)
+
+    _local[key] = entry
+    # The merged tree is the number's full tree, so it can replace the number's index entries
+    label_index.index_tree(key, entry["tree"])
+    logging.info(
+        f"[TREE CACHE] Synced {key}: {len(added)} subtrees added, {written} changed/removed paths"
+    )
+    return entry
+
+
+def stale_branches(entry: dict, max_age: float = TREE_CACHE_MAX_AGE) -> list:
+    """Top-level digits whose last crawl is older than max_age (or never recorded)."""
+    if not entry:
+        return []
+    cutoff = time.time() - max_age
+    branches = entry.get("branches", {})
+    return sorted(
+        digit for digit in entry.get("tree", {})
+        if branches.get(digit, {}).get("crawled_at", 0) < cutoff
+    )
+
+
+def is_fresh(entry: dict, max_age: float = TREE_CACHE_MAX_AGE) -> bool:
+    return bool(entry) and not stale_branches(entry, max_age)
@@ -6,13 +6,29 @@ import urllib.parse
 from fastapi import Request
 from fastapi.responses import Response
 from twilio.rest import Client
+from twilio.base.exceptions import TwilioRestException
+from twilio.http.async_http_client import AsyncTwilioHttpClient
 from audio_utils import detect_prompt_time
-from firebase_client import update_session_status
+from firebase_client import update_session_status_async
 from session_memory import session_store
 import time
 from pydub.utils import mediainfo
-from firebase_client import get_session_status
-from session_memory import session_store  # 👈 create this shared memory
+from firebase_client import get_session_status, get_session_status_async, run_io
+from session_memory import session_store, session_lock  # 👈 create this shared memory
+from blob_store import put_blob, summarize_segments
+from session_model import Segments
+from log_utils import Summary
+from routing import shard_params
+from tree import make_key, split_key
+from tree_cache import normalize_number
+from call_scheduler import call_scheduler, DialError
+from fair_queue import whisper_queue, gpt_queue
+from timing_store import learn_from_recording
+from public_url import public_url, public_base_url, refresh_public_url
+from functools import partial
+import asyncio
+import random
+import aiohttp
 from fastapi import APIRouter
 import os
 
@@ -30,31 +46,95 @@ from dotenv import load_dotenv
 load_dotenv()
 
 openai_api_key = os.getenv("OPENAI_API_KEY")
-twilio_client = Client(os.getenv("TWILIO_SID"), os.getenv("TWILIO_AUTH_TOKEN"))
 FROM_NUMBER = os.getenv("TWILIO_FROM_NUMBER")
+CALL_SUBMIT_WAIT = float(os.getenv("CALL_SUBMIT_WAIT", "20"))  # how long an API request waits for a queued call
+TWILIO_CREATE_RETRIES = int(os.getenv("TWILIO_CREATE_RETRIES", "3"))
+TWILIO_RETRY_BACKOFF = float(os.getenv("TWILIO_RETRY_BACKOFF", "0.5"))  # seconds, doubled per attempt
+TWILIO_HTTP_TIMEOUT = float(os.getenv("TWILIO_HTTP_TIMEOUT", "15"))
 
 # Needed for Whisper if used
 os.environ["PATH"] += r";C:\ffmpeg\bin"
 
 
-def get_ngrok_url():
-    try:
-        res = requests.get("http://127.0.0.1:4040/api/tunnels")
-        public_url = res.json()["tunnels"][0]["public_url"]
-        return public_url
-    except Exception as e:
-        logging.error(f"[NGROK ERROR] {e}")
-        return None
+def callback_query(session_id: str, **extra) -> str:
+    """Query string for a callback URL, carrying the session's owning-worker shard token."""
+    params = {"session_id": session_id, **shard_params(session_id)}
+    params.update({k: v for k, v in extra.items() if v is not None})
+    return urllib.parse.urlencode(params)
+
+
+# 📞 Call creation: one pooled aiohttp session for every Calls API request, so
+# bursts of branch dials don't hold the event loop (or a thread) per HTTPS round trip
+_async_twilio = None
+
+
+def async_twilio_client() -> Client:
+    global _async_twilio
+    if _async_twilio is None:
+        _async_twilio = Client(
+            os.getenv("TWILIO_SID"), os.getenv("TWILIO_AUTH_TOKEN"),
+            http_client=AsyncTwilioHttpClient(pool_connections=True),
+        )
+    return _async_twilio
+
+
+async def close_twilio_client():
+    global _async_twilio
+    if _async_twilio is not None:
+        await _async_twilio.http_client.close()
+        _async_twilio = None
+
 
+def _retryable(e: Exception) -> bool:
+    # POST /Calls isn't idempotent: only retry when Twilio certainly didn't create the call.
+    # 429/503 are refusals; a failed connect never sent the request. A read timeout or a
+    # 500 may come after the call was placed, and a retry would dial the number twice.
+    if isinstance(e, TwilioRestException):
+        return e.status in (429, 503)
+    return isinstance(e, aiohttp.ClientConnectorError)
 
-def initiate_twilio_call(to_number: str = None, session_id: str = "", say_query: bool = False, branch_digit: str = None):
-    ngrok_url = get_ngrok_url()
-    if not ngrok_url:
-        raise RuntimeError("Ngrok URL could not be retrieved")
 
-    session = session_store.get(session_id)
+async def create_call(**params):
+    """calls.create on the pooled async client, retrying refusals (429/503) and failed connects with backoff."""
+    for attempt in range(TWILIO_CREATE_RETRIES + 1):
+        try:
+            # The client's own timeout never reaches aiohttp (create_async passes timeout=None
+            # per request), so bound each request here or a hung one holds its dial slot forever.
+            # A timeout isn't retried: the call may already have been placed.
+            return await asyncio.wait_for(async_twilio_client().calls.create_async(**params), TWILIO_HTTP_TIMEOUT)
+        except Exception as e:
+            if attempt >= TWILIO_CREATE_RETRIES or not _retryable(e):
+                raise
+            delay = TWILIO_RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5)
+            logging.warning(f"[TWILIO RETRY] {params.get('to')}: {e} — retry {attempt + 1}/{TWILIO_CREATE_RETRIES} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+async def initiate_twilio_call(to_number: str = None, session_id: str = "", say_query: bool = False, branch_digit: str = None, digit: str = None,
+                               send_digits: str = None, target_key: str = None, digit_path=None,
+                               navigate: bool = False):
+    """
+    Place a crawl call for a session. With `send_digits` (a DTMF route from
+    dial_planner, "w" = half-second wait) the call plays the route as soon as it
+    connects and records only the destination, skipping discovery.
+    With `digit_path` ("root.2.3.1", "2.3.1" or ["2", "3", "1"]) the call replays
+    the whole path with the pauses learned for each level and records only the
+    node it lands on, so exploring a deep node costs no more than a shallow one.
+    With `navigate` it listens there instead and keeps walking the tree in-call
+    (call_navigator).
+    """
+    branch_key = None
+    if digit_path:
+        branch_key = make_key(split_key(digit_path) if isinstance(digit_path, str) else digit_path)
+    if not public_base_url():
+        # Startup couldn't resolve it (tunnel not up yet); try once more off the loop
+        await run_io(refresh_public_url)
+
+    # Fall back to shared storage: the session may have been created by another worker
+    session = session_store.get(session_id) or await get_session_status_async(session_id)
     if not session:
         raise RuntimeError(f"No session found for ID {session_id}")
+    session_store[session_id] = session
 
     if not to_number:
         to_number = session.get("resolved_number")
@@ -62,33 +142,46 @@ def initiate_twilio_call(to_number: str = None, session_id: str = "", say_query:
             raise RuntimeError("No destination phone number provided or found in session")
 
     # Build URL with query parameters
-    params = {"session_id": session_id}
-    if say_query:
-        params["say_query"] = "true"
-    if branch_digit:
-        params["branch_digit"] = branch_digit
-    full_url = f"{ngrok_url}/twilio/crawler-entry?{urllib.parse.urlencode(params)}"
+    full_url = public_url("/twilio/crawler-entry", callback_query(
+        session_id,
+        say_query="true" if say_query else None,
+        digit=digit,
+        branch_digit=branch_digit,
+        play_digits=send_digits,
+        target=target_key,
+        branch=branch_key,
+        nav="1" if branch_key and navigate else None,
+    ))
 
     # Construct callbacks
-    recording_callback = f"{ngrok_url}/twilio/recording-status?session_id={session_id}"
-    status_callback = f"{ngrok_url}/twilio/status-callback?session_id={session_id}"
+    # Only plain discovery calls record the root menu untouched; their timings train timing_store
+    plain = not (say_query or digit or branch_digit or send_digits or target_key)
+    recording_callback = public_url("/twilio/recording-status", callback_query(session_id, timing="root" if plain else None))
+    # Branch calls run alongside the session's own call; tag them so they don't claim its SID
+    status_callback = public_url("/twilio/status-callback", callback_query(session_id, branch=branch_key or branch_digit))
 
     logging.info(f"[INITIATE CALL] SID: {session_id} | to={to_number} | say_query={say_query} | URL: {full_url}")
 
+    # Path calls skip the whole-call recording: its Whisper pass would overwrite
+    # the session's discovery timing, and the route itself is already known
+    recording = {} if branch_key else {
+        "record": True,
+        "recording_channels": "mono",
+        "recording_status_callback": recording_callback,
+        "recording_status_callback_method": "POST",
+        "recording_status_callback_event": ["completed"],
+    }
+
     try:
-        call = twilio_client.calls.create(
+        call = await create_call(
             to=to_number,
             from_=FROM_NUMBER,
             url=full_url,
             method="POST",
-            record=True,
-            recording_channels="mono",
-            recording_status_callback=recording_callback,
-            recording_status_callback_method="POST",
-            recording_status_callback_event=["completed"],
             status_callback=status_callback,
             status_callback_method="POST",
-            status_callback_event=["initiated", "ringing", "answered", "completed"]
+            status_callback_event=["initiated", "ringing", "answered", "completed"],
+            **recording
         )
         logging.info(f"[TWILIO CALL CREATED] Call SID: {call.sid}")
         return call.sid
@@ -98,58 +191,118 @@ def initiate_twilio_call(to_number: str = None, session_id: str = "", say_query:
 
 
 
-# FastAPI route for recording status
+def _fetch_mp3(recording_url: str, local_path: str):
+    r = requests.get(
+        recording_url + ".mp3",
+        auth=(os.getenv("TWILIO_ACCOUNT_SID"), os.getenv("TWILIO_AUTH_TOKEN"))
+    )
+    with open(local_path, "wb") as f:
+        f.write(r.content)
 
-@router.post("/twilio/recording-status")
-async def recording_status_callback(request: Request):
-    form = await request.form()
-    recording_url = form.get("RecordingUrl")
-    call_sid = form.get("CallSid")
-    session_id = request.query_params.get("session_id")
-    if not session_id:
-        logging.error("[RECORDING CALLBACK] Missing session_id in callback URL")
-        return Response(status_code=400)
 
-    logging.info(f"[RECORDING COMPLETED] CallSid={call_sid} | URL={recording_url}")
+def _mp3_ready(local_path: str) -> bool:
+    if os.path.exists(local_path) and os.path.getsize(local_path) > 10000:
+        try:
+            info = mediainfo(local_path)
+            if "duration" in info:
+                logging.info(f"[MP3 READY] Valid MP3 file confirmed: {info['duration']}s")
+                return True
+        except Exception as err:
+            logging.warning(f"[MP3 VALIDATION FAIL] {err}")
+    return False
+
 
-    # Step 1: Delay to give Twilio time to finalize the recording
-    import time
-    time.sleep(10)  # Give Twilio a head start before MP3 fetch
+async def download_recording(recording_url: str, call_sid: str, delay: float = 10):
+    """Fetch a Twilio recording as MP3 into recordings/; returns the local path or None."""
+    # Step 1: Delay to give Twilio time to finalize the recording (waits on the loop,
+    # not on an I/O thread: only the download and the file check use the pool)
+    await asyncio.sleep(delay)
 
     # Step 2: Download the audio file
     local_path = f"recordings/{call_sid}.mp3"
     os.makedirs("recordings", exist_ok=True)
     try:
-        r = requests.get(
-            recording_url + ".mp3",
-            auth=(os.getenv("TWILIO_ACCOUNT_SID"), os.getenv("TWILIO_AUTH_TOKEN"))
-        )
-        with open(local_path, "wb") as f:
-            f.write(r.content)
+        await run_io(_fetch_mp3, recording_url, local_path)
     except Exception as e:
         logging.error(f"[RECORDING DOWNLOAD FAIL] {e}")
-        return Response(status_code=204)
+        return None
 
     # Step 3: Ensure file is ready before running Whisper
     for attempt in range(5):
         try:
-            if os.path.exists(local_path) and os.path.getsize(local_path) > 10000:
-                try:
-                    info = mediainfo(local_path)
-                    if "duration" in info:
-                        logging.info(f"[MP3 READY] Valid MP3 file confirmed: {info['duration']}s")
-                        break
-                except Exception as err:
-                    logging.warning(f"[MP3 VALIDATION FAIL] {err}")
+            if await run_io(_mp3_ready, local_path):
+                break
             logging.info(f"[MP3 CHECK] Not valid yet. Retrying... ({attempt+1}/5)")
-            time.sleep(2)
         except Exception as e:
             logging.warning(f"[MP3 CHECK ERROR] {e}")
-            time.sleep(2)
+        await asyncio.sleep(2)
+
+    return local_path
+
+
+_dial_callbacks = set()
+
+
+def _after_dial(on_dialed, dialed):
+    if dialed.cancelled() or dialed.exception() is not None or not dialed.result():
+        return
+    task = asyncio.ensure_future(on_dialed(dialed.result()))
+    _dial_callbacks.add(task)
+    task.add_done_callback(_dial_callbacks.discard)
+
+
+async def schedule_call(session_id: str, to_number: str = None, lane: str = None, priority: int = 1,
+                        label: str = None, wait: float = CALL_SUBMIT_WAIT, on_dialed=None, **call_args):
+    """
+    Place an initiate_twilio_call through the call scheduler. Returns the call SID,
+    or None if it is still queued after `wait` seconds (it stays queued); raises
+    DialError if Twilio didn't accept the call within that time.
+    Webhook handlers pass wait=0: they must answer Twilio right away.
+    `async on_dialed(call_sid)` runs once the call is placed, however long it queued.
+    """
+    number = to_number or (session_store.get(session_id) or {}).get("resolved_number")
+    job = await call_scheduler.submit(
+        session_id, normalize_number(number),
+        lambda: initiate_twilio_call(to_number=to_number, session_id=session_id, **call_args),
+        lane=lane, priority=priority, label=label,
+    )
+    if on_dialed:
+        job.dialed.add_done_callback(partial(_after_dial, on_dialed))
+    if job.dialed.done() or wait <= 0:
+        return job.dialed.result() if job.dialed.done() else None
+    try:
+        return await asyncio.wait_for(asyncio.shield(job.dialed), wait)
+    except asyncio.TimeoutError:
+        logging.info(f"[CALL QUEUED] {label} for {session_id} still waiting for a slot")
+        return None
+
+
+# FastAPI route for recording status
+
+@router.post("/twilio/recording-status")
+async def recording_status_callback(request: Request):
+    form = await request.form()
+    recording_url = form.get("RecordingUrl")
+    call_sid = form.get("CallSid")
+    session_id = request.query_params.get("session_id")
+    if not session_id:
+        logging.error("[RECORDING CALLBACK] Missing session_id in callback URL")
+        return Response(status_code=400)
+
+    logging.info(f"[RECORDING COMPLETED] CallSid={call_sid} | URL={recording_url}")
+
+    # Steps 1-3: download once Twilio has finalized the recording
+    local_path = await download_recording(recording_url, call_sid)
+    if not local_path:
+        return Response(status_code=204)
+
+    # Whisper and GPT capacity is shared fairly between users
+    session = session_store.get(session_id) or await get_session_status_async(session_id) or {}
+    user_id = session.get("user_id")
 
     # Step 4: Analyze with Whisper
     try:
-        pause_info = detect_prompt_time(local_path)
+        pause_info = await whisper_queue.run(user_id, detect_prompt_time, local_path)
         full_transcript = " ".join(seg["text"] for seg in pause_info.get("segments", []))
         ivr_type = None
 
@@ -162,45 +315,63 @@ async def recording_status_callback(request: Request):
             logging.info("[WHISPER DETECTED] Open-ended prompt")
         else:
             from ivr_utils import classify_ivr_type
-            session = session_store.get(session_id) or get_session_status(session_id)
             user_query = session.get("query", "")
-            ivr_type = classify_ivr_type(full_transcript, user_query)
+            ivr_type = await gpt_queue.run(user_id, classify_ivr_type, full_transcript, user_query)
             logging.info(f"[GPT FALLBACK] Classified as: {ivr_type}")
 
     except Exception as e:
         logging.error(f"[WHISPER ERROR] {e}")
         return Response(status_code=500)
 
-    # Step 6: Save session updates to Firebase
-    session = session_store.get(session_id) or get_session_status(session_id)
-    session["calculated_pause"] = pause_info["calculated_pause"]
-    session["timing_debug"] = {
-        "open_ended_start": pause_info["open_ended_start"],
-        "menu_start": pause_info["menu_start"],
-        "calculated_pause": pause_info["calculated_pause"]
-    }
-    session["whisper_segments"] = pause_info["segments"]
-    session["whisper_finished"] = True
-    session["recording_ready"] = True
-    session["ivr_type"] = ivr_type
-    update_session_status(session_id, session)
-
-    # Step 7: Retry say_query if it was waiting for Whisper to finish
-    if session.get("query_pending"):
-        logging.info(f"[RESUME INJECTION] Whisper done. Retrying say_query for {session_id}")
-        try:
-            initiate_twilio_call(
-                to_number=session.get("resolved_number"),
-                session_id=session_id,
-                say_query=True
-            )
-            session["query_spoken"] = True
-            session["query_pending"] = False
-            update_session_status(session_id, session)
-        except Exception as e:
-            logging.error(f"[RETRY INJECTION FAIL] {e}")
-
-    logging.info(f"[WHISPER TIMING] Pause: {pause_info['calculated_pause']}s — Full: {pause_info}")
+    pause = pause_info["calculated_pause"]
+    if request.query_params.get("timing") == "root":
+        learned = await run_io(learn_from_recording, session.get("resolved_number"), "root", pause_info)
+        if learned["learned"] and learned["pause"]:
+            # Median over past crawls of this number instead of just the latest recording
+            pause = learned["pause"]
+
+    # Step 6: Save session updates to Firebase (serialized with other callbacks for this session)
+    async with session_lock(session_id):
+        session = session_store.get(session_id) or await get_session_status_async(session_id)
+        session_store[session_id] = session
+        # Full segments (tokens, word timings) go to the blob store as parallel arrays;
+        # the session keeps a summary + ref
+        segments = Segments.from_whisper(pause_info["segments"])
+        segments_ref = await run_io(put_blob, session_id, call_sid, "whisper_segments", segments.to_dict())
+        updates = {
+            "calculated_pause": pause,
+            "timing_debug": {
+                "open_ended_start": pause_info["open_ended_start"],
+                "menu_start": pause_info["menu_start"],
+                "calculated_pause": pause_info["calculated_pause"],
+                "learned_pause": pause,
+            },
+            "whisper_segments_ref": segments_ref,
+            "whisper_summary": summarize_segments(segments),
+            "whisper_segments": None,
+            "whisper_finished": True,
+            "recording_ready": True,
+            "ivr_type": ivr_type,
+        }
+        # Only write the fields this callback owns so concurrent callbacks don't overwrite each other
+        session.update(updates)
+        session.pop("whisper_segments", None)
+        await update_session_status_async(session_id, updates)
+
+        # Step 7: Retry say_query if it was waiting for Whisper to finish
+        if session.get("query_pending"):
+            logging.info(f"[RESUME INJECTION] Whisper done. Retrying say_query for {session_id}")
+            try:
+                await schedule_call(
+                    session_id, session.get("resolved_number"), label="say_query", wait=0, say_query=True
+                )
+                session["query_spoken"] = True
+                session["query_pending"] = False
+                await update_session_status_async(session_id, {"query_spoken": True, "query_pending": False})
+            except Exception as e:
+                logging.error(f"[RETRY INJECTION FAIL] {e}")
+
+    logging.info("[WHISPER TIMING] Pause: %ss (this call: %ss) — Full: %s", pause, pause_info["calculated_pause"], Summary(pause_info))
     return Response(status_code=204)
 
 